@@ -0,0 +1,89 @@
+"""Scaling and equivalence check of `processing.branch_group_label` on synthetic trees.
+
+Run from the repository root with `python -m benchmarks.bench_branch_groups`.
+The previous per-component implementation is run alongside and the labels are
+required to match exactly on trees small enough for it to finish.
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from tourguide.tourguide_lib import processing
+
+from .synthetic import random_meshwork
+
+
+def _branch_group_label_reference(nrn, cp_max_thresh=200_000):
+    "Per-component implementation used before the grouped reduction"
+    sk = nrn.skeleton
+    cps = sk.cover_paths
+    cp_lens = [sk.path_length(cp) for cp in cps]
+    cp_ends = np.array([cp[-1] for cp in cps])
+
+    cp_df = pd.DataFrame({"cps": cps, "pathlen": cp_lens, "ends": cp_ends})
+    cp_df["root_parent"] = sk.parent_nodes(cp_df["ends"])
+
+    clip = cp_df["pathlen"] > cp_max_thresh
+    clip_points = cp_df[clip].query("root_parent != -1")["ends"]
+    extra_clip_points = sk.child_nodes(sk.root)
+    all_clip_pts = np.unique(np.concatenate([clip_points, extra_clip_points]))
+
+    _, lbls = sparse.csgraph.connected_components(sk.cut_graph(all_clip_pts))
+    min_dist_label = [np.min(sk.distance_to_root[lbls == l]) for l in np.unique(lbls)]
+    labels_ordered = np.unique(lbls)[np.argsort(min_dist_label)]
+    return np.argsort(labels_ordered)[lbls]
+
+
+def _timed(func, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = func(*args, **kwargs)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--branchiness", type=float, default=0.05)
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=20_000,
+        help="Cover path length above which a branch group is split off, in nm",
+    )
+    parser.add_argument(
+        "--reference-max",
+        type=int,
+        default=100_000,
+        help="Largest tree to run the reference implementation on",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'n_vertices':>12} {'n_groups':>10} {'new (s)':>10} {'reference (s)':>14}")
+    for n in args.sizes:
+        nrn = random_meshwork(n, branchiness=args.branchiness, seed=args.seed)
+        # Cover paths are cached on the skeleton, so compute them outside the timings.
+        nrn.skeleton.cover_paths
+        lbls, t_new = _timed(
+            processing.branch_group_label, nrn, cp_max_thresh=args.threshold
+        )
+        if n <= args.reference_max:
+            lbls_ref, t_ref = _timed(
+                _branch_group_label_reference, nrn, cp_max_thresh=args.threshold
+            )
+            if not np.array_equal(lbls, lbls_ref):
+                raise AssertionError(f"Branch group labels differ for n={n}")
+            ref_str = f"{t_ref:14.3f}"
+        else:
+            ref_str = f"{'skipped':>14}"
+        print(f"{n:>12} {lbls.max() + 1:>10} {t_new:10.3f} {ref_str}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Scaling of `processing.num_branch_points` on synthetic trees.
+
+Run from the repository root with `python -m benchmarks.bench_branch_points`.
+The previous per-branch-point implementation is timed alongside for comparison
+on trees small enough for it to finish.
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from tourguide.tourguide_lib import processing
+
+from .synthetic import random_meshwork
+
+
+def _num_branch_points_reference(nrn):
+    "Downstream-set implementation used before the single-pass version"
+    n_bp = np.zeros(len(nrn.skeleton.vertices), dtype=int)
+    bp = nrn.skeleton.branch_points
+    for bp, ds_list in zip(bp, nrn.skeleton.downstream_nodes(bp)):
+        n_bp[ds_list] = n_bp[ds_list] + 1
+    return n_bp
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument("--branchiness", type=float, default=0.05)
+    parser.add_argument(
+        "--reference-max",
+        type=int,
+        default=20_000,
+        help="Largest tree to run the reference implementation on",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{'n_vertices':>12} {'n_branch':>10} {'new (s)':>10} {'reference (s)':>14}")
+    for n in args.sizes:
+        nrn = random_meshwork(n, branchiness=args.branchiness, seed=args.seed)
+        n_bp, t_new = _timed(processing.num_branch_points, nrn)
+        if n <= args.reference_max:
+            n_bp_ref, t_ref = _timed(_num_branch_points_reference, nrn)
+            if not np.array_equal(n_bp, n_bp_ref):
+                raise AssertionError(f"Branch point counts differ for n={n}")
+            ref_str = f"{t_ref:14.3f}"
+        else:
+            ref_str = f"{'skipped':>14}"
+        print(f"{n:>12} {len(nrn.skeleton.branch_points):>10} {t_new:10.3f} {ref_str}")
+
+
+if __name__ == "__main__":
+    main()
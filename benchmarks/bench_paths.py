@@ -0,0 +1,134 @@
+"""Scaling of the cover path segments built by `processing.process_paths`.
+
+Run from the repository root with `python -m benchmarks.bench_paths`.
+Trees are sized so their skeletons have roughly the requested number of cover
+paths. The previous per-path loop with NaN separators and `dropna` is timed
+alongside and checked for equal output. Peak memory is measured with tracemalloc,
+which tracks NumPy and pandas allocations.
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from tourguide.tourguide_lib import processing
+
+from .synthetic import random_meshwork
+
+
+def _interpolate_path_reference(path, sk, step_size):
+    "Per-path interpolation used before the vectorized version"
+    path = path[::-1]
+    if step_size is None:
+        return sk.vertices[path]
+    ds = sk.distance_to_root[path]
+    ds_interp = np.linspace(
+        ds[0], ds[-1], np.round((ds[-1] - ds[0]) / step_size).astype(int)
+    )
+    xs = np.interp(ds_interp, ds, sk.vertices[path, 0])
+    ys = np.interp(ds_interp, ds, sk.vertices[path, 1])
+    zs = np.interp(ds_interp, ds, sk.vertices[path, 2])
+    return np.vstack([xs, ys, zs]).T
+
+
+def _path_df_reference(sk, paths, step_size=None, min_path_length=0):
+    path_length = np.array(sk.path_length(paths))
+    if step_size:
+        pieces = [
+            [_interpolate_path_reference(path, sk, step_size), np.full((1, 3), np.nan)]
+            for path, pl in zip(paths, path_length)
+            if pl > min_path_length
+        ]
+    else:
+        pieces = [
+            [sk.vertices[path], np.full((1, 3), np.nan)]
+            for path, pl in zip(paths, path_length)
+            if pl > min_path_length
+        ]
+    interp_paths = np.vstack([x for piece in pieces for x in piece])
+    return pd.DataFrame(
+        np.concatenate([interp_paths[:-1], interp_paths[1:]], axis=1),
+        columns=processing.PATH_VERTEX_COLUMNS,
+    ).dropna(axis=0)
+
+
+def _path_df(sk, paths, step_size=None, min_path_length=0):
+    points, offsets = processing._cover_path_points(
+        sk, paths, step_size=step_size, min_path_length=min_path_length
+    )
+    return pd.DataFrame(
+        processing._path_segments(points, offsets),
+        columns=processing.PATH_VERTEX_COLUMNS,
+    )
+
+
+def _measured(func, *args, **kwargs):
+    "Output, run time and peak traced memory in MB of a function call"
+    tracemalloc.start()
+    t0 = time.perf_counter()
+    out = func(*args, **kwargs)
+    elapsed = time.perf_counter() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return out, elapsed, peak / 1024**2
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--paths", type=int, nargs="+", default=[1_000, 10_000, 100_000]
+    )
+    parser.add_argument(
+        "--branchiness",
+        type=float,
+        default=0.1,
+        help="Branch probability per vertex, which sets vertices per path",
+    )
+    parser.add_argument(
+        "--step-size", type=float, default=2_000, help="Interpolation step in nm"
+    )
+    parser.add_argument(
+        "--reference-max",
+        type=int,
+        default=10_000,
+        help="Largest number of paths to run the reference implementation on",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(
+        f"{'n_paths':>10} {'step (nm)':>10} {'n_segments':>10} {'new (s)':>10} "
+        f"{'new (MB)':>10} {'reference (s)':>14} {'reference (MB)':>15}"
+    )
+    for n_paths in args.paths:
+        n_vertices = int(n_paths / args.branchiness)
+        nrn = random_meshwork(n_vertices, branchiness=args.branchiness, seed=args.seed)
+        sk = nrn.skeleton
+        paths = sk.cover_paths_with_parent()
+        for step_size in [None, args.step_size]:
+            path_df, t_new, mem_new = _measured(
+                _path_df, sk, paths, step_size=step_size
+            )
+            if len(paths) <= args.reference_max:
+                path_df_ref, t_ref, mem_ref = _measured(
+                    _path_df_reference, sk, paths, step_size=step_size
+                )
+                if not np.allclose(path_df.values, path_df_ref.values):
+                    raise AssertionError(
+                        f"Path segments differ for {len(paths)} paths, step {step_size}"
+                    )
+                ref_str = f"{t_ref:14.3f} {mem_ref:15.1f}"
+            else:
+                ref_str = f"{'skipped':>14} {'skipped':>15}"
+            step_str = "none" if step_size is None else f"{step_size:g}"
+            print(
+                f"{len(paths):>10} {step_str:>10} {len(path_df):>10} "
+                f"{t_new:10.3f} {mem_new:10.1f} {ref_str}"
+            )
+
+
+if __name__ == "__main__":
+    main()
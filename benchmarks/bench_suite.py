@@ -0,0 +1,204 @@
+"""Wall time and peak memory of the main `processing` functions on synthetic neurons.
+
+Run from the repository root with `python -m benchmarks.bench_suite`.
+Each case is timed on fresh inputs as the best of `--repeat` runs, and its peak
+memory is measured with tracemalloc in one extra run, since tracing slows NumPy
+code down. Results are printed as a table and can be written to a JSON baseline
+with `--output`. With `--compare`, each case is checked against a previous
+baseline, and the exit code is nonzero if any case got slower than `--tolerance`.
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+from tourguide.tourguide_lib import processing
+
+from .synthetic import SYNTHETIC_ROOT_ID, random_meshwork
+
+STEP_SIZE_UM = 2
+
+
+def _fresh_table(vertex_table: processing.VertexTable) -> processing.VertexTable:
+    "Copy of a vertex table that does not share memoized values with the original"
+    return processing.VertexTable.from_bytes(vertex_table.to_bytes(compress=False))
+
+
+def _cases(nrn, vertex_table) -> dict:
+    """Benchmark cases as name -> function returning a no-argument callable.
+
+    Setup, such as copying inputs so skeleton and memo caches start empty, runs
+    outside the timed callable.
+    """
+    base_row = len(vertex_table) // 2
+    base_lvl2_id = int(vertex_table.lvl2_ids[vertex_table.lvl2_offsets[base_row]])
+    max_distance = float(np.median(vertex_table[processing.DISTANCE_COLUMN]))
+
+    def meshwork_case(func):
+        def setup():
+            nrn_copy = copy.deepcopy(nrn)
+            return lambda: func(nrn_copy)
+
+        return setup
+
+    def table_case(func, **kwargs):
+        def setup():
+            vt = _fresh_table(vertex_table)
+            return lambda: func(vertex_table=vt, **kwargs)
+
+        return setup
+
+    def filter_dataframe(vertex_table):
+        return processing.filter_dataframe(
+            SYNTHETIC_ROOT_ID,
+            vertex_table,
+            compartment_filter="axon",
+            max_distance_to_root=max_distance,
+        )
+
+    def process_paths(vertex_table, step_size):
+        return processing.process_paths(
+            SYNTHETIC_ROOT_ID,
+            vertex_table,
+            compartment_filter="dendrite",
+            step_size=step_size,
+        )
+
+    return {
+        "process_meshwork_to_dataframe": meshwork_case(
+            processing.process_meshwork_to_dataframe
+        ),
+        "process_meshwork_to_vertex_table": meshwork_case(
+            processing.process_meshwork_to_vertex_table
+        ),
+        "filter_dataframe": table_case(filter_dataframe),
+        "add_downstream_column": table_case(
+            processing.add_downstream_column, base_lvl2_id=base_lvl2_id
+        ),
+        "process_paths": table_case(process_paths, step_size=None),
+        "process_paths_smoothed": table_case(process_paths, step_size=STEP_SIZE_UM),
+    }
+
+
+def _run(setup, repeat: int) -> tuple:
+    "Best wall time in seconds over `repeat` runs and peak traced memory in MB"
+    times = []
+    for _ in range(repeat):
+        func = setup()
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    func = setup()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak / 1024**2
+
+
+def _metadata(args: argparse.Namespace) -> dict:
+    return {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "branchiness": args.branchiness,
+        "axon_fraction": args.axon_fraction,
+        "seed": args.seed,
+        "repeat": args.repeat,
+    }
+
+
+def _compare(results: list, baseline_path: str, tolerance: float) -> list:
+    "Names of cases that are slower than the baseline by more than `tolerance`"
+    with open(baseline_path) as f:
+        baseline = {(r["case"], r["n_vertices"]): r for r in json.load(f)["results"]}
+    regressions = []
+    print(f"\nCompared to {baseline_path}:")
+    for r in results:
+        old = baseline.get((r["case"], r["n_vertices"]))
+        if old is None:
+            continue
+        ratio = r["seconds"] / old["seconds"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            regressions.append(f"{r['case']}@{r['n_vertices']}")
+            flag = "  SLOWER"
+        print(
+            f"{r['case']:>34} {r['n_vertices']:>9} {ratio:8.2f}x time "
+            f"{r['peak_mb'] / max(old['peak_mb'], 1e-6):8.2f}x memory{flag}"
+        )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[1_000, 10_000, 100_000],
+        help="Numbers of vertices. Sizes of 1000000 take tens of minutes",
+    )
+    parser.add_argument("--branchiness", type=float, default=0.05)
+    parser.add_argument("--axon-fraction", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--cases", nargs="+", default=None, help="Only run the named cases"
+    )
+    parser.add_argument("--output", help="Write results to this JSON file")
+    parser.add_argument("--compare", help="Compare results to this JSON baseline")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed fractional slowdown relative to the baseline",
+    )
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'case':>34} {'n_vertices':>10} {'time (s)':>10} {'peak (MB)':>10}")
+    for n in args.sizes:
+        nrn = random_meshwork(
+            n,
+            branchiness=args.branchiness,
+            axon_fraction=args.axon_fraction,
+            seed=args.seed,
+        )
+        vertex_table = processing.process_meshwork_to_vertex_table(copy.deepcopy(nrn))
+        for name, setup in _cases(nrn, vertex_table).items():
+            if args.cases is not None and name not in args.cases:
+                continue
+            seconds, peak_mb = _run(setup, args.repeat)
+            results.append(
+                {
+                    "case": name,
+                    "n_vertices": n,
+                    "seconds": round(seconds, 6),
+                    "peak_mb": round(peak_mb, 3),
+                }
+            )
+            print(f"{name:>34} {n:>10} {seconds:10.4f} {peak_mb:10.1f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"metadata": _metadata(args), "results": results}, f, indent=2)
+            f.write("\n")
+    if args.compare:
+        regressions = _compare(results, args.compare, args.tolerance)
+        if regressions:
+            print(f"Slower than baseline: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
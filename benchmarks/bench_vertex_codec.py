@@ -0,0 +1,96 @@
+"""Size and speed of vertex table payloads for JSON transport.
+
+Run from the repository root with `python -m benchmarks.bench_vertex_codec`.
+Compares base64 npz payloads from `VertexTable.to_bytes`, with and without
+compression, to the records JSON that the app used to keep in dcc.Store, and checks
+that each round-trips the vertex dataframe.
+"""
+
+import argparse
+import base64
+import json
+import time
+
+import pandas as pd
+
+from tourguide.tourguide_lib import processing
+from tourguide.tourguide_lib.vertex_table import VERTEX_INDEX_NAME, VertexTable
+
+from .synthetic import random_meshwork
+
+
+def _records_encode(vertex_table):
+    "Records JSON with level 2 id lists as comma-separated strings, as the app used"
+    df = vertex_table.to_dataframe().reset_index()
+    df[processing.LVL2_ID_COLUMN] = (
+        df[processing.LVL2_ID_COLUMN].apply(lambda x: str(x)[1:-1]).astype(str)
+    )
+    return json.dumps(df.to_dict("records"))
+
+
+def _records_decode(payload):
+    df = pd.DataFrame(json.loads(payload))
+    df[processing.LVL2_ID_COLUMN] = (
+        df[processing.LVL2_ID_COLUMN]
+        .apply(lambda x: [int(y) for y in x.split(",")])
+        .astype(object)
+    )
+    return df.set_index(VERTEX_INDEX_NAME)
+
+
+def _npz_encode(vertex_table, compress):
+    data = vertex_table.to_bytes(compress=compress)
+    return json.dumps(base64.b64encode(data).decode("ascii"))
+
+
+def _npz_decode(payload):
+    return VertexTable.from_bytes(base64.b64decode(json.loads(payload))).to_dataframe()
+
+
+def _timed(func, *args):
+    t0 = time.perf_counter()
+    out = func(*args)
+    return out, time.perf_counter() - t0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 300_000]
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    codecs = {
+        "records json": (_records_encode, _records_decode),
+        "npz": (lambda vt: _npz_encode(vt, compress=False), _npz_decode),
+        "npz zlib": (lambda vt: _npz_encode(vt, compress=True), _npz_decode),
+    }
+    print(
+        f"{'n_vertices':>12} {'codec':>14} {'size (MB)':>10} "
+        f"{'encode (s)':>11} {'decode (s)':>11}"
+    )
+    for n in args.sizes:
+        vertex_table = processing.process_meshwork_to_vertex_table(
+            random_meshwork(n, seed=args.seed)
+        )
+        vertex_table = processing.process_new_points(vertex_table, [])
+        expected = vertex_table.to_dataframe()
+        for name, (encode, decode) in codecs.items():
+            payload, t_encode = _timed(encode, vertex_table)
+            df, t_decode = _timed(decode, payload)
+            if name == "records json":
+                # Records JSON does not keep dtypes or list element types
+                pd.testing.assert_frame_equal(
+                    df, expected, check_dtype=False, check_index_type=False
+                )
+            else:
+                pd.testing.assert_frame_equal(df, expected)
+            print(
+                f"{n:>12} {name:>14} {len(payload) / 1024**2:10.2f} "
+                f"{t_encode:11.3f} {t_decode:11.3f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,517 @@
+"""Local stand-in for the CAVE services that TourGuide calls, for offline end-to-end tests.
+
+Serves synthetic responses for the info service, chunkedgraph, skeleton service,
+L2 cache table mapping and the neuroglancer state link shortener, with a
+configurable delay before every response. Any root id is accepted. Root ids ending
+in an even digit are current, and the odd root id just below each one is its only
+past version. Both versions share a random skeleton seeded by the current root id.
+When `root_id // 2` is even, the current version had a small subtree split off.
+Otherwise the current version gained that subtree, which the time restriction
+shows as new. As in the PyChunkedGraph, the edit also gives the vertex at the
+edit site new level 2 ids, so neither version's level 2 ids are a subset of the
+other's.
+
+Run from the repository root with
+
+    python -m benchmarks.cave_standin --port 8900 --latency-ms 50
+
+and point TourGuide at it with
+
+    export TOURGUIDE_SERVER_ADDRESS=http://localhost:8900
+    export TOURGUIDE_NEUROGLANCER_URL=http://localhost:8900/viewer
+    export TOURGUIDE_USE_LOCAL_TOKEN=true
+    AUTH_DISABLED=true python run.py
+
+With `TOURGUIDE_USE_LOCAL_TOKEN=true`, clients use the locally configured CAVE token
+instead of the placeholder token that disabled auth gives requests. The stand-in
+accepts any hexadecimal token. `make_client` and `make_global_client` accept an
+`http://` server address, so scripts can also use the stand-in directly.
+
+Recorded responses from a real deployment can be served in place of the synthetic
+ones with `--recordings`, a JSON file mapping "METHOD /path" to the response body.
+Request counts per endpoint are available at `/standin/stats`.
+"""
+
+import argparse
+import datetime
+import functools
+import gzip
+import json
+import random
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+import flask
+import numpy as np
+
+from .synthetic import _subtree_sizes, random_skeleton_dict
+
+DEFAULT_DATASTACK = "synthetic"
+TABLE_ID = "synthetic_pcg"
+N_LAYERS = 12
+LAYER_BITS = 8
+EDIT_FRACTION = 0.05
+# Level 2 ids created by the edit are numbered from here within a neuron's id range
+EDIT_LVL2_START = 1 << 23
+
+# Root ids of current versions are created a day ago, past versions a month ago
+CURRENT_AGE = datetime.timedelta(days=1)
+PAST_AGE = datetime.timedelta(days=30)
+
+SERVICE_VERSIONS = {
+    "info": "4.5.0",
+    "segmentation": "2.20.0",
+    "skeletoncache": "0.21.0",
+    "nglstate": "1.0.0",
+}
+
+
+def _lvl2_offset(root_id: int) -> int:
+    "First level 2 id of a synthetic neuron, encoded as a layer 2 node id"
+    return (2 << (64 - LAYER_BITS)) + ((root_id & 0xFFFFFF) << 24)
+
+
+def _is_current(root_id: int) -> bool:
+    return root_id % 2 == 0
+
+
+def _current_root(root_id: int) -> int:
+    return root_id if _is_current(root_id) else root_id + 1
+
+
+def _is_trimmed(root_id: int) -> bool:
+    "Whether a root id is the version of its lineage without the edited subtree"
+    is_split = (_current_root(root_id) // 2) % 2 == 0
+    return _is_current(root_id) == is_split
+
+
+class SyntheticNeurons:
+    """Random skeletons for any root id, generated on first use.
+
+    Parameters
+    ----------
+    n_vertices : int
+        Number of vertices of the larger version of each neuron.
+    branchiness : float
+        Probability that a vertex starts a new branch.
+    axon_fraction : float
+        Approximate fraction of vertices labeled as axon.
+    """
+
+    def __init__(self, n_vertices: int, branchiness: float, axon_fraction: float):
+        self.n_vertices = n_vertices
+        self.branchiness = branchiness
+        self.axon_fraction = axon_fraction
+        self.created = datetime.datetime.now(datetime.timezone.utc)
+
+    @functools.lru_cache(maxsize=256)
+    def _full_skeleton(self, root_id: int) -> dict:
+        return random_skeleton_dict(
+            self.n_vertices,
+            branchiness=self.branchiness,
+            axon_fraction=self.axon_fraction,
+            seed=root_id % 2**32,
+            lvl2_offset=_lvl2_offset(root_id),
+        )
+
+    @functools.lru_cache(maxsize=256)
+    def _edit_site(self, root_id: int) -> tuple:
+        "Vertices of the full skeleton outside the edited subtree, and the vertex it was cut from"
+        sk = self._full_skeleton(root_id)
+        parent = np.full(len(sk["vertices"]), -1)
+        parent[sk["edges"][:, 0]] = sk["edges"][:, 1]
+        sizes = _subtree_sizes(parent)
+        base = 1 + np.argmin(np.abs(sizes[1:] - EDIT_FRACTION * len(parent)))
+        # Parents come before children, so a forward pass marks the subtree.
+        removed = np.zeros(len(parent), dtype=bool)
+        removed[base] = True
+        for v in range(base + 1, len(parent)):
+            removed[v] = removed[parent[v]]
+        return ~removed, int(parent[base])
+
+    def skeleton(self, root_id: int) -> dict:
+        "Skeleton service dictionary for a root id"
+        current_root = _current_root(root_id)
+        sk = self._full_skeleton(current_root)
+        if not _is_trimmed(root_id):
+            return sk
+        keep, cut_vertex = self._edit_site(current_root)
+        new_index = np.cumsum(keep) - 1
+        edges = sk["edges"][keep[sk["edges"][:, 0]]]
+        keep_lvl2 = keep[sk["mesh_to_skel_map"]]
+        lvl2_ids = sk["lvl2_ids"][keep_lvl2]
+        at_edit = sk["mesh_to_skel_map"][keep_lvl2] == cut_vertex
+        lvl2_ids[at_edit] = (
+            _lvl2_offset(current_root) + EDIT_LVL2_START + np.arange(at_edit.sum())
+        )
+        return {
+            "vertices": sk["vertices"][keep],
+            "edges": new_index[edges],
+            "root": sk["root"],
+            "mesh_to_skel_map": new_index[sk["mesh_to_skel_map"][keep_lvl2]],
+            "lvl2_ids": lvl2_ids,
+            "radius": sk["radius"][keep],
+            "compartment": sk["compartment"][keep],
+            "meta": sk["meta"],
+        }
+
+    def leaves(self, root_id: int) -> np.ndarray:
+        return self.skeleton(root_id)["lvl2_ids"]
+
+    def timestamp(self, root_id: int) -> datetime.datetime:
+        return self.created - (CURRENT_AGE if _is_current(root_id) else PAST_AGE)
+
+    def lineage(self, root_id: int) -> tuple:
+        "(past root, current root) of the lineage of a root id"
+        current = _current_root(root_id)
+        return current - 1, current
+
+
+class LatencyModel:
+    """Delay before each response, by service.
+
+    Parameters
+    ----------
+    latency_ms : float
+        Default delay in milliseconds.
+    jitter_ms : float
+        Each delay is drawn uniformly from `latency +/- jitter`.
+    service_latency_ms : dict, optional
+        Delay for specific services, by the first part of the URL path, such as
+        "segmentation" or "skeletoncache".
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        service_latency_ms: Optional[dict] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.service_latency_ms = service_latency_ms or {}
+
+    def delay_s(self, service: str) -> float:
+        latency = self.service_latency_ms.get(service, self.latency_ms)
+        return max(0, latency + random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+
+def _ids_from_body(key: str) -> list:
+    body = json.loads(flask.request.get_data() or b"{}")
+    return [int(x) for x in np.atleast_1d(body.get(key, []))]
+
+
+def create_standin_app(
+    neurons: SyntheticNeurons,
+    latency: LatencyModel,
+    datastack_name: str = DEFAULT_DATASTACK,
+    recordings: Optional[dict] = None,
+) -> flask.Flask:
+    "Flask app serving the stand-in CAVE endpoints"
+    app = flask.Flask("cave_standin")
+    recordings = recordings or {}
+    request_counts = Counter()
+    counts_lock = threading.Lock()
+    states = {}
+    states_lock = threading.Lock()
+
+    def datastack_info():
+        server = flask.request.host_url.rstrip("/")
+        return {
+            "name": datastack_name,
+            "local_server": server,
+            "segmentation_source": f"graphene://{server}/segmentation/table/{TABLE_ID}",
+            "skeleton_source": f"precomputed://{server}/skeletoncache/api/v1/{datastack_name}/precomputed/skeleton",
+            # No version.json is served here, which CAVEclient treats as empty info
+            "viewer_site": f"{server}/viewer",
+            "viewer_resolution_x": 4.0,
+            "viewer_resolution_y": 4.0,
+            "viewer_resolution_z": 40.0,
+            "synapse_table": None,
+            "soma_table": None,
+            "analysis_database": None,
+            "aligned_volume": {
+                "name": f"{datastack_name}_volume",
+                "id": 1,
+                "image_source": f"precomputed://{server}/image",
+                "description": "Synthetic image volume",
+            },
+        }
+
+    @app.before_request
+    def before_request():
+        rule = flask.request.url_rule.rule if flask.request.url_rule else "unmatched"
+        with counts_lock:
+            request_counts[f"{flask.request.method} {rule}"] += 1
+        service = flask.request.path.strip("/").split("/")[0]
+        if service != "standin":
+            time.sleep(latency.delay_s(service))
+        recorded = recordings.get(f"{flask.request.method} {flask.request.path}")
+        if recorded is not None:
+            return flask.jsonify(recorded)
+
+    @app.route("/standin/stats")
+    def stats():
+        with counts_lock:
+            return dict(request_counts)
+
+    # Versions of each service, used by CAVEclient to pick API endpoints
+    @app.route("/info/version")
+    def info_version():
+        return flask.jsonify(SERVICE_VERSIONS["info"])
+
+    @app.route("/segmentation/api/version")
+    def segmentation_version():
+        return flask.jsonify(SERVICE_VERSIONS["segmentation"])
+
+    @app.route("/segmentation/api/versions")
+    def segmentation_api_versions():
+        return flask.jsonify([1])
+
+    @app.route("/skeletoncache/api/version")
+    def skeleton_version():
+        return flask.jsonify(SERVICE_VERSIONS["skeletoncache"])
+
+    @app.route("/skeletoncache/api/versions")
+    def skeleton_versions():
+        # Both the API version and the skeleton versions
+        return flask.jsonify([1, 2, 3, 4])
+
+    @app.route("/nglstate/api/v1/version")
+    def nglstate_version():
+        return flask.jsonify(SERVICE_VERSIONS["nglstate"])
+
+    # Info service
+    @app.route("/info/api/v2/datastacks")
+    def datastacks():
+        return flask.jsonify([datastack_name])
+
+    @app.route("/info/api/v2/datastack/full/<name>")
+    def full_datastack_info(name):
+        if name != datastack_name:
+            flask.abort(404)
+        return datastack_info()
+
+    @app.route("/info/api/v2/datastack/<name>/image_sources")
+    def image_sources(name):
+        return flask.jsonify([datastack_info()["aligned_volume"]])
+
+    @app.route("/image/info")
+    def image_info():
+        return {
+            "data_type": "uint8",
+            "num_channels": 1,
+            "type": "image",
+            "scales": [
+                {
+                    "chunk_sizes": [[64, 64, 64]],
+                    "encoding": "raw",
+                    "key": "8_8_40",
+                    "resolution": [8, 8, 40],
+                    "size": [262144, 262144, 8192],
+                    "voxel_offset": [0, 0, 0],
+                }
+            ],
+        }
+
+    # Chunkedgraph
+    @app.route(f"/segmentation/table/{TABLE_ID}/info")
+    def segmentation_info():
+        server = flask.request.host_url.rstrip("/")
+        return {
+            "app": {"supported_api_versions": [0, 1]},
+            "chunks_start_at_voxel_offset": True,
+            "data_dir": "",
+            "data_type": "uint64",
+            "graph": {
+                "bounding_box": [2048, 2048, 512],
+                "chunk_size": [256, 256, 512],
+                "cv_mip": 0,
+                "n_bits_for_layer_id": LAYER_BITS,
+                "n_layers": N_LAYERS,
+                "spatial_bit_masks": {str(i): 10 for i in range(1, N_LAYERS + 1)},
+            },
+            "mesh": "graphene_meshes",
+            "num_channels": 1,
+            "scales": [
+                {
+                    "chunk_sizes": [[256, 256, 32]],
+                    "compressed_segmentation_block_size": [8, 8, 8],
+                    "encoding": "compressed_segmentation",
+                    "key": "8_8_40",
+                    "locked": True,
+                    "resolution": [8, 8, 40],
+                    "size": [262144, 262144, 8192],
+                    "voxel_offset": [0, 0, 0],
+                }
+            ],
+            "type": "segmentation",
+            "verify": False,
+            "url": f"{server}/segmentation/table/{TABLE_ID}",
+        }
+
+    @app.route(f"/segmentation/api/v1/table/{TABLE_ID}/node/<int:root_id>/leaves")
+    def leaves(root_id):
+        return {"leaf_ids": neurons.leaves(root_id).tolist()}
+
+    @app.route(
+        f"/segmentation/api/v1/table/{TABLE_ID}/root_timestamps", methods=["POST"]
+    )
+    def root_timestamps():
+        return {
+            "timestamp": [
+                neurons.timestamp(r).timestamp() for r in _ids_from_body("node_ids")
+            ]
+        }
+
+    @app.route(
+        f"/segmentation/api/v1/table/{TABLE_ID}/is_latest_roots", methods=["POST"]
+    )
+    def is_latest_roots():
+        return {"is_latest": [_is_current(r) for r in _ids_from_body("node_ids")]}
+
+    @app.route(f"/segmentation/api/v1/table/{TABLE_ID}/valid_nodes")
+    def valid_nodes():
+        return {"valid_roots": _ids_from_body("node_ids")}
+
+    @app.route(f"/segmentation/api/v1/table/{TABLE_ID}/past_id_mapping")
+    def past_id_mapping():
+        timestamp_past = flask.request.args.get("timestamp_past", type=float)
+        past_id_map = {}
+        for root_id in _ids_from_body("root_ids"):
+            past, current = neurons.lineage(root_id)
+            if root_id == current and (
+                timestamp_past is None
+                or timestamp_past < neurons.timestamp(current).timestamp()
+            ):
+                past_id_map[str(root_id)] = [past]
+            else:
+                past_id_map[str(root_id)] = [root_id]
+        return {"past_id_map": past_id_map, "future_id_map": {}}
+
+    @app.route(
+        f"/segmentation/api/v1/table/{TABLE_ID}/lineage_graph_multiple",
+        methods=["POST"],
+    )
+    def lineage_graph():
+        nodes, links = {}, []
+        for root_id in _ids_from_body("root_ids"):
+            past, current = neurons.lineage(root_id)
+            for node in (past, current):
+                nodes[node] = {
+                    "id": node,
+                    "timestamp": neurons.timestamp(node).timestamp(),
+                    "operation_id": 1,
+                }
+            links.append({"source": past, "target": current})
+        return {
+            "directed": True,
+            "multigraph": False,
+            "graph": {},
+            "nodes": list(nodes.values()),
+            "links": links,
+        }
+
+    @app.route(
+        f"/segmentation/api/v1/table/{TABLE_ID}/minimal_covering_nodes",
+        methods=["POST"],
+    )
+    def minimal_covering_nodes():
+        # Level 2 ids cover themselves, which is enough for a segmentation layer
+        node_ids = np.unique(np.array(_ids_from_body("node_ids"), dtype=np.uint64))
+        return flask.Response(node_ids.tobytes(), mimetype="application/octet-stream")
+
+    # L2 cache
+    @app.route("/l2cache/api/v1/table_mapping")
+    def l2cache_table_mapping():
+        return {TABLE_ID: f"{TABLE_ID}_l2"}
+
+    # Skeleton service
+    @app.route(
+        "/skeletoncache/api/v1/<name>/async/get_skeleton/<int:skeleton_version>/<int:root_id>/flatdict"
+    )
+    def skeleton(name, skeleton_version, root_id):
+        sk = {
+            k: v.tolist() if isinstance(v, np.ndarray) else v
+            for k, v in neurons.skeleton(root_id).items()
+        }
+        return flask.Response(
+            gzip.compress(json.dumps(sk).encode()),
+            mimetype="application/octet-stream",
+        )
+
+    # Neuroglancer state link shortener
+    @app.route("/nglstate/api/v1/post", methods=["POST"])
+    def upload_state():
+        with states_lock:
+            state_id = len(states) + 1
+            states[state_id] = flask.request.get_data()
+        return flask.jsonify(
+            f"{flask.request.host_url.rstrip('/')}/nglstate/api/v1/{state_id}"
+        )
+
+    @app.route("/nglstate/api/v1/<int:state_id>")
+    def get_state(state_id):
+        with states_lock:
+            state = states.get(state_id)
+        if state is None:
+            flask.abort(404)
+        return flask.Response(state, mimetype="application/json")
+
+    return app
+
+
+def _parse_service_latency(values: list) -> dict:
+    latencies = {}
+    for value in values:
+        service, _, ms = value.partition("=")
+        latencies[service] = float(ms)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--datastack", default=DEFAULT_DATASTACK)
+    parser.add_argument("--n-vertices", type=int, default=10_000)
+    parser.add_argument("--branchiness", type=float, default=0.05)
+    parser.add_argument("--axon-fraction", type=float, default=0.3)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument(
+        "--service-latency-ms",
+        nargs="+",
+        default=[],
+        metavar="SERVICE=MS",
+        help="Latency for specific services, e.g. segmentation=80 skeletoncache=500",
+    )
+    parser.add_argument(
+        "--recordings",
+        help='JSON file mapping "METHOD /path" to a recorded response body',
+    )
+    args = parser.parse_args()
+
+    recordings = None
+    if args.recordings:
+        with open(args.recordings) as f:
+            recordings = json.load(f)
+    app = create_standin_app(
+        SyntheticNeurons(args.n_vertices, args.branchiness, args.axon_fraction),
+        LatencyModel(
+            args.latency_ms,
+            args.jitter_ms,
+            _parse_service_latency(args.service_latency_ms),
+        ),
+        datastack_name=args.datastack,
+        recordings=recordings,
+    )
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
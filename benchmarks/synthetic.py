@@ -0,0 +1,168 @@
+from typing import Optional
+
+import numpy as np
+from meshparty import meshwork
+from pcg_skel.service import rebuild_meshwork
+
+AXON_COMPARTMENT = 2
+DENDRITE_COMPARTMENT = 3
+SOMA_COMPARTMENT = 1
+
+SYNTHETIC_ROOT_ID = 864691135000000000
+SYNTHETIC_LVL2_OFFSET = 160000000000000000
+
+
+def random_parents(
+    n_vertices: int,
+    branchiness: float = 0.05,
+    rng: Optional[np.random.Generator] = None,
+) -> np.ndarray:
+    """Random tree as a parent array where every parent index is smaller than its child.
+
+    With probability `1 - branchiness` a vertex continues the previous vertex, otherwise
+    it starts a new branch from a uniformly chosen earlier vertex.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    idx = np.arange(n_vertices)
+    parent = idx - 1
+    new_branch = rng.random(n_vertices) < branchiness
+    new_branch[:2] = False
+    parent[new_branch] = np.floor(
+        rng.random(new_branch.sum()) * idx[new_branch]
+    ).astype(int)
+    parent[0] = -1
+    return parent
+
+
+def _subtree_sizes(parent: np.ndarray) -> np.ndarray:
+    sizes = np.ones(len(parent), dtype=int)
+    parent_list = parent.tolist()
+    size_list = sizes.tolist()
+    for v in range(len(parent) - 1, 0, -1):
+        size_list[parent_list[v]] += size_list[v]
+    return np.array(size_list)
+
+
+def _axon_mask(parent: np.ndarray, axon_fraction: float) -> np.ndarray:
+    "Mark the subtree whose size is closest to the requested fraction as axon"
+    is_axon = np.zeros(len(parent), dtype=bool)
+    if axon_fraction <= 0 or len(parent) < 2:
+        return is_axon
+    sizes = _subtree_sizes(parent)
+    axon_base = 1 + np.argmin(np.abs(sizes[1:] - axon_fraction * len(parent)))
+    # Parents precede children, so a forward pass propagates the label downstream.
+    is_axon[axon_base] = True
+    parent_list = parent.tolist()
+    axon_list = is_axon.tolist()
+    for v in range(axon_base + 1, len(parent)):
+        if axon_list[parent_list[v]]:
+            axon_list[v] = True
+    return np.array(axon_list)
+
+
+def random_skeleton_dict(
+    n_vertices: int,
+    branchiness: float = 0.05,
+    axon_fraction: float = 0.3,
+    max_lvl2_per_vertex: int = 3,
+    step_nm: float = 500,
+    seed: Optional[int] = None,
+    lvl2_offset: int = SYNTHETIC_LVL2_OFFSET,
+) -> dict:
+    """Random skeleton in the dictionary format returned by the skeleton service.
+
+    Parameters
+    ----------
+    n_vertices : int
+        Number of skeleton vertices.
+    branchiness : float, optional
+        Probability that a vertex starts a new branch, by default 0.05.
+    axon_fraction : float, optional
+        Approximate fraction of vertices labeled as axon, by default 0.3.
+    max_lvl2_per_vertex : int, optional
+        Each skeleton vertex gets between 1 and this many level 2 ids, by default 3.
+    step_nm : float, optional
+        Typical edge length in nanometers, by default 500.
+    seed : int, optional
+        Random seed.
+    lvl2_offset : int, optional
+        First level 2 id. Level 2 ids are consecutive from here.
+
+    Returns
+    -------
+    dict
+        Skeleton with "vertices", "edges", "root", "mesh_to_skel_map", "lvl2_ids",
+        "radius", "compartment" and "meta". Vertex parents always come before
+        their children.
+    """
+    rng = np.random.default_rng(seed)
+    parent = random_parents(n_vertices, branchiness=branchiness, rng=rng)
+
+    steps = rng.normal(scale=step_nm, size=(n_vertices, 3))
+    steps[0] = [100_000, 100_000, 100_000]
+    parent_list = parent.tolist()
+    cols = []
+    for col in steps.T.tolist():
+        for v in range(1, n_vertices):
+            col[v] += col[parent_list[v]]
+        cols.append(col)
+    verts = np.array(cols).T
+
+    edges = np.vstack([np.arange(1, n_vertices), parent[1:]]).T
+
+    compartments = np.full(n_vertices, DENDRITE_COMPARTMENT)
+    compartments[_axon_mask(parent, axon_fraction)] = AXON_COMPARTMENT
+    compartments[0] = SOMA_COMPARTMENT
+
+    n_l2 = rng.integers(1, max_lvl2_per_vertex + 1, size=n_vertices)
+    mesh_to_skel_map = rng.permutation(np.repeat(np.arange(n_vertices), n_l2))
+    lvl2_ids = lvl2_offset + np.arange(len(mesh_to_skel_map))
+
+    return {
+        "vertices": verts,
+        "edges": edges,
+        "root": 0,
+        "mesh_to_skel_map": mesh_to_skel_map,
+        "lvl2_ids": lvl2_ids,
+        "radius": np.full(n_vertices, step_nm / 2),
+        "compartment": compartments,
+        "meta": {"skeleton_version": 4, "synthetic": True},
+    }
+
+
+def random_meshwork(
+    n_vertices: int,
+    branchiness: float = 0.05,
+    axon_fraction: float = 0.3,
+    max_lvl2_per_vertex: int = 3,
+    step_nm: float = 500,
+    seed: Optional[int] = None,
+) -> meshwork.Meshwork:
+    """Build a meshwork with the same structure as one returned by the skeleton service.
+
+    Parameters are the same as for `random_skeleton_dict`.
+
+    Returns
+    -------
+    meshwork.Meshwork
+        Meshwork with `lvl2_ids` and `is_axon` annotations.
+    """
+    sk = random_skeleton_dict(
+        n_vertices,
+        branchiness=branchiness,
+        axon_fraction=axon_fraction,
+        max_lvl2_per_vertex=max_lvl2_per_vertex,
+        step_nm=step_nm,
+        seed=seed,
+    )
+    return rebuild_meshwork(
+        root_id=SYNTHETIC_ROOT_ID,
+        sk_verts=sk["vertices"],
+        sk_edges=sk["edges"],
+        root=sk["root"],
+        mesh_to_skel_map=sk["mesh_to_skel_map"],
+        lvl2_ids=sk["lvl2_ids"],
+        radius=sk["radius"],
+        compartments=sk["compartment"],
+    )
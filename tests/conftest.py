@@ -1 +1,26 @@
+import numpy as np
 import pytest
+
+from benchmarks.synthetic import random_meshwork
+from tourguide.tourguide_lib.vertex_table import VertexTable
+
+
+@pytest.fixture(scope="session")
+def small_meshwork():
+    "Random neuron with a few thousand vertices, shared by tests that do not modify it"
+    return random_meshwork(3_000, branchiness=0.05, axon_fraction=0.3, seed=1)
+
+
+@pytest.fixture
+def make_table():
+    "Factory for small vertex tables with two level 2 ids per vertex and a reversed index"
+
+    def make(n: int) -> VertexTable:
+        return VertexTable(
+            {"a": np.arange(n, dtype=np.int32), "b": np.linspace(0, 1, n)},
+            lvl2_ids=np.arange(2 * n),
+            lvl2_offsets=np.arange(0, 2 * n + 1, 2),
+            index=np.arange(n)[::-1],
+        )
+
+    return make
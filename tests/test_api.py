@@ -0,0 +1,62 @@
+import flask
+import pytest
+from middle_auth_client import decorators
+
+from tourguide.flask_app import api
+from tourguide.flask_app.api import api_bp
+from tourguide.tourguide_app import tours
+
+TOURS_URL = "/api/v1/datastack/ds/tours"
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(decorators, "AUTH_DISABLED", True)
+    app = flask.Flask(__name__)
+    app.register_blueprint(api_bp)
+    return app.test_client()
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        [1, 2],
+        "864691135000000000",
+        {"root_ids": []},
+        {"root_ids": [1], "settings": {"unknown": 1}},
+        {"root_ids": [1], "settings": [1]},
+        {"root_ids": [1], "outputs": ["soma"]},
+        {"root_ids": [1], "settings": {"max_distance_to_root": "10"}},
+    ],
+)
+def test_invalid_tour_requests_are_rejected(client, body):
+    response = client.post(TOURS_URL, json=body)
+    assert response.status_code == 400
+    assert response.get_json()["error"].startswith("Invalid request")
+
+
+def test_tour_settings_are_in_microns(client, monkeypatch):
+    calls = []
+
+    def process_paths(root_id, vertex_table, **kwargs):
+        calls.append((root_id, kwargs))
+        raise RuntimeError("stop")
+
+    monkeypatch.setattr(api, "make_client", lambda **kwargs: object())
+    monkeypatch.setattr(tours, "build_vertex_table", lambda root_id, client: [])
+    monkeypatch.setattr(tours, "process_paths", process_paths)
+    response = client.post(
+        TOURS_URL,
+        json={
+            "root_ids": [1, {"root_id": 2, "min_path_length": 1}],
+            "settings": {"max_distance_to_root": 10, "step_size": 2},
+            "outputs": ["path"],
+            "states": True,
+        },
+    )
+    assert response.status_code == 200
+    # Tours run in threads, so calls can come in any order
+    calls = [kwargs for _, kwargs in sorted(calls, key=lambda call: call[0])]
+    assert [c["max_distance_to_root"] for c in calls] == [10_000, 10_000]
+    assert [c["min_path_length"] for c in calls] == [None, 1_000]
+    assert [c["step_size"] for c in calls] == [2, 2]
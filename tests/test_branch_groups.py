@@ -0,0 +1,23 @@
+import numpy as np
+import pytest
+
+from benchmarks.bench_branch_groups import _branch_group_label_reference
+from benchmarks.synthetic import random_meshwork
+from tourguide.tourguide_lib import processing
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+@pytest.mark.parametrize("threshold", [5_000, 20_000, 200_000])
+def test_branch_group_label_matches_reference(seed, threshold):
+    nrn = random_meshwork(2_000, branchiness=0.05, seed=seed)
+    labels = processing.branch_group_label(nrn, cp_max_thresh=threshold)
+    expected = _branch_group_label_reference(nrn, cp_max_thresh=threshold)
+    assert np.array_equal(labels, expected)
+
+
+def test_branch_group_label_orders_groups_by_distance(small_meshwork):
+    sk = small_meshwork.skeleton
+    labels = processing.branch_group_label(small_meshwork, cp_max_thresh=20_000)
+    assert labels[sk.root] == 0
+    min_distance = [sk.distance_to_root[labels == l].min() for l in np.unique(labels)]
+    assert np.all(np.diff(min_distance) >= 0)
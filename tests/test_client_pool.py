@@ -0,0 +1,86 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from tourguide.tourguide_lib import lib_utils
+from tourguide.tourguide_lib.caching import LRUStore
+
+
+class FakeClient:
+    "Stand-in for CachedClient and CAVEclient that records how it was built"
+
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.mirrors = []
+        self.info = SimpleNamespace(
+            get_datastack_info=lambda image_mirror=None: self.mirrors.append(
+                image_mirror
+            )
+        )
+        FakeClient.instances.append(self)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeClient.instances = []
+    monkeypatch.setattr(lib_utils, "CachedClient", FakeClient)
+    monkeypatch.setattr(lib_utils, "CAVEclient", FakeClient)
+    store = LRUStore(maxsize=8, ttl=60)
+    monkeypatch.setattr(lib_utils, "_client_pool", store)
+    return store
+
+
+def test_client_is_reused(pool):
+    first = lib_utils.make_client("ds", "global.example.org", "token")
+    second = lib_utils.make_client("ds", "https://global.example.org", "token")
+    assert second is first
+    assert len(FakeClient.instances) == 1
+    assert first.kwargs["server_address"] == "https://global.example.org"
+
+
+def test_clients_are_separated_by_token_and_mirror(pool):
+    clients = [
+        lib_utils.make_client("ds", "https://a.org", "token-1"),
+        lib_utils.make_client("ds", "https://a.org", "token-2"),
+        lib_utils.make_client("ds", "https://a.org", "token-1", image_mirror="m"),
+        lib_utils.make_client("other", "https://a.org", "token-1"),
+    ]
+    assert len({id(c) for c in clients}) == 4
+    assert clients[1].kwargs["auth_token"] == "token-2"
+    assert clients[2].mirrors == ["m"]
+    assert clients[0].mirrors == []
+    # Tokens are only kept in the key as hashes
+    for key in pool._cache.keys():
+        assert "token-1" not in key and "token-2" not in key
+
+
+def test_global_client_is_separate_from_datastack_clients(pool):
+    global_client = lib_utils.make_global_client("https://a.org", "token")
+    assert lib_utils.make_global_client("https://a.org", "token") is global_client
+    assert global_client.kwargs["global_only"] is True
+    assert lib_utils.make_client("ds", "https://a.org", "token") is not global_client
+
+
+def test_clients_expire_after_ttl(monkeypatch, pool):
+    monkeypatch.setattr(lib_utils, "_client_pool", LRUStore(maxsize=8, ttl=0.05))
+    first = lib_utils.make_client("ds", "https://a.org", "token")
+    assert lib_utils.make_client("ds", "https://a.org", "token") is first
+    time.sleep(0.1)
+    assert lib_utils.make_client("ds", "https://a.org", "token") is not first
+    assert len(FakeClient.instances) == 2
+
+
+def test_request_token_is_used_by_default(pool):
+    client = lib_utils.make_client("ds", "https://a.org", "AUTH_DISABLED")
+    assert client.kwargs["auth_token"] == "AUTH_DISABLED"
+
+
+def test_local_token_is_opt_in(monkeypatch, pool):
+    monkeypatch.setattr(lib_utils, "USE_LOCAL_TOKEN", True)
+    client = lib_utils.make_client("ds", "https://a.org", "token")
+    assert client.kwargs["auth_token"] is None
+    global_client = lib_utils.make_global_client("https://a.org", "token")
+    assert global_client.kwargs["auth_token"] is None
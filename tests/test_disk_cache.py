@@ -0,0 +1,46 @@
+import numpy as np
+
+from tourguide.tourguide_lib.disk_cache import VertexTableDiskCache
+
+
+def test_round_trip(tmp_path, make_table):
+    cache = VertexTableDiskCache(str(tmp_path), max_bytes=10**8)
+    assert cache.get("ds", 1) is None
+    vertex_table = make_table(5)
+    cache.put("ds", 1, vertex_table)
+    cached = cache.get("ds", 1)
+    assert cached.columns == vertex_table.columns
+    for c in vertex_table.columns:
+        assert cached[c].dtype == vertex_table[c].dtype
+        assert np.array_equal(cached[c], vertex_table[c])
+    assert np.array_equal(cached.lvl2_ids, vertex_table.lvl2_ids)
+    assert np.array_equal(cached.lvl2_offsets, vertex_table.lvl2_offsets)
+    assert np.array_equal(cached.index, vertex_table.index)
+    assert cache.get("other", 1) is None
+    assert cache.info()["hits"] == 1
+
+
+def test_other_version_is_a_miss(tmp_path, make_table):
+    VertexTableDiskCache(str(tmp_path), max_bytes=10**8, version=1).put(
+        "ds", 1, make_table(5)
+    )
+    assert (
+        VertexTableDiskCache(str(tmp_path), max_bytes=10**8, version=2).get("ds", 1)
+        is None
+    )
+    assert (
+        VertexTableDiskCache(str(tmp_path), max_bytes=10**8, version=1).get("ds", 1)
+        is not None
+    )
+
+
+def test_evicts_to_max_bytes(tmp_path, make_table):
+    cache = VertexTableDiskCache(str(tmp_path), max_bytes=10**8)
+    cache.put("ds", 1, make_table(1000))
+    entry_size = cache.size()
+    cache.max_bytes = int(2.5 * entry_size)
+    for root_id in range(2, 5):
+        cache.put("ds", root_id, make_table(1000))
+    assert cache.size() <= cache.max_bytes
+    assert cache.get("ds", 4) is not None
+    assert cache.get("ds", 1) is None
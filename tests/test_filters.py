@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from tourguide.tourguide_lib import processing
+from tourguide.tourguide_lib.vertex_table import IS_AXON_COLUMN
+
+
+@pytest.fixture
+def vertex_table(small_meshwork):
+    return processing.process_new_points(
+        processing.process_meshwork_to_vertex_table(small_meshwork), []
+    )
+
+
+def test_filter_dataframe_returns_fresh_tables(vertex_table):
+    first = processing.filter_dataframe(1, vertex_table, compartment_filter="axon")
+    second = processing.filter_dataframe(1, vertex_table, compartment_filter="axon")
+    assert first is not second
+    assert 0 < len(first) < len(vertex_table)
+    assert first[IS_AXON_COLUMN].all()
+    np.testing.assert_array_equal(first.index, second.index)
+
+    first["label"] = 1
+    assert "label" not in second
+    assert "label" not in vertex_table
+
+
+def test_filter_dataframe_keeps_table_without_filters(vertex_table):
+    assert processing.filter_dataframe(1, vertex_table) is vertex_table
+
+
+def test_filter_memo_stays_within_table_budget(vertex_table):
+    for max_branch in range(200):
+        processing.filter_dataframe(1, vertex_table, max_branch_to_root=max_branch)
+    info = vertex_table._memo.info()
+    assert info["currsize"] <= info["maxsize"] < vertex_table.nbytes
@@ -0,0 +1,88 @@
+import multiprocessing
+import threading
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from tourguide.tourguide_app import neuron_cache
+from tourguide.tourguide_lib.disk_cache import VertexTableDiskCache
+from tourguide.tourguide_lib.processing import NEW_POINT_COLUMN, process_new_points
+
+
+def test_get_neuron_rebuilds_once_for_concurrent_misses(monkeypatch, make_table):
+    calls = []
+
+    def build_vertex_table(root_id, client):
+        calls.append(root_id)
+        time.sleep(0.05)
+        return make_table(4)
+
+    monkeypatch.setattr(neuron_cache, "build_vertex_table", build_vertex_table)
+    vertex_table = make_table(4)
+    vertex_table[NEW_POINT_COLUMN] = np.array([True, False, True, False])
+    key = neuron_cache.make_neuron_key("test", 1, [1, 2], vertex_table)
+    neuron_cache._neuron_cache.clear()
+
+    results = []
+    threads = [
+        threading.Thread(
+            target=lambda: results.append(neuron_cache.get_neuron(key, None))
+        )
+        for _ in range(4)
+    ]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(calls) == 1
+    for vt in results:
+        assert vt[NEW_POINT_COLUMN].tolist() == [True, False, True, False]
+        assert vt._memo is results[0]._memo
+
+
+def _background_job(cache_dir, vertex_table, queue):
+    "Stand-in for process_root_id in a job process: cache the table, return the key"
+    neuron_cache._disk_cache = VertexTableDiskCache(cache_dir, max_bytes=10**8)
+    neuron_cache._disk_cache.put("test", 2, vertex_table)
+    vertex_table = process_new_points(vertex_table, [int(vertex_table.lvl2_ids[0])])
+    queue.put(neuron_cache.make_neuron_key("test", 2, [], vertex_table))
+
+
+def test_web_worker_loads_table_from_background_job(monkeypatch, tmp_path, make_table):
+    cache_dir = str(tmp_path)
+    monkeypatch.setattr(
+        neuron_cache,
+        "_disk_cache",
+        VertexTableDiskCache(cache_dir, max_bytes=10**8),
+    )
+    neuron_cache._neuron_cache.clear()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    job = context.Process(
+        target=_background_job, args=(cache_dir, make_table(3), queue)
+    )
+    job.start()
+    key = queue.get(timeout=30)
+    job.join()
+    # Nothing the job process did is in this worker's memory cache
+    assert len(neuron_cache._neuron_cache) == 0
+
+    def skeletonize(*args, **kwargs):
+        raise AssertionError("Table should be loaded from the disk cache")
+
+    monkeypatch.setattr(neuron_cache, "process_meshwork_to_vertex_table", skeletonize)
+    client = SimpleNamespace(datastack_name="test")
+    vertex_table = neuron_cache.get_neuron(key, client)
+    assert vertex_table[NEW_POINT_COLUMN].tolist() == [False, True, True]
+    assert len(neuron_cache._neuron_cache) == 1
+
+
+def test_app_requires_disk_cache(monkeypatch):
+    from tourguide import tourguide_app
+
+    monkeypatch.setattr(neuron_cache, "_disk_cache", None)
+    with pytest.raises(ValueError, match="TOURGUIDE_DISK_CACHE_DIR"):
+        tourguide_app.make_background_callback_manager()
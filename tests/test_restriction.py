@@ -0,0 +1,89 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+from scipy import spatial
+
+from tourguide.tourguide_lib import processing
+
+VIEWER_RESOLUTION = np.array([4, 4, 40])
+
+
+@pytest.fixture(scope="module")
+def vertex_table(small_meshwork):
+    return processing.process_meshwork_to_vertex_table(small_meshwork)
+
+
+@pytest.fixture
+def lookups(monkeypatch):
+    "Record remote level 2 lookups and answer them from `lookups.answer`"
+    processing._restriction_cache.clear()
+    calls = SimpleNamespace(root_ids=[], answer=None)
+
+    def get_closest_lvl2_chunk(point, root_id, client, voxel_resolution, radius):
+        calls.root_ids.append(root_id)
+        return calls.answer
+
+    monkeypatch.setattr(
+        processing.chunk_tools, "get_closest_lvl2_chunk", get_closest_lvl2_chunk
+    )
+    return calls
+
+
+def _client():
+    return SimpleNamespace(
+        datastack_name="restriction",
+        info=SimpleNamespace(viewer_resolution=lambda: VIEWER_RESOLUTION.tolist()),
+    )
+
+
+def _positions(vertex_table):
+    return vertex_table[processing.VERTEX_COLUMNS].astype(float)
+
+
+def test_point_inside_vertex_radius_snaps_locally(vertex_table, lookups):
+    v = 1234
+    point = np.round(_positions(vertex_table)[v] / VIEWER_RESOLUTION)
+    row = processing._restriction_vertex(1, vertex_table, point.tolist(), _client())
+    assert row == v
+    assert lookups.root_ids == []
+
+
+def test_point_outside_vertex_radius_is_looked_up(vertex_table, lookups):
+    positions = _positions(vertex_table)
+    tree = spatial.cKDTree(positions)
+    rng = np.random.default_rng(0)
+    # A point beside the arbor, farther from every vertex than its radius but
+    # within the old 2 µm snap distance
+    for _ in range(1000):
+        v = rng.integers(len(positions))
+        point = np.round((positions[v] + rng.normal(size=3) * 700) / VIEWER_RESOLUTION)
+        distance, nearest = tree.query(point * VIEWER_RESOLUTION)
+        if vertex_table[processing.RADIUS_COLUMN][nearest] < distance < 2000:
+            break
+    else:
+        pytest.fail("No point found beside the arbor")
+
+    # The segmentation says the point is on another branch
+    other = (nearest + len(positions) // 2) % len(positions)
+    lookups.answer = int(vertex_table.lvl2_ids[vertex_table.lvl2_offsets[other]])
+    row = processing._restriction_vertex(7, vertex_table, point.tolist(), _client())
+    assert row == other
+    assert lookups.root_ids == [7]
+
+
+def test_table_without_radius_always_looks_up(vertex_table, lookups):
+    no_radius = processing.VertexTable(
+        {
+            c: vertex_table[c]
+            for c in vertex_table.columns
+            if c != processing.RADIUS_COLUMN
+        },
+        lvl2_ids=vertex_table.lvl2_ids,
+        lvl2_offsets=vertex_table.lvl2_offsets,
+    )
+    v = 1234
+    point = np.round(_positions(vertex_table)[v] / VIEWER_RESOLUTION)
+    lookups.answer = int(vertex_table.lvl2_ids[vertex_table.lvl2_offsets[v]])
+    assert processing._restriction_vertex(1, no_radius, point.tolist(), _client()) == v
+    assert lookups.root_ids == [1]
@@ -0,0 +1,151 @@
+import threading
+import time
+from types import SimpleNamespace
+from typing import Optional
+
+import numpy as np
+import pytest
+
+from tourguide.tourguide_lib import lib_utils, processing
+
+
+class FakeChunkedGraph:
+    "Chunkedgraph with fixed leaves per root id that records get_leaves calls"
+
+    def __init__(self, leaves: dict, delay_s: Optional[dict] = None):
+        self.leaves = leaves
+        self.delay_s = delay_s or {}
+        self.calls = []
+        self.past_id_timestamps = []
+        self._lock = threading.Lock()
+        self.segmentation_info = {"graph": {"n_layers": 6}}
+
+    def get_leaves(self, root_id, stop_layer=None):
+        with self._lock:
+            self.calls.append(int(root_id))
+        time.sleep(self.delay_s.get(int(root_id), 0))
+        return np.array(self.leaves[int(root_id)])
+
+    def get_past_ids(self, root_ids, timestamp_past=None):
+        self.past_id_timestamps.append(timestamp_past)
+        return {"past_id_map": {root_ids: self.past_ids}}
+
+    def get_root_timestamps(self, root_ids):
+        return [self.timestamps[r] for r in root_ids]
+
+    def get_latest_roots(self, root_id, timestamp=None):
+        return np.array(self.latest_roots)
+
+    def is_latest_roots(self, root_ids, timestamp=None):
+        return np.ones(len(root_ids), dtype=bool)
+
+
+def _client(chunkedgraph, name):
+    return SimpleNamespace(datastack_name=name, chunkedgraph=chunkedgraph)
+
+
+@pytest.fixture(autouse=True)
+def clear_leaves_cache():
+    processing._leaves_cache.clear()
+    processing._previous_match_cache.clear()
+
+
+def test_highest_overlap_fetches_newest_root_alone_when_it_wins():
+    leaves = {1: np.arange(100), 10: np.arange(90), 11: np.arange(90, 95)}
+    leaves.update({r: [1000 + r] for r in range(12, 30)})
+    cg = FakeChunkedGraph(leaves)
+    cg.past_ids = list(range(10, 30))
+    # Root 10 is the newest
+    cg.timestamps = {r: 100 - r for r in cg.past_ids}
+    lvl2 = processing.get_highest_overlap_lvl2_ids(1, 0.0, _client(cg, "newest"))
+    assert np.array_equal(lvl2, np.arange(90))
+    assert cg.calls == [1, 10]
+
+
+def test_highest_overlap_matches_sequential_scan():
+    # The current root is split over many past roots, the largest being the oldest
+    leaves = {1: np.arange(100)}
+    past_ids = list(range(10, 20))
+    for i, r in enumerate(past_ids[:-1]):
+        leaves[r] = np.arange(5 * i, 5 * i + 5)
+    leaves[19] = np.arange(45, 100)
+    cg = FakeChunkedGraph(leaves)
+    cg.past_ids = past_ids
+    cg.timestamps = {r: 100 - r for r in past_ids}
+    lvl2 = processing.get_highest_overlap_lvl2_ids(1, 0.0, _client(cg, "oldest"))
+    assert np.array_equal(lvl2, leaves[19])
+
+
+def test_highest_overlap_does_not_wait_for_unneeded_fetches():
+    leaves = {1: np.arange(100), 10: np.arange(30), 11: np.arange(30, 100)}
+    leaves.update({r: [1000 + r] for r in range(12, 20)})
+    # Root 11 settles the result while the older roots are still being fetched
+    cg = FakeChunkedGraph(leaves, delay_s={r: 2.0 for r in range(12, 20)})
+    cg.past_ids = list(range(10, 20))
+    cg.timestamps = {r: 100 - r for r in cg.past_ids}
+    t0 = time.perf_counter()
+    lvl2 = processing.get_highest_overlap_lvl2_ids(1, 0.0, _client(cg, "wait"))
+    elapsed = time.perf_counter() - t0
+    assert np.array_equal(lvl2, leaves[11])
+    assert elapsed < 1.0
+
+
+def test_suggest_latest_roots_fetches_one_candidate_when_it_wins():
+    leaves = {1: np.arange(100), 20: np.arange(80), 21: np.arange(80, 90)}
+    leaves.update({r: [1000 + r] for r in range(22, 30)})
+    cg = FakeChunkedGraph(leaves)
+    cg.latest_roots = list(range(20, 30))
+    root = lib_utils.suggest_latest_roots_robust(_client(cg, "latest"), 1)
+    assert root == 20
+    assert cg.calls == [1, 20]
+
+
+def test_suggest_latest_roots_picks_largest_overlap():
+    leaves = {1: np.arange(100), 20: np.arange(30), 21: np.arange(30, 35)}
+    leaves[22] = np.arange(35, 100)
+    cg = FakeChunkedGraph(leaves)
+    cg.latest_roots = [20, 21, 22]
+    assert lib_utils.suggest_latest_roots_robust(_client(cg, "largest"), 1) == 22
+
+
+def _horizon_chunkedgraph():
+    cg = FakeChunkedGraph({1: np.arange(10), 10: np.arange(6), 11: [100]})
+    cg.past_ids = [10, 11]
+    cg.timestamps = {10: 2, 11: 1}
+    return cg
+
+
+def test_previous_match_is_cached_within_one_horizon_quantum(monkeypatch):
+    monkeypatch.setattr(processing, "HORIZON_QUANTUM_S", 60)
+    cg = _horizon_chunkedgraph()
+    client = _client(cg, "quantum")
+    first = processing.get_previous_match_lvl2_ids(1, 1_000_020.5, client)
+    second = processing.get_previous_match_lvl2_ids(1, 1_000_079.0, client)
+    assert second is first
+    assert len(cg.past_id_timestamps) == 1
+    # Queried at the start of the quantum
+    assert cg.past_id_timestamps[0].timestamp() == 1_000_020.0
+
+    processing.get_previous_match_lvl2_ids(1, 1_000_080.0, client)
+    assert len(cg.past_id_timestamps) == 2
+
+
+def test_filter_memo_key_uses_quantized_horizon(monkeypatch, make_table):
+    monkeypatch.setattr(processing, "HORIZON_QUANTUM_S", 60)
+    cg = _horizon_chunkedgraph()
+    client = _client(cg, "filter")
+    vertex_table = make_table(5)
+    masks = [
+        processing.filter_mask(
+            1,
+            vertex_table,
+            only_after_timestamp=True,
+            horizon_timestamp=horizon,
+            client=client,
+        )
+        for horizon in [1_000_020.5, 1_000_079.0]
+    ]
+    assert masks[1] is masks[0]
+    # Vertices 3 and 4 hold level 2 ids 6 to 9, which the past root did not have
+    assert masks[0].tolist() == [False, False, False, True, True]
+    assert len(cg.past_id_timestamps) == 1
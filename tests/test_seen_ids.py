@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from tourguide.tourguide_app import utils
+from tourguide.tourguide_lib.vertex_table import VertexTable
+
+
+def _table(lvl2_ids) -> VertexTable:
+    lvl2_ids = np.asarray(lvl2_ids, dtype=np.int64)
+    return VertexTable({}, lvl2_ids=lvl2_ids, lvl2_offsets=np.arange(len(lvl2_ids) + 1))
+
+
+@pytest.mark.parametrize(
+    "ids",
+    [
+        [7],
+        [0, 1, 2, 3],
+        [160032475051983415, 160032475051983416, 160102843795161088],
+        [1, 2**63 - 1],
+    ],
+)
+def test_segment_round_trip(ids):
+    ids = np.array(ids, dtype=np.int64)
+    decoded = utils._decode_id_segment(utils._encode_id_segment(ids))
+    assert decoded.dtype == np.int64
+    np.testing.assert_array_equal(decoded, ids)
+
+
+def test_empty_store():
+    store = utils.empty_seen_ids()
+    assert utils.seen_id_count(store) == 0
+    assert len(utils.rehydrate_seen_ids(store)) == 0
+    assert len(utils.rehydrate_seen_ids(None)) == 0
+
+
+def test_update_adds_only_new_ids():
+    store = utils.empty_seen_ids()
+    for lvl2_ids in [[5, 3, 9], [9, 3, 11, 2], [3, 5]]:
+        seen = utils.rehydrate_seen_ids(store)
+        store = utils.update_seen_ids(store, seen, _table(lvl2_ids))
+    seen = utils.rehydrate_seen_ids(store)
+    assert sorted(seen.tolist()) == [2, 3, 5, 9, 11]
+    assert utils.seen_id_count(store) == 5
+    assert len(store["segments"]) == 2
+
+
+def test_legacy_list_store_is_reencoded():
+    store = ["10", "4", "10"]
+    seen = utils.rehydrate_seen_ids(store)
+    assert utils.seen_id_count(store) == 3
+    store = utils.update_seen_ids(store, seen, _table([4, 6]))
+    assert store["version"] == utils.SEEN_ID_STORE_VERSION
+    assert sorted(utils.rehydrate_seen_ids(store).tolist()) == [4, 6, 10]
+    assert utils.seen_id_count(store) == 3
+
+
+def test_segments_are_merged(monkeypatch):
+    monkeypatch.setattr(utils, "MAX_SEEN_ID_SEGMENTS", 2)
+    store = utils.empty_seen_ids()
+    for i in range(3):
+        seen = utils.rehydrate_seen_ids(store)
+        store = utils.update_seen_ids(store, seen, _table([10 - i, 20 + i]))
+    assert len(store["segments"]) == 1
+    assert utils.rehydrate_seen_ids(store).tolist() == [8, 9, 10, 20, 21, 22]
+    assert utils.seen_id_count(store) == 6
+
+
+def test_seen_store_hash():
+    empty = utils.empty_seen_ids()
+    assert utils.seen_store_hash(empty) == utils.seen_store_hash(None)
+    first = utils.update_seen_ids(empty, [], _table([5, 3]))
+    second = utils.update_seen_ids(
+        first, utils.rehydrate_seen_ids(first), _table([3, 7])
+    )
+    assert utils.seen_store_hash(second) != utils.seen_store_hash(first)
+    swapped = {**second, "segments": second["segments"][::-1]}
+    assert utils.seen_store_hash(swapped) == utils.seen_store_hash(second)
+    assert utils.seen_store_hash(["3", "5"]) == utils.seen_store_hash(["5", "3", "3"])
@@ -0,0 +1,88 @@
+from types import SimpleNamespace
+
+import pytest
+
+from tourguide.tourguide_lib import processing, states
+
+
+class FakeStateService:
+    "Link shortener that counts uploads"
+
+    def __init__(self):
+        self.uploads = []
+
+    def upload_state_json(self, state_json):
+        self.uploads.append(state_json)
+        return len(self.uploads)
+
+    def build_neuroglancer_url(self, state_id, target_url):
+        return f"{target_url}/#!state/{state_id}"
+
+
+def _client(image_source="precomputed://images", datastack_name="fake_states"):
+    info = SimpleNamespace(
+        segmentation_source=lambda: "graphene://segmentation",
+        get_datastack_info=lambda: {"skeleton_source": "precomputed://skeletons"},
+        viewer_resolution=lambda: [4, 4, 40],
+        image_source=lambda: image_source,
+    )
+    client = SimpleNamespace(
+        server_address="https://global.example.org",
+        datastack_name=datastack_name,
+        info=info,
+        state=FakeStateService(),
+    )
+    states.config_ngl(client, target_url="https://viewer.example.org")
+    return client
+
+
+@pytest.fixture(scope="module")
+def vertex_table(small_meshwork):
+    return processing.process_meshwork_to_vertex_table(small_meshwork)
+
+
+@pytest.fixture(autouse=True)
+def clear_short_links():
+    states._short_link_cache.clear()
+
+
+def _hash(vertex_table, client, tags=None):
+    return states._state_hash(
+        states.branch_end_point_state(1, vertex_table, client, tags=tags)
+    )
+
+
+def test_state_hash_ignores_annotation_ids(vertex_table):
+    client = _client()
+    first = states.end_point_state(1, vertex_table, client)
+    second = states.end_point_state(1, vertex_table, client)
+    ids = [
+        [a["id"] for a in s.to_dict()["layers"][-1]["annotations"]]
+        for s in (first, second)
+    ]
+    assert len(ids[0]) > 0 and ids[0] != ids[1]
+    assert states._state_hash(first) == states._state_hash(second)
+
+
+def test_state_hash_changes_with_tags_and_mirror(vertex_table):
+    client = _client()
+    base = _hash(vertex_table, client)
+    assert _hash(vertex_table, client, tags=["checked"]) != base
+    mirror = _client(image_source="precomputed://mirror-images")
+    assert _hash(vertex_table, mirror) != base
+
+
+def test_shorten_link_uploads_identical_states_once(vertex_table):
+    client = _client()
+    links = [
+        states.shorten_link(states.end_point_state(1, vertex_table, client), client)
+        for _ in range(3)
+    ]
+    assert len(client.state.uploads) == 1
+    assert links == [links[0]] * 3
+
+    other = states.shorten_link(
+        states.end_point_state(1, vertex_table, client, tags=["checked"]), client
+    )
+    assert len(client.state.uploads) == 2
+    assert other != links[0]
@@ -0,0 +1,49 @@
+import pytest
+
+from tourguide import cli
+from tourguide.tourguide_app import tours
+
+
+def test_distances_are_converted_from_microns():
+    kwargs = tours.processing_settings(
+        {"max_distance_to_root": 2.5, "step_size": 2, "min_path_length": 5}
+    )
+    assert kwargs["max_distance_to_root"] == 2_500
+    assert kwargs["min_path_length"] == 5_000
+    # process_paths takes its step size in µm
+    assert kwargs["step_size"] == 2
+
+
+def test_unset_distances_stay_unset():
+    kwargs = tours.processing_settings({})
+    assert kwargs["max_distance_to_root"] is None
+    assert kwargs["min_path_length"] is None
+    assert kwargs["step_size"] is None
+
+
+@pytest.mark.parametrize("value", ["10", True, [10]])
+def test_non_numeric_distances_are_rejected(value):
+    with pytest.raises(ValueError, match="max_distance_to_root"):
+        tours.validate_settings({"max_distance_to_root": value})
+
+
+def test_cli_flags_and_json_lines_share_units(tmp_path):
+    roots = tmp_path / "roots.txt"
+    roots.write_text(
+        '1\n{"root_id": 2, "max_distance_to_root": 10, "min_path_length": 5}\n'
+    )
+    args = cli._parse_args(
+        [
+            "ds",
+            str(roots),
+            "--max-distance-to-root",
+            "10",
+            "--min-path-length",
+            "5",
+        ]
+    )
+    (_, from_flags), (_, from_json) = cli.read_roots(
+        str(roots), cli._default_settings(args)
+    )
+    assert tours.processing_settings(from_flags) == tours.processing_settings(from_json)
+    assert tours.processing_settings(from_json)["max_distance_to_root"] == 10_000
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from tourguide.tourguide_lib import processing
+
+
+@pytest.fixture(scope="module")
+def vertex_table(small_meshwork):
+    return processing.process_meshwork_to_vertex_table(small_meshwork)
+
+
+def test_euler_tour_index_on_small_tree():
+    #     0
+    #    / \
+    #   1   4
+    #  / \
+    # 2   3
+    parent = np.array([-1, 0, 1, 1, 0])
+    preorder, subtree_end = processing.euler_tour_index(parent, 0)
+    assert sorted(preorder.tolist()) == [0, 1, 2, 3, 4]
+    assert (subtree_end - preorder).tolist() == [5, 3, 1, 1, 1]
+
+
+def test_euler_tour_intervals_match_descendants(small_meshwork):
+    sk = small_meshwork.skeleton
+    parent = np.asarray(sk.parent_nodes(np.arange(len(sk.vertices))))
+    preorder, subtree_end = processing.euler_tour_index(parent, int(sk.root))
+    rng = np.random.default_rng(0)
+    for u in rng.choice(len(parent), size=20, replace=False):
+        inside = (preorder >= preorder[u]) & (preorder < subtree_end[u])
+        assert set(np.flatnonzero(inside)) == set(sk.downstream_nodes(u))
+
+
+@pytest.mark.parametrize("inclusive", [True, False])
+def test_downstream_mask_matches_skeleton(small_meshwork, vertex_table, inclusive):
+    sk = small_meshwork.skeleton
+    cut_points = np.random.default_rng(1).choice(len(vertex_table), size=3)
+    expected = np.zeros(len(vertex_table), dtype=bool)
+    for v in cut_points:
+        expected[sk.downstream_nodes(v)] = True
+    if not inclusive:
+        # Cut points only count if they are downstream of another cut point
+        for v in cut_points:
+            expected[v] = any(v in sk.downstream_nodes(u) for u in cut_points if u != v)
+    mask = processing.downstream_mask(vertex_table, cut_points, inclusive=inclusive)
+    assert np.array_equal(mask, expected)
+
+
+def test_upstream_mask_of_one_point(small_meshwork, vertex_table):
+    sk = small_meshwork.skeleton
+    v = len(vertex_table) // 2
+    expected = np.ones(len(vertex_table), dtype=bool)
+    expected[sk.downstream_nodes(v)] = False
+    assert np.array_equal(
+        processing.upstream_mask(vertex_table, v, inclusive=False), expected
+    )
+    expected[v] = True
+    assert np.array_equal(processing.upstream_mask(vertex_table, v), expected)
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+
+from tourguide.tourguide_lib.vertex_table import (
+    DISTANCE_COLUMN,
+    LVL2_ID_COLUMN,
+    VERTEX_INDEX_NAME,
+    VertexTable,
+)
+
+
+@pytest.fixture
+def vertex_table():
+    "Five vertices with 1, 0, 2, 1 and 3 level 2 ids"
+    return VertexTable(
+        {
+            DISTANCE_COLUMN: np.array([0.0, 1.0, 2.0, 3.0, 4.0]),
+            "label": np.array([10, 11, 12, 13, 14]),
+        },
+        lvl2_ids=np.array([100, 120, 121, 130, 140, 141, 142]),
+        lvl2_offsets=np.array([0, 1, 1, 3, 4, 7]),
+    )
+
+
+def test_columns_must_match_length():
+    with pytest.raises(ValueError):
+        VertexTable({"a": np.arange(3)}, lvl2_ids=[], lvl2_offsets=[0, 0])
+    vt = VertexTable({"a": np.arange(2)}, lvl2_ids=[], lvl2_offsets=[0, 0, 0])
+    with pytest.raises(ValueError):
+        vt["b"] = np.arange(3)
+
+
+def test_scalar_column_is_broadcast(vertex_table):
+    vertex_table["flag"] = True
+    assert vertex_table["flag"].tolist() == [True] * 5
+
+
+@pytest.mark.parametrize(
+    "selection",
+    [
+        np.array([False, True, True, False, True]),
+        np.array([1, 2, 4]),
+    ],
+)
+def test_take_keeps_lvl2_ids_and_index(vertex_table, selection):
+    taken = vertex_table.take(selection)
+    assert len(taken) == 3
+    assert taken.index.tolist() == [1, 2, 4]
+    assert taken["label"].tolist() == [11, 12, 14]
+    assert taken.lvl2_counts.tolist() == [0, 2, 3]
+    assert taken.lvl2_ids.tolist() == [120, 121, 140, 141, 142]
+
+
+def test_take_reorders_rows(vertex_table):
+    taken = vertex_table.take(np.array([4, 0]))
+    assert taken.index.tolist() == [4, 0]
+    assert taken.lvl2_ids.tolist() == [140, 141, 142, 100]
+    assert taken.take(np.array([1])).index.tolist() == [0]
+
+
+def test_take_rejects_wrong_mask_length(vertex_table):
+    with pytest.raises(ValueError):
+        vertex_table.take(np.array([True, False]))
+
+
+def test_copy_does_not_change_original(vertex_table):
+    copied = vertex_table.copy()
+    copied["label"] = np.zeros(5)
+    copied["extra"] = 1
+    assert vertex_table["label"].tolist() == [10, 11, 12, 13, 14]
+    assert "extra" not in vertex_table
+
+
+def test_dataframe_round_trip(vertex_table):
+    df = vertex_table.to_dataframe()
+    assert df.index.name == VERTEX_INDEX_NAME
+    assert df[LVL2_ID_COLUMN].tolist() == [
+        [100],
+        [],
+        [120, 121],
+        [130],
+        [140, 141, 142],
+    ]
+    restored = VertexTable.from_dataframe(df)
+    assert restored.columns == vertex_table.columns
+    assert np.array_equal(restored.lvl2_ids, vertex_table.lvl2_ids)
+    assert np.array_equal(restored.lvl2_offsets, vertex_table.lvl2_offsets)
+    assert np.array_equal(restored["label"], vertex_table["label"])
+
+
+def test_lvl2_lookups(vertex_table):
+    query = [141, 999, 100, 121]
+    assert vertex_table.lvl2_positions(query).tolist() == [5, -1, 0, 2]
+    assert vertex_table.vertex_of_lvl2(query).tolist() == [4, -1, 0, 2]
+    assert vertex_table.lvl2_isin(query).tolist() == [True, False, True, False, True]
+    mask = vertex_table.lvl2_mask(query)
+    assert vertex_table.lvl2_ids[mask].tolist() == [100, 121, 141]
+    assert vertex_table.any_lvl2(mask).tolist() == [True, False, True, False, True]
+    assert vertex_table.lvl2_for(np.array([2, 3])).tolist() == [120, 121, 130]
+
+
+def test_lvl2_lookups_on_taken_table(vertex_table):
+    taken = vertex_table.take(np.array([4, 2]))
+    assert taken.vertex_of_lvl2([121, 100, 142]).tolist() == [1, -1, 0]
+
+
+def test_lvl2_lookups_on_empty_table():
+    empty = VertexTable({}, lvl2_ids=[], lvl2_offsets=[0])
+    assert empty.vertex_of_lvl2([1, 2]).tolist() == [-1, -1]
+
+
+def test_memo_is_bounded_by_bytes(vertex_table):
+    budget = vertex_table._memo.maxsize
+    assert budget == vertex_table.array_nbytes
+    assert vertex_table.nbytes >= vertex_table.array_nbytes + budget
+    for i in range(budget):
+        vertex_table.memoize(("mask", i), lambda: np.ones(len(vertex_table), bool))
+    assert vertex_table._memo.info()["currsize"] <= budget
+    assert len(vertex_table._memo) == budget // len(vertex_table)
+
+
+def test_memo_returns_values_larger_than_budget(vertex_table):
+    big = np.zeros(vertex_table._memo.maxsize + 1, dtype=np.int8)
+    assert vertex_table.memoize("big", lambda: big) is big
+    assert "big" not in vertex_table._memo
+
+
+def test_memo_counts_kdtree_memory():
+    from scipy import spatial
+
+    from tourguide.tourguide_lib.vertex_table import _memo_nbytes
+
+    points = np.random.default_rng(0).random((1000, 3))
+    tree = spatial.cKDTree(points)
+    assert _memo_nbytes(tree) > points.nbytes + tree.indices.nbytes
+
+
+@pytest.mark.parametrize("compress", [True, False])
+def test_bytes_round_trip(vertex_table, compress):
+    vertex_table["flag"] = np.array([True, False, True, True, False])
+    vertex_table["small"] = np.arange(5, dtype=np.int8)
+    taken = vertex_table.take(np.array([4, 0, 2]))
+    restored = VertexTable.from_bytes(taken.to_bytes(compress=compress))
+    assert restored.columns == taken.columns
+    for c in taken.columns:
+        assert restored[c].dtype == taken[c].dtype
+        np.testing.assert_array_equal(restored[c], taken[c])
+    np.testing.assert_array_equal(restored.lvl2_ids, taken.lvl2_ids)
+    np.testing.assert_array_equal(restored.lvl2_offsets, taken.lvl2_offsets)
+    np.testing.assert_array_equal(restored.index, taken.index)
+
+
+def test_bytes_round_trip_of_empty_table():
+    empty = VertexTable({"a": np.zeros(0)}, lvl2_ids=[], lvl2_offsets=[0])
+    restored = VertexTable.from_bytes(empty.to_bytes())
+    assert len(restored) == 0
+    assert restored.columns == ["a"]
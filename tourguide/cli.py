@@ -0,0 +1,208 @@
+"""Headless batch processing of many root ids into TourGuide states or links.
+
+Root ids are read from a file with one root id per line, or one JSON object per line
+with a `root_id` and any filter settings that override the command line defaults.
+Distances are in microns, both on the command line and in JSON lines.
+Each root id is processed in a worker process and its result is written as one line
+of NDJSON as soon as it is done, so a partial run still produces usable output.
+
+Example:
+
+    tourguide my_datastack root_ids.txt --compartment axon --output tours.ndjson
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Optional
+
+from loguru import logger
+
+from .tourguide_app.tours import (
+    DEFAULT_OUTPUTS,
+    OUTPUT_TYPES,
+    make_tour,
+    validate_settings,
+)
+from .tourguide_lib import lib_utils
+
+# Client settings for each worker process, set by `_init_worker`
+_worker_config = {}
+
+
+def _init_worker(config: dict) -> None:
+    _worker_config.update(config)
+    logger.remove()
+    logger.add(sys.stderr, level=config["log_level"])
+
+
+def _worker_client():
+    return lib_utils.make_client(
+        datastack_name=_worker_config["datastack"],
+        server_address=_worker_config["server_address"],
+        auth_token=_worker_config["auth_token"],
+        image_mirror=_worker_config["image_mirror"],
+    )
+
+
+def process_root(root_id: int, settings: dict, outputs: list, as_link: bool) -> dict:
+    "Tour record for a root id, made in a worker process with its own client"
+    return make_tour(root_id, _worker_client(), settings, outputs, as_link)
+
+
+def read_roots(path: str, defaults: dict) -> list:
+    "List of (root id, settings) from a file of root ids or JSON objects, one per line"
+    roots = []
+    with sys.stdin if path == "-" else open(path) as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                settings = {**defaults, **json.loads(line)}
+                root_id = int(settings.pop("root_id"))
+                try:
+                    validate_settings(settings)
+                except ValueError as e:
+                    raise ValueError(f"Line {line_number}: {e}")
+            else:
+                root_id = int(line)
+                settings = dict(defaults)
+            roots.append((root_id, settings))
+    return roots
+
+
+def _parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="tourguide",
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("datastack", help="Datastack the root ids belong to")
+    parser.add_argument(
+        "roots", help="File of root ids or JSON objects, one per line, or - for stdin"
+    )
+    parser.add_argument(
+        "-o", "--output", default="-", help="NDJSON output file, or - for stdout"
+    )
+    parser.add_argument(
+        "--outputs",
+        nargs="+",
+        choices=OUTPUT_TYPES,
+        default=DEFAULT_OUTPUTS,
+        help="States to generate for each root id",
+    )
+    parser.add_argument(
+        "--states",
+        action="store_true",
+        help="Write neuroglancer states instead of uploading them as short links",
+    )
+    parser.add_argument("-j", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--server-address", default=os.environ.get("TOURGUIDE_SERVER_ADDRESS")
+    )
+    parser.add_argument(
+        "--auth-token",
+        default=os.environ.get("TOURGUIDE_AUTH_TOKEN"),
+        help="CAVE token. Defaults to the locally configured token",
+    )
+    parser.add_argument("--image-mirror", default=None)
+    parser.add_argument("--log-level", default="WARNING")
+
+    filters = parser.add_argument_group("filters", "Defaults for every root id")
+    filters.add_argument("--compartment", choices=["axon", "dendrite", "all"])
+    filters.add_argument(
+        "--restriction-direction", choices=["downstream-of", "upstream-of"]
+    )
+    filters.add_argument(
+        "--restriction-point",
+        type=lib_utils.process_point_string,
+        help="Point in viewer voxel coordinates, as 'x, y, z'",
+    )
+    filters.add_argument("--max-branch-to-root", type=int)
+    filters.add_argument(
+        "--max-distance-to-root", type=float, help="Maximum distance in microns"
+    )
+    filters.add_argument(
+        "--after-timestamp",
+        type=float,
+        help="Only keep vertices added after this UTC unix timestamp",
+    )
+    filters.add_argument(
+        "--step-size", type=float, help="Path interpolation step in microns"
+    )
+    filters.add_argument(
+        "--min-path-length", type=float, help="Shortest path to keep, in microns"
+    )
+    filters.add_argument(
+        "--show-mesh-subset",
+        action="store_true",
+        help="Add a layer with the segmentation of the filtered region to path states",
+    )
+    filters.add_argument("--tags", nargs="+")
+    return parser.parse_args(argv)
+
+
+def _default_settings(args: argparse.Namespace) -> dict:
+    return {
+        "compartment_filter": args.compartment,
+        "restriction_direction": args.restriction_direction,
+        "restriction_point": args.restriction_point,
+        "max_branch_to_root": args.max_branch_to_root,
+        "max_distance_to_root": args.max_distance_to_root,
+        "only_after_timestamp": args.after_timestamp is not None,
+        "horizon_timestamp": args.after_timestamp,
+        "step_size": args.step_size,
+        "min_path_length": args.min_path_length,
+        "show_mesh_subset": args.show_mesh_subset,
+        "tags": args.tags,
+    }
+
+
+def main(argv: Optional[list] = None) -> int:
+    args = _parse_args(argv)
+    logger.remove()
+    logger.add(sys.stderr, level=args.log_level)
+    roots = read_roots(args.roots, _default_settings(args))
+    config = {
+        "datastack": args.datastack,
+        "server_address": args.server_address,
+        "auth_token": args.auth_token,
+        "image_mirror": args.image_mirror,
+        "log_level": args.log_level,
+    }
+
+    n_failed = 0
+    t0 = time.perf_counter()
+    out = sys.stdout if args.output == "-" else open(args.output, "w")
+    try:
+        with ProcessPoolExecutor(
+            max_workers=args.workers, initializer=_init_worker, initargs=(config,)
+        ) as pool:
+            futures = [
+                pool.submit(
+                    process_root, root_id, settings, args.outputs, not args.states
+                )
+                for root_id, settings in roots
+            ]
+            for future in as_completed(futures):
+                record = future.result()
+                if "error" in record:
+                    n_failed += 1
+                    logger.warning(f"Root ID {record['root_id']}: {record['error']}")
+                out.write(json.dumps(record) + "\n")
+                out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    logger.info(
+        f"Processed {len(roots)} root IDs ({n_failed} failed) in {time.perf_counter() - t0:.1f} seconds"
+    )
+    return 1 if n_failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
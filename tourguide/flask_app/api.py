@@ -1,14 +1,29 @@
 import os
+import json
 import flask
+from concurrent.futures import ThreadPoolExecutor
 from flask_caching import Cache
-from flask import Blueprint, render_template, request
-from middle_auth_client import auth_required
-from ..tourguide_lib.lib_utils import make_global_client, ServerIncompatibilityError
+from flask import Blueprint, Response, render_template, request
+from middle_auth_client import auth_required, auth_requires_permission
+from ..tourguide_lib.lib_utils import (
+    make_client,
+    make_global_client,
+    ServerIncompatibilityError,
+)
+from ..tourguide_app.tours import (
+    DEFAULT_OUTPUTS,
+    OUTPUT_TYPES,
+    make_tour,
+    validate_settings,
+)
 from .config import TOURGUIDE_PREFIX
 
 api_bp = Blueprint("main", __name__)
 __version__ = "2.3.2"
 
+TOUR_WORKERS = int(os.environ.get("TOURGUIDE_API_TOUR_WORKERS", 4))
+MAX_TOUR_BATCH = int(os.environ.get("TOURGUIDE_API_MAX_BATCH", 1000))
+
 cache = Cache(
     config={
         "CACHE_TYPE": "SimpleCache",
@@ -66,3 +81,92 @@ def index():
 @api_bp.route("/version")
 def version():
     return __version__
+
+
+def _tour_requests(body: dict) -> list:
+    "List of (root id, settings) from a tour request body, raising ValueError if invalid"
+    defaults = body.get("settings", {})
+    roots = []
+    for entry in body.get("root_ids", []):
+        if isinstance(entry, dict):
+            entry = dict(entry)
+            root_id = int(entry.pop("root_id"))
+            settings = {**defaults, **entry}
+        else:
+            root_id = int(entry)
+            settings = dict(defaults)
+        validate_settings(settings)
+        roots.append((root_id, settings))
+    if len(roots) == 0:
+        raise ValueError("No root ids given")
+    if len(roots) > MAX_TOUR_BATCH:
+        raise ValueError(f"At most {MAX_TOUR_BATCH} root ids can be requested at once")
+    return roots
+
+
+def _stream_tours(datastack_name: str):
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return {"error": "Invalid request: body must be a JSON object"}, 400
+    outputs = body.get("outputs", DEFAULT_OUTPUTS)
+    try:
+        roots = _tour_requests(body)
+        if not set(outputs) <= set(OUTPUT_TYPES):
+            raise ValueError(f"Outputs must be from {OUTPUT_TYPES}")
+    except (ValueError, TypeError, KeyError) as e:
+        return {"error": f"Invalid request: {e}"}, 400
+    as_link = not body.get("states", False)
+    client = make_client(
+        datastack_name=datastack_name,
+        server_address=os.environ.get("TOURGUIDE_SERVER_ADDRESS"),
+        auth_token=flask.g.get("auth_token"),
+        image_mirror=body.get("image_mirror"),
+    )
+
+    def generate():
+        pool = ThreadPoolExecutor(max_workers=TOUR_WORKERS)
+        try:
+            # Results are written in request order as each one is ready
+            futures = [
+                pool.submit(make_tour, root_id, client, settings, outputs, as_link)
+                for root_id, settings in roots
+            ]
+            for future in futures:
+                yield json.dumps(future.result()) + "\n"
+        finally:
+            # Stop queued work if the client disconnects
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@api_bp.route("/api/v1/datastack/<datastack_name>/tours", methods=["POST"])
+@auth_required
+def tours(datastack_name):
+    """Tour links or states for a batch of root ids, streamed as NDJSON.
+
+    The JSON body has `root_ids`, a list of root ids or of objects with a `root_id`
+    and per-root settings, and optionally `settings` with defaults for every root id,
+    `outputs` from "end", "branch", "branch-end" and "path", `states` to return
+    neuroglancer states instead of short links, and `image_mirror`.
+    Each line of the response is the record of one root id, in request order.
+
+    Settings and their units, the same as in the app and CLI:
+
+    - `compartment_filter`: "axon", "dendrite" or "all".
+    - `restriction_direction`: "downstream-of" or "upstream-of".
+    - `restriction_point`: [x, y, z] in viewer resolution voxels.
+    - `max_branch_to_root`: number of branch points.
+    - `max_distance_to_root`: µm.
+    - `only_after_timestamp`: boolean.
+    - `horizon_timestamp`: UTC unix time in seconds.
+    - `step_size`: µm between path points, or null for unsmoothed paths.
+    - `min_path_length`: µm.
+    - `show_mesh_subset`: boolean.
+    - `tags`: list of annotation tag names.
+    """
+    return auth_requires_permission(
+        "view",
+        table_id=datastack_name,
+        resource_namespace="datastack",
+    )(_stream_tours)(datastack_name)
@@ -1,6 +1,7 @@
 import flask
 import dash
-from dash import Dash, _dash_renderer
+import diskcache
+from dash import Dash, DiskcacheManager, _dash_renderer
 
 # Required for dash mantine components
 _dash_renderer._set_react_version("18.2.0")
@@ -8,12 +9,32 @@ _dash_renderer._set_react_version("18.2.0")
 import dash_mantine_components as dmc
 
 from .external_stylesheets import external_stylesheets
+from . import neuron_cache
 from .pages.callbacks import register_callbacks
 import pathlib
 import os
+import tempfile
 
 pages_folder = pathlib.Path(__file__).parent.absolute().joinpath("pages")
 
+# Background callback jobs and their results are stored here, so that any gunicorn
+# worker on the machine can answer the progress polls for a job.
+JOB_CACHE_DIR = os.environ.get(
+    "TOURGUIDE_JOB_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "tourguide-jobs"),
+)
+
+
+def make_background_callback_manager():
+    # Root ids are processed in job processes, whose tables only reach the web
+    # workers through the vertex table disk cache
+    if not neuron_cache.disk_cache_enabled():
+        raise ValueError(
+            "TOURGUIDE_DISK_CACHE_DIR=None is not supported by the app: background "
+            "jobs hand processed neurons to web workers through the disk cache"
+        )
+    return DiskcacheManager(diskcache.Cache(JOB_CACHE_DIR))
+
 
 def create_tourguide_app(name=__name__, config={}, **kwargs):
     dapp = Dash(
@@ -21,6 +42,7 @@ def create_tourguide_app(name=__name__, config={}, **kwargs):
         use_pages=True,
         external_stylesheets=external_stylesheets,
         pages_folder=pages_folder,
+        background_callback_manager=make_background_callback_manager(),
         **kwargs,
     )
     register_callbacks(dapp)
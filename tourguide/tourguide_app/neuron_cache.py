@@ -0,0 +1,182 @@
+import base64
+import os
+import tempfile
+from typing import Callable, Optional
+
+import numpy as np
+from pcg_skel.service import rebuild_meshwork
+
+from ..tourguide_lib.caching import LRUStore
+from ..tourguide_lib.disk_cache import VertexTableDiskCache
+from ..tourguide_lib.processing import (
+    NEW_POINT_COLUMN,
+    VERTEX_TABLE_VERSION,
+    VertexTable,
+    process_meshwork_to_vertex_table,
+    process_new_points,
+)
+from .utils import seen_store_hash
+
+NEURON_CACHE_BYTES = int(os.environ.get("TOURGUIDE_NEURON_CACHE_MB", 512)) * 1024**2
+DISK_CACHE_DIR = os.environ.get(
+    "TOURGUIDE_DISK_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "tourguide-cache"),
+)
+DISK_CACHE_BYTES = int(os.environ.get("TOURGUIDE_DISK_CACHE_MB", 4096)) * 1024**2
+
+# Processed neurons for this worker, keyed by (datastack, root id, seen-set hash).
+_neuron_cache = LRUStore(
+    maxsize=NEURON_CACHE_BYTES,
+    getsizeof=lambda x: x.nbytes,
+    name="neuron",
+)
+
+# Seen-independent vertex tables shared by all workers, keyed by (datastack, root id).
+# Root ids never change, so entries are only removed to bound the size. Setting the
+# directory to "None" disables it for the CLI and API; the app refuses to start.
+if DISK_CACHE_DIR != "None":
+    _disk_cache = VertexTableDiskCache(
+        DISK_CACHE_DIR, max_bytes=DISK_CACHE_BYTES, version=VERTEX_TABLE_VERSION
+    )
+else:
+    _disk_cache = None
+
+
+def _cache_key(neuron_key: dict) -> tuple:
+    return (
+        neuron_key["datastack"],
+        int(neuron_key["root_id"]),
+        neuron_key["seen_hash"],
+    )
+
+
+def _pack_mask(mask: np.ndarray) -> str:
+    return base64.b64encode(np.packbits(mask)).decode("ascii")
+
+
+def _unpack_mask(packed: str, n: int) -> np.ndarray:
+    return np.unpackbits(
+        np.frombuffer(base64.b64decode(packed), dtype=np.uint8), count=n
+    ).astype(bool)
+
+
+def build_vertex_table(
+    root_id: int,
+    client,
+    progress: Optional[Callable[[str], None]] = None,
+) -> VertexTable:
+    """Download the meshwork for a root id and process it into a vertex table, using the disk cache.
+
+    If given, `progress` is called with the name of each stage as it starts:
+    "fetch", "skeletonize" and "dataframe". Stages are skipped on a disk cache hit.
+    """
+    if progress is None:
+        progress = lambda stage: None
+    if _disk_cache is not None:
+        vertex_table = _disk_cache.get(client.datastack_name, root_id)
+        if vertex_table is not None:
+            return vertex_table
+
+    # Same as pcg_skel.get_meshwork_from_client, split up to report each stage
+    progress("fetch")
+    sk = client.skeleton.get_skeleton(
+        int(root_id), skeleton_version=4, output_format="dict"
+    )
+    ts = client.chunkedgraph.get_root_timestamps(int(root_id), latest=True)[0]
+
+    progress("skeletonize")
+    nrn = rebuild_meshwork(
+        root_id=int(root_id),
+        sk_verts=np.array(sk["vertices"]),
+        sk_edges=np.array(sk["edges"]),
+        root=int(sk["root"]),
+        mesh_to_skel_map=np.array(sk["mesh_to_skel_map"]),
+        lvl2_ids=np.array(sk["lvl2_ids"]),
+        metadata=sk["meta"],
+        radius=np.array(sk["radius"]),
+        compartments=np.array(sk["compartment"]),
+        client=client,
+        synapses=False,
+        timestamp=ts,
+    )
+
+    progress("dataframe")
+    vertex_table = process_meshwork_to_vertex_table(nrn)
+    if _disk_cache is not None:
+        _disk_cache.put(client.datastack_name, root_id, vertex_table)
+    return vertex_table
+
+
+def make_neuron_key(
+    datastack_name: str,
+    root_id: int,
+    seen_store,
+    vertex_table: VertexTable,
+) -> dict:
+    """Key for dcc.Store that lets `get_neuron` load a processed vertex table.
+
+    The table is processed in a background job process, so it is not stored in the
+    memory cache here. Web workers load it with `get_neuron` from the disk cache
+    written by `build_vertex_table`, which the app requires.
+
+    Parameters
+    ----------
+    datastack_name : str
+        Datastack the root id belongs to.
+    root_id : int
+        Root id of the neuron.
+    seen_store : dict or list
+        Seen id store that was used to compute the new point column.
+    vertex_table : VertexTable
+        Vertex table with the new point column already computed.
+
+    Returns
+    -------
+    dict
+        Small JSON-compatible key. The new point column is included as a packed bitmask
+        so the table can be rebuilt exactly from the seen-independent table.
+    """
+    return {
+        "datastack": datastack_name,
+        "root_id": str(root_id),
+        "seen_hash": seen_store_hash(seen_store),
+        "n_vertices": len(vertex_table),
+        "new_points": _pack_mask(vertex_table[NEW_POINT_COLUMN]),
+    }
+
+
+def get_neuron(neuron_key: dict, client) -> VertexTable:
+    """Get the vertex table for a key from `make_neuron_key`, loading it if not cached.
+
+    The returned table is a copy, so callers can add columns without affecting
+    other requests.
+    """
+
+    def rebuild():
+        vertex_table = build_vertex_table(neuron_key["root_id"], client)
+        if len(vertex_table) == neuron_key["n_vertices"]:
+            vertex_table[NEW_POINT_COLUMN] = _unpack_mask(
+                neuron_key["new_points"], len(vertex_table)
+            )
+        else:
+            # The skeleton no longer matches the stored mask, so treat every point as new
+            vertex_table = process_new_points(vertex_table, [])
+        return vertex_table
+
+    # Concurrent link callbacks for an evicted neuron wait for one rebuild, so they
+    # also share its memoized filter results.
+    return _neuron_cache.get_or_compute(_cache_key(neuron_key), rebuild).copy()
+
+
+def disk_cache_enabled() -> bool:
+    return _disk_cache is not None
+
+
+def neuron_cache_info() -> dict:
+    return _neuron_cache.info()
+
+
+def disk_cache_info() -> Optional[dict]:
+    if _disk_cache is None:
+        return None
+    return _disk_cache.info()
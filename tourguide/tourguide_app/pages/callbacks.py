@@ -1,29 +1,27 @@
 from typing import Optional
 import flask
-from dash import html, dcc, Input, Output, State, ctx, no_update
+from dash import html, dcc, hooks, Input, Output, State, ctx, no_update
 from dash.exceptions import PreventUpdate
 import dash_mantine_components as dmc
 from ..utils import (
-    stash_dataframe,
-    rehydrate_dataframe,
     link_maker_button,
-    rehydrate_id_list,
-    update_seen_id_list,
+    empty_seen_ids,
+    rehydrate_seen_ids,
+    seen_id_count,
+    update_seen_ids,
     convert_time_string_to_utc,
 )
+from ..neuron_cache import build_vertex_table, get_neuron, make_neuron_key
 from ...tourguide_lib.processing import (
-    process_meshwork_to_dataframe,
     filter_dataframe,
     process_new_points,
     process_paths,
-    VERTEX_COLUMNS,
     END_POINT_COLUMN,
     BRANCH_GROUP_COLUMN,
-    LVL2_ID_COLUMN,
+    IS_AXON_COLUMN,
 )
 from ...tourguide_lib import states, lib_utils
-from pcg_skel import get_meshwork_from_client
-import pandas as pd
+import numpy as np
 import time
 import os
 from urllib.parse import parse_qs, urlparse, urlencode
@@ -56,6 +54,24 @@ RESET_LINK_TRIGGERS = [
 
 SHORT_PATH_LENGTH = 5_000
 
+# Progress messages for the stages of processing a root id, in order
+PROCESSING_STAGES = {
+    "fetch": "Downloading skeleton",
+    "skeletonize": "Rebuilding skeleton",
+    "dataframe": "Building vertex table",
+    "seen-set": "Comparing with seen level 2 ids",
+}
+
+
+@hooks.custom_data("auth")
+def auth_custom_data(_):
+    "Pass the auth token to callbacks, including background callbacks without a request context"
+    return {"token": flask.g.get("auth_token")}
+
+
+def callback_auth_token():
+    return ctx.custom_data.get("auth", {}).get("token")
+
 
 def get_datastack(pathname):
     if pathname is not None:
@@ -161,7 +177,7 @@ def link_process_generic(
         logger.info(f"Generating point link for root ID {root_id}")
         vertex_df = filter_dataframe(
             root_id=int(root_id),
-            vertex_df=rehydrate_dataframe(vertex_data, list_columns=[LVL2_ID_COLUMN]),
+            vertex_df=get_neuron(vertex_data, client),
             compartment_filter=compartment_filter,
             restriction_direction=point_filter,
             restriction_point=restriction_point,
@@ -205,7 +221,7 @@ def link_process_generic(
         else:
             step_size = None
         logger.debug(f"\tStep Size: {step_size}")
-        vertex_df = rehydrate_dataframe(vertex_data, list_columns=[LVL2_ID_COLUMN])
+        vertex_df = get_neuron(vertex_data, client)
         path_df, lvl2_ids = process_paths(
             root_id=int(root_id),
             vertex_df=vertex_df,
@@ -334,18 +350,26 @@ def register_callbacks(app):
             State("seen-lvl2-ids", "data"),
         ],
         prevent_initial_call=True,
+        background=True,
         running=[
             (Output("submit-button", "loading"), True, False),
             (Output("update-id-button", "loading"), True, False),
         ],
+        progress=[Output("message-text", "title")],
+        progress_default=[None],
     )
-    def process_root_id(root_id, url, _, __, seen_lvl2_ids):
+    def process_root_id(set_progress, root_id, url, _, __, seen_lvl2_ids):
+        def report_stage(stage):
+            n = list(PROCESSING_STAGES).index(stage) + 1
+            set_progress(
+                f"{PROCESSING_STAGES[stage]} ({n}/{len(PROCESSING_STAGES)})..."
+            )
+
         t0 = time.time()
         if root_id is None:
-            vertex_df = pd.DataFrame(columns=VERTEX_COLUMNS)
             return (
                 None,
-                stash_dataframe(vertex_df),
+                None,
                 seen_lvl2_ids,
                 "Please provide a Root ID",
                 "yellow",
@@ -361,7 +385,7 @@ def register_callbacks(app):
         client = lib_utils.make_client(
             get_datastack(url),
             server_address=os.environ.get("TOURGUIDE_SERVER_ADDRESS"),
-            auth_token=flask.g.get("auth_token"),
+            auth_token=callback_auth_token(),
         )
         if ctx.triggered_id == "update-id-button":
             new_root_id = lib_utils.suggest_latest_roots_robust(
@@ -378,19 +402,14 @@ def register_callbacks(app):
             root_id_updated = False
 
         try:
-            nrn = get_meshwork_from_client(
-                int(root_id),
-                client=client,
-                synapses=False,
-            )
+            vertex_df = build_vertex_table(int(root_id), client, progress=report_stage)
         except Exception as e:
-            vertex_df = pd.DataFrame(columns=VERTEX_COLUMNS)
             message_text = str(e)
             message_color = "red"
             logger.warning(f"Error processing root ID {root_id}: {e}")
             return (
                 None,
-                stash_dataframe(vertex_df),
+                None,
                 seen_lvl2_ids,
                 message_text,
                 message_color,
@@ -404,21 +423,22 @@ def register_callbacks(app):
                 no_update,
             )
 
-        seen_lvl2_ids = rehydrate_id_list(seen_lvl2_ids)
-        vertex_df = process_meshwork_to_dataframe(nrn)
+        report_stage("seen-set")
+        seen_store = seen_lvl2_ids
+        seen_lvl2_ids = rehydrate_seen_ids(seen_store)
         vertex_df = process_new_points(vertex_df, seen_lvl2_ids)
-        disable_compartments = vertex_df["is_axon"].nunique() == 1
+        disable_compartments = len(np.unique(vertex_df[IS_AXON_COLUMN])) == 1
         if root_id_updated:
             message_text = f"Pre-processed root ID {root_id} (updated from {old_id}) with {len(vertex_df)} vertices in {time.time() - t0:.2f} seconds."
             message_color = "violet"
         else:
             message_text = f"Pre-processed root ID {root_id} with {len(vertex_df)} vertices in {time.time() - t0:.2f} seconds."
             message_color = "green"
-        new_seen_lvl2_ids = update_seen_id_list(seen_lvl2_ids, vertex_df)
+        new_seen_lvl2_ids = update_seen_ids(seen_store, seen_lvl2_ids, vertex_df)
         logger.info(f"Processed root ID {root_id} in {time.time() - t0:.2f} seconds")
         return (
             str(root_id),
-            stash_dataframe(vertex_df, list_cols=[LVL2_ID_COLUMN]),
+            make_neuron_key(get_datastack(url), root_id, seen_store, vertex_df),
             new_seen_lvl2_ids,
             message_text,
             message_color,
@@ -432,6 +452,22 @@ def register_callbacks(app):
             root_id,
         )
 
+    @app.callback(
+        Input("vertex-df", "data"),
+        State("url", "pathname"),
+        prevent_initial_call=True,
+    )
+    def load_processed_neuron(vertex_data, url):
+        "Load a neuron processed by a background job into the memory cache of this worker"
+        if vertex_data is None:
+            return
+        client = lib_utils.make_client(
+            get_datastack(url),
+            server_address=os.environ.get("TOURGUIDE_SERVER_ADDRESS"),
+            auth_token=flask.g.get("auth_token"),
+        )
+        get_neuron(vertex_data, client)
+
     @app.callback(
         Output("end-point-link-card", "children"),
         Input("curr-root-id", "data"),
@@ -712,14 +748,14 @@ def register_callbacks(app):
         prevent_initial_call=True,
     )
     def reset_seen_lvl2_ids(_):
-        return []
+        return empty_seen_ids()
 
     @app.callback(
         Output("previously-unseen-message", "children"),
         Input("seen-lvl2-ids", "data"),
     )
     def previously_seen_lvl2_ids(seen_lvl2_ids):
-        return f"{len(seen_lvl2_ids)} previously seen vertex ids"
+        return f"{seen_id_count(seen_lvl2_ids)} previously seen vertex ids"
 
     @app.callback(
         Output("restriction-datetime", "error"),
@@ -1,7 +1,7 @@
 import dash
 from dash import html, dcc
 import dash_mantine_components as dmc
-from ..utils import link_maker_button
+from ..utils import empty_seen_ids, link_maker_button
 from datetime import datetime
 from ...flask_app.api import __version__
 
@@ -483,7 +483,7 @@ def layout(**kwargs):
             dcc.Store(id="vertex-df"),
             dcc.Store(
                 id="seen-lvl2-ids",
-                data=[],
+                data=empty_seen_ids(),
                 storage_type="session",
             ),
             dcc.Store(id="curr-root-id"),
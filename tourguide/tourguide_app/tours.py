@@ -0,0 +1,198 @@
+"""Tour links and states for a root id, shared by the batch CLI and the JSON API"""
+
+import json
+import time
+import traceback
+
+from loguru import logger
+from nglui.statebuilder import NumpyEncoder
+
+from ..tourguide_lib import states
+from ..tourguide_lib.processing import (
+    BRANCH_POINT_COLUMN,
+    END_POINT_COLUMN,
+    RESTRICT_OPTIONS,
+    filter_dataframe,
+    process_paths,
+)
+from .neuron_cache import build_vertex_table
+
+OUTPUT_TYPES = ["end", "branch", "branch-end", "path"]
+DEFAULT_OUTPUTS = ["end", "branch", "path"]
+
+# Filter settings that can be set per root id
+SETTING_KEYS = [
+    "compartment_filter",
+    "restriction_direction",
+    "restriction_point",
+    "max_branch_to_root",
+    "max_distance_to_root",
+    "only_after_timestamp",
+    "horizon_timestamp",
+    "step_size",
+    "min_path_length",
+    "show_mesh_subset",
+    "tags",
+]
+
+# Distance settings, in µm like in the app
+MICRON_SETTINGS = ["max_distance_to_root", "step_size", "min_path_length"]
+
+POINT_STATES = {
+    "end": (states.end_point_state, END_POINT_COLUMN),
+    "branch": (states.branch_point_state, BRANCH_POINT_COLUMN),
+    "branch-end": (states.branch_end_point_state, END_POINT_COLUMN),
+}
+
+
+def validate_settings(settings: dict) -> None:
+    "Raise a ValueError if settings have unknown keys or invalid filter values"
+    unknown = set(settings) - set(SETTING_KEYS)
+    if unknown:
+        raise ValueError(f"Unknown settings: {sorted(unknown)}")
+    if settings.get("compartment_filter") not in (None, "axon", "dendrite", "all"):
+        raise ValueError(
+            f"Invalid compartment_filter: {settings['compartment_filter']}"
+        )
+    if settings.get("restriction_direction") not in (None, *RESTRICT_OPTIONS):
+        raise ValueError(
+            f"Invalid restriction_direction: {settings['restriction_direction']}"
+        )
+    point = settings.get("restriction_point")
+    if point is not None and len(point) != 3:
+        raise ValueError("restriction_point must have 3 values")
+    for key in MICRON_SETTINGS:
+        value = settings.get(key)
+        if value is not None and (
+            isinstance(value, bool) or not isinstance(value, (int, float))
+        ):
+            raise ValueError(f"{key} must be a number of µm")
+
+
+def processing_settings(settings: dict) -> dict:
+    """Keyword arguments of `processing.process_paths` for tour settings.
+
+    This is the one place where settings are converted to the units of processing:
+    distances are given in µm, and processing takes nm except for the step size.
+    """
+
+    def nm(key):
+        value = settings.get(key)
+        return None if value is None else value * 1_000
+
+    return dict(
+        compartment_filter=settings.get("compartment_filter"),
+        restriction_direction=settings.get("restriction_direction"),
+        restriction_point=settings.get("restriction_point"),
+        max_branch_to_root=settings.get("max_branch_to_root"),
+        max_distance_to_root=nm("max_distance_to_root"),
+        only_after_timestamp=settings.get("only_after_timestamp", False),
+        horizon_timestamp=settings.get("horizon_timestamp"),
+        step_size=settings.get("step_size"),
+        min_path_length=nm("min_path_length"),
+    )
+
+
+def _render(viewer_state, client, as_link: bool):
+    "Short link of a viewer state, or its JSON state"
+    if as_link:
+        states.config_ngl(client)
+        return states.shorten_link(viewer_state, client)
+    return json.loads(json.dumps(viewer_state.to_dict(), cls=NumpyEncoder))
+
+
+def make_tour(
+    root_id: int,
+    client,
+    settings: dict,
+    outputs: list,
+    as_link: bool = True,
+) -> dict:
+    """Build the vertex table of a root id and the requested states for it.
+
+    Parameters
+    ----------
+    root_id : int
+        Root id to process.
+    client : CAVEclient
+        Client for the datastack of the root id.
+    settings : dict
+        Filter settings, with keys from `SETTING_KEYS`. Distances are in µm.
+    outputs : list
+        Output types from `OUTPUT_TYPES`.
+    as_link : bool
+        If True, upload states to the link shortener and return links instead of states.
+
+    Returns
+    -------
+    dict
+        JSON-compatible record with the root id, one entry per output, counts and
+        per-stage timings in seconds. Failures are reported in an `error` entry.
+    """
+    t_start = time.perf_counter()
+    record = {"root_id": str(root_id), "outputs": {}, "counts": {}, "timings": {}}
+
+    def timed(stage):
+        record["timings"][stage] = round(time.perf_counter() - t_stage, 4)
+
+    try:
+        t_stage = time.perf_counter()
+        vertex_table = build_vertex_table(int(root_id), client)
+        record["counts"]["vertices"] = len(vertex_table)
+        timed("vertex_table")
+
+        filters = processing_settings(settings)
+        path_settings = dict(
+            step_size=filters.pop("step_size"),
+            min_path_length=filters.pop("min_path_length"),
+        )
+        filters["client"] = client
+        tags = settings.get("tags")
+
+        if any(output in POINT_STATES for output in outputs):
+            t_stage = time.perf_counter()
+            filtered = filter_dataframe(int(root_id), vertex_table, **filters)
+            record["counts"]["end_points"] = int(filtered[END_POINT_COLUMN].sum())
+            record["counts"]["branch_points"] = int(filtered[BRANCH_POINT_COLUMN].sum())
+            timed("filter")
+
+        for output in outputs:
+            t_stage = time.perf_counter()
+            if output in POINT_STATES:
+                state_function, point_column = POINT_STATES[output]
+                if not filtered[point_column].any():
+                    record["outputs"][output] = None
+                    timed(output)
+                    continue
+                viewer_state = state_function(
+                    root_id=int(root_id),
+                    vertex_df=filtered,
+                    client=client,
+                    tags=tags,
+                )
+            else:
+                show_mesh_subset = settings.get("show_mesh_subset", False)
+                path_df, lvl2_ids = process_paths(
+                    int(root_id),
+                    vertex_table,
+                    return_l2_ids=show_mesh_subset,
+                    **path_settings,
+                    **filters,
+                )
+                record["counts"]["path_segments"] = len(path_df)
+                viewer_state = states.path_state(
+                    client=client,
+                    root_id=int(root_id),
+                    path_df=path_df,
+                    lvl2_ids=lvl2_ids,
+                    add_restricted_segmentation_layer=show_mesh_subset,
+                    restricted_color="white",
+                    tags=tags,
+                )
+            record["outputs"][output] = _render(viewer_state, client, as_link)
+            timed(output)
+    except Exception as e:
+        logger.debug(traceback.format_exc())
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["timings"]["total"] = round(time.perf_counter() - t_start, 4)
+    return record
@@ -1,46 +1,14 @@
 from typing import Optional
+import base64
+import hashlib
+import zlib
 from ..tourguide_lib.lib_utils import make_client, make_global_client
 import dash_mantine_components as dmc
-import pandas as pd
-import re
 import numpy as np
-from ..tourguide_lib.processing import LVL2_ID_COLUMN
+from ..tourguide_lib.vertex_table import VertexTable
 from datetime import datetime, timezone, timedelta
 
 
-def stringify_int64s(df, stringify_cols=None) -> pd.DataFrame:
-    if stringify_cols is None:
-        stringify_cols = [col for col in df.columns if re.search("_root_id$", col)]
-    for col in stringify_cols:
-        df[col] = df[col].astype(str)
-    return df
-
-
-def stringify_list(col, df) -> pd.DataFrame:
-    df[col] = df[col].apply(lambda x: str(x)[1:-1]).astype(str)
-    return df
-
-
-def repopulate_list(col, df) -> None:
-    df[col] = df[col].apply(lambda x: [int(y) for y in x.split(",")]).astype(object)
-
-
-def stash_dataframe(df, int64_cols=[], list_cols=[]) -> list:
-    """Ready a dataframe for dcc.Store JSON format"""
-    df = stringify_int64s(df, int64_cols)
-    for col in list_cols:
-        stringify_list(col, df)
-    return df.to_dict("records")
-
-
-def rehydrate_dataframe(rows, list_columns=[]) -> pd.DataFrame:
-    """Get a dataframe out of dcc.Store JSON format"""
-    df = pd.DataFrame(rows)
-    for col in list_columns:
-        repopulate_list(col, df)
-    return df
-
-
 def stash_id_list(ids) -> list:
     "Return a list of int64s as a string"
     return [str(x) for x in ids]
@@ -51,20 +19,100 @@ def rehydrate_id_list(ids) -> list:
     return [int(x) for x in ids]
 
 
-def update_seen_id_list(lvl2_ids: list, vertex_df: pd.DataFrame) -> list:
-    "Return a list of unique lvl2_ids from the vertex dataframe and a list of ids"
-    return (
-        np.unique(
-            np.concatenate(
-                [
-                    lvl2_ids,
-                    vertex_df[LVL2_ID_COLUMN].explode().values,
-                ]
-            )
-        )
-        .astype(str)
-        .tolist()
-    )
+SEEN_ID_STORE_VERSION = 1
+MAX_SEEN_ID_SEGMENTS = 32
+
+
+def _encode_id_segment(ids: np.ndarray) -> str:
+    "Compress sorted unique ids as byte-shuffled uint64 deltas"
+    deltas = np.diff(ids.astype(np.uint64), prepend=np.uint64(0))
+    # Grouping the bytes of each significance together leaves long runs of zeros
+    shuffled = deltas.astype("<u8").view(np.uint8).reshape(-1, 8).T.tobytes()
+    return base64.b64encode(zlib.compress(shuffled)).decode("ascii")
+
+
+def _decode_id_segment(segment: str) -> np.ndarray:
+    shuffled = np.frombuffer(zlib.decompress(base64.b64decode(segment)), dtype=np.uint8)
+    deltas = shuffled.reshape(8, -1).T.copy().view("<u8").ravel()
+    return np.cumsum(deltas, dtype=np.uint64).astype(np.int64)
+
+
+def empty_seen_ids() -> dict:
+    "Seen level 2 id store with no ids"
+    return {"version": SEEN_ID_STORE_VERSION, "count": 0, "segments": []}
+
+
+def rehydrate_seen_ids(seen_store) -> np.ndarray:
+    """Return the level 2 ids of a seen id store as an int64 array.
+
+    The store is a list of disjoint segments, each a sorted and compressed set of ids.
+    Lists of id strings from older sessions are also accepted.
+    """
+    if seen_store is None:
+        return np.zeros(0, dtype=np.int64)
+    if isinstance(seen_store, list):
+        return np.array(rehydrate_id_list(seen_store), dtype=np.int64)
+    segments = [_decode_id_segment(x) for x in seen_store["segments"]]
+    if len(segments) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.concatenate(segments)
+
+
+def seen_id_count(seen_store) -> int:
+    if seen_store is None:
+        return 0
+    if isinstance(seen_store, list):
+        return len(seen_store)
+    return seen_store["count"]
+
+
+def seen_store_hash(seen_store) -> str:
+    """Hash of the ids in a seen id store, without decoding it.
+
+    Segments are disjoint and each one is a canonical encoding of its ids, so the
+    sorted segment strings identify the set. The same ids split into different
+    segments hash differently, which only costs a cache miss. Lists of id strings
+    from older sessions are hashed from their sorted ids.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    if isinstance(seen_store, list):
+        h.update(np.unique(rehydrate_seen_ids(seen_store)).tobytes())
+    elif seen_store is not None:
+        for segment in sorted(seen_store["segments"]):
+            h.update(segment.encode("ascii"))
+            h.update(b"\n")
+    return h.hexdigest()
+
+
+def update_seen_ids(
+    seen_store, seen_lvl2_ids: np.ndarray, vertex_table: VertexTable
+) -> dict:
+    """Add the level 2 ids of a vertex table to a seen id store.
+
+    Only ids not already in `seen_lvl2_ids`, the rehydrated contents of the store, are
+    encoded as a new segment, so existing segments are passed through unchanged.
+    Segments are merged into one when there are more than `MAX_SEEN_ID_SEGMENTS`.
+    """
+    if seen_store is None or isinstance(seen_store, list):
+        # Re-encode stores from older sessions
+        seen_lvl2_ids = np.unique(seen_lvl2_ids)
+        seen_store = empty_seen_ids()
+        if len(seen_lvl2_ids) > 0:
+            seen_store["count"] = len(seen_lvl2_ids)
+            seen_store["segments"] = [_encode_id_segment(seen_lvl2_ids)]
+    new_ids = np.unique(vertex_table.lvl2_ids[~vertex_table.lvl2_mask(seen_lvl2_ids)])
+    if len(new_ids) == 0:
+        return seen_store
+    segments = seen_store["segments"] + [_encode_id_segment(new_ids)]
+    if len(segments) > MAX_SEEN_ID_SEGMENTS:
+        segments = [
+            _encode_id_segment(np.unique(np.concatenate([seen_lvl2_ids, new_ids])))
+        ]
+    return {
+        "version": SEEN_ID_STORE_VERSION,
+        "count": seen_store["count"] + len(new_ids),
+        "segments": segments,
+    }
 
 
 def _basic_button(
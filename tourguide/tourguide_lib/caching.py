@@ -0,0 +1,122 @@
+import threading
+from typing import Callable, Hashable, Optional
+
+import cachetools
+from prometheus_client import Counter
+
+CACHE_REQUESTS = Counter(
+    "tourguide_cache_requests",
+    "Cache lookups by cache name and result",
+    ["cache", "result"],
+)
+
+
+def record_cache_request(name: Optional[str], hit: bool) -> None:
+    "Count a cache lookup in the prometheus metrics, if the cache is named"
+    if name is not None:
+        CACHE_REQUESTS.labels(cache=name, result="hit" if hit else "miss").inc()
+
+
+class LRUStore:
+    """Thread-safe LRU cache with hit and miss counters.
+
+    Parameters
+    ----------
+    maxsize : int
+        Maximum total size of the cached values.
+    getsizeof : Callable, optional
+        Function returning the size of a value. If None, every value has size 1.
+    ttl : float, optional
+        If set, entries expire this many seconds after they were stored.
+    name : str, optional
+        If set, lookups are exported as prometheus metrics under this cache name.
+    """
+
+    def __init__(
+        self,
+        maxsize: int,
+        getsizeof: Optional[Callable] = None,
+        ttl: Optional[float] = None,
+        name: Optional[str] = None,
+    ):
+        self.name = name
+        if ttl is None:
+            self._cache = cachetools.LRUCache(maxsize=maxsize, getsizeof=getsizeof)
+        else:
+            self._cache = cachetools.TTLCache(
+                maxsize=maxsize, ttl=ttl, getsizeof=getsizeof
+            )
+        self._lock = threading.Lock()
+        # Per-key locks for values being computed by `get_or_compute`
+        self._computing = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default=None):
+        with self._lock:
+            try:
+                value = self._cache[key]
+            except KeyError:
+                self.misses += 1
+                record_cache_request(self.name, hit=False)
+                return default
+            self.hits += 1
+        record_cache_request(self.name, hit=True)
+        return value
+
+    def put(self, key: Hashable, value) -> None:
+        with self._lock:
+            try:
+                self._cache[key] = value
+            except ValueError:
+                # Value is larger than the whole cache, so it is not stored.
+                pass
+
+    def get_or_compute(self, key: Hashable, compute: Callable):
+        """Return the cached value for `key`, or compute and store it.
+
+        Threads that ask for the same missing key at the same time wait for the first
+        one to finish instead of computing the value again.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+        with self._lock:
+            key_lock = self._computing.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                with self._lock:
+                    value = self._cache.get(key)
+                if value is None:
+                    value = compute()
+                    self.put(key, value)
+        finally:
+            with self._lock:
+                if self._computing.get(key) is key_lock:
+                    del self._computing[key]
+        return value
+
+    @property
+    def maxsize(self) -> int:
+        return self._cache.maxsize
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._cache
+
+    def __len__(self) -> int:
+        return len(self._cache)
+
+    def info(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "entries": len(self._cache),
+                "currsize": self._cache.currsize,
+                "maxsize": self._cache.maxsize,
+            }
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Optional
+
+import numpy as np
+from loguru import logger
+
+from .caching import record_cache_request
+from .vertex_table import VertexTable
+
+COLUMNS_FILE = "columns.json"
+LVL2_IDS_FILE = "lvl2_ids.npy"
+LVL2_OFFSETS_FILE = "lvl2_offsets.npy"
+INDEX_FILE = "index.npy"
+
+
+def _column_file(column: str) -> str:
+    return f"col_{column}.npy"
+
+
+class VertexTableDiskCache:
+    """Content-addressed cache of vertex tables on local disk, shared by every process.
+
+    Each entry is a directory named by the hash of (version, datastack, root id)
+    holding one `.npy` file per array. Entries written with another version are
+    never read, so they are misses and age out through eviction. Entries are written to a temporary directory and renamed
+    into place, so readers never see partial entries, and are loaded memory-mapped.
+    When the total size exceeds `max_bytes`, the least recently used entries are removed.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory for cache entries. Created if it does not exist.
+    max_bytes : int
+        Maximum total size of all entries.
+    version : int, optional
+        Version of the cached table format, by default 0. Change it whenever the
+        columns or the way they are computed change.
+    name : str, optional
+        Cache name for prometheus metrics, by default "vertex_table_disk".
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        version: int = 0,
+        name: Optional[str] = "vertex_table_disk",
+    ):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.version = version
+        self.name = name
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def entry_name(self, datastack_name: str, root_id: int) -> str:
+        return hashlib.sha256(
+            f"v{self.version}/{datastack_name}/{int(root_id)}".encode()
+        ).hexdigest()
+
+    def _entry_path(self, datastack_name: str, root_id: int) -> str:
+        return os.path.join(self.cache_dir, self.entry_name(datastack_name, root_id))
+
+    def _record(self, hit: bool) -> None:
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache_request(self.name, hit=hit)
+
+    def get(self, datastack_name: str, root_id: int) -> Optional[VertexTable]:
+        "Load a memory-mapped vertex table, or None if it is not cached"
+        path = self._entry_path(datastack_name, root_id)
+        try:
+            with open(os.path.join(path, COLUMNS_FILE)) as f:
+                columns = json.load(f)
+            vertex_table = VertexTable(
+                {
+                    c: np.load(os.path.join(path, _column_file(c)), mmap_mode="r")
+                    for c in columns
+                },
+                lvl2_ids=np.load(os.path.join(path, LVL2_IDS_FILE), mmap_mode="r"),
+                lvl2_offsets=np.load(
+                    os.path.join(path, LVL2_OFFSETS_FILE), mmap_mode="r"
+                ),
+                index=np.load(os.path.join(path, INDEX_FILE), mmap_mode="r"),
+            )
+            # Mark as recently used for eviction
+            os.utime(path)
+        except (OSError, ValueError):
+            # Missing, or removed by another process while loading
+            self._record(hit=False)
+            return None
+        self._record(hit=True)
+        return vertex_table
+
+    def put(self, datastack_name: str, root_id: int, vertex_table: VertexTable) -> None:
+        "Write a vertex table to the cache and evict old entries if over the size limit"
+        path = self._entry_path(datastack_name, root_id)
+        if os.path.exists(path):
+            return
+        tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for c in vertex_table.columns:
+                np.save(os.path.join(tmp_path, _column_file(c)), vertex_table[c])
+            np.save(os.path.join(tmp_path, LVL2_IDS_FILE), vertex_table.lvl2_ids)
+            np.save(
+                os.path.join(tmp_path, LVL2_OFFSETS_FILE), vertex_table.lvl2_offsets
+            )
+            np.save(os.path.join(tmp_path, INDEX_FILE), vertex_table.index)
+            with open(os.path.join(tmp_path, COLUMNS_FILE), "w") as f:
+                json.dump(vertex_table.columns, f)
+            os.rename(tmp_path, path)
+        except OSError as e:
+            # Another process may have written the same entry first
+            logger.debug(f"Could not write disk cache entry for {root_id}: {e}")
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            return
+        self.evict()
+
+    def _entries(self) -> list:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_dir() or entry.name.startswith("."):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                continue
+        return entries
+
+    def size(self) -> int:
+        "Total size of cached entries in bytes"
+        return sum(size for _, size, _ in self._entries())
+
+    def evict(self) -> None:
+        "Remove least recently used entries until the cache fits in `max_bytes`"
+        entries = sorted(self._entries())
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self) -> None:
+        for _, _, path in self._entries():
+            shutil.rmtree(path, ignore_errors=True)
+
+    def info(self) -> dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        entries = self._entries()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "entries": len(entries),
+            "currsize": sum(size for _, size, _ in entries),
+            "maxsize": self.max_bytes,
+        }
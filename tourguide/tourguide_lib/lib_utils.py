@@ -1,4 +1,8 @@
 import datetime
+import hashlib
+import os
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import islice
 from typing import Optional
 from urllib.parse import urlparse
 
@@ -7,6 +11,37 @@ from caveclient import CAVEclient
 from caveclient.base import ServerIncompatibilityError
 from caveclient.tools.caching import CachedClient
 
+from .caching import LRUStore
+from .processing import LEAVES_FETCH_WORKERS
+
+CLIENT_POOL_SIZE = int(os.environ.get("TOURGUIDE_CLIENT_POOL_SIZE", 32))
+CLIENT_POOL_TTL_S = float(os.environ.get("TOURGUIDE_CLIENT_POOL_TTL_S", 600))
+
+# Opt-in for local development: ignore request tokens and use the locally configured
+# CAVE token for every client
+USE_LOCAL_TOKEN = os.environ.get("TOURGUIDE_USE_LOCAL_TOKEN", "false") == "true"
+
+# Clients for this worker, keyed by (datastack, server, token hash, mirror), so that
+# HTTP sessions and cached info are reused across callbacks.
+_client_pool = LRUStore(
+    maxsize=CLIENT_POOL_SIZE,
+    ttl=CLIENT_POOL_TTL_S,
+    name="caveclient",
+)
+
+
+def _local_token(auth_token: Optional[str]) -> Optional[str]:
+    "Token to pass to CAVEclient, or None for the locally configured token if opted in"
+    if USE_LOCAL_TOKEN:
+        return None
+    return auth_token
+
+
+def _token_hash(auth_token: Optional[str]) -> Optional[str]:
+    if auth_token is None:
+        return None
+    return hashlib.sha256(auth_token.encode()).hexdigest()
+
 
 def make_client(
     datastack_name: str,
@@ -14,16 +49,21 @@ def make_client(
     auth_token: Optional[str] = None,
     image_mirror: Optional[str] = None,
 ):
-    "Generate the appropriate CAVEclient with info caching"
+    "Get the appropriate CAVEclient with info caching, reusing a pooled client if possible"
     if len(urlparse(server_address).scheme) == 0:
         server_address = f"https://{server_address}"
-    client = CachedClient(
-        datastack_name=datastack_name,
-        server_address=server_address,
-        auth_token=auth_token,
-    )
-    if image_mirror is not None:
-        client.info.get_datastack_info(image_mirror=image_mirror)
+    auth_token = _local_token(auth_token)
+    key = (datastack_name, server_address, _token_hash(auth_token), image_mirror)
+    client = _client_pool.get(key)
+    if client is None:
+        client = CachedClient(
+            datastack_name=datastack_name,
+            server_address=server_address,
+            auth_token=auth_token,
+        )
+        if image_mirror is not None:
+            client.info.get_datastack_info(image_mirror=image_mirror)
+        _client_pool.put(key, client)
     return client
 
 
@@ -31,14 +71,25 @@ def make_global_client(
     server_address: str,
     auth_token: Optional[str] = None,
 ):
+    "Get a global-only CAVEclient, reusing a pooled client if possible"
     if len(urlparse(server_address).scheme) == 0:
         server_address = f"https://{server_address}"
-    return CAVEclient(
-        datastack_name=None,
-        server_address=server_address,
-        global_only=True,
-        auth_token=auth_token,
-    )
+    auth_token = _local_token(auth_token)
+    key = (None, server_address, _token_hash(auth_token), None)
+    client = _client_pool.get(key)
+    if client is None:
+        client = CAVEclient(
+            datastack_name=None,
+            server_address=server_address,
+            global_only=True,
+            auth_token=auth_token,
+        )
+        _client_pool.put(key, client)
+    return client
+
+
+def client_pool_info() -> dict:
+    return _client_pool.info()
 
 
 def process_point_string(pt_str):
@@ -78,18 +129,55 @@ def suggest_latest_roots_robust(client, root_id, timestamp=None):
             )
         chunks_orig = client.chunkedgraph.get_leaves(root_id, stop_layer=stop_layer)
 
-    chunk_list = np.array(
-        [
-            len(
-                np.intersect1d(
-                    chunks_orig,
-                    client.chunkedgraph.get_leaves(oid, stop_layer=stop_layer),
-                    assume_unique=True,
+    chunks_orig = np.unique(chunks_orig)
+    overlap = np.full(len(curr_ids), -1, dtype=np.int64)
+
+    # Candidates are disjoint, so their overlaps with the original root sum to at
+    # most len(chunks_orig). Once the best overlap is larger than what is left,
+    # no candidate still being fetched can win. One candidate usually holds most
+    # of the original root, so the first is fetched alone before fanning out.
+    to_fetch = iter(enumerate(curr_ids))
+    pending = {}
+    executor = ThreadPoolExecutor(max_workers=LEAVES_FETCH_WORKERS)
+    try:
+        n_submit = 1
+        while True:
+            for ii, oid in islice(to_fetch, n_submit):
+                future = executor.submit(
+                    client.chunkedgraph.get_leaves, oid, stop_layer=stop_layer
                 )
+                pending[future] = ii
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            done = [(pending.pop(f), f.result()) for f in done]
+            overlap[[ii for ii, _ in done]] = _overlap_counts(
+                chunks_orig, [leaves for _, leaves in done]
             )
-            / len(chunks_orig)
-            for oid in curr_ids
-        ]
-    )
-    order = np.argsort(chunk_list)[::-1]
+            if overlap.max() > len(chunks_orig) - overlap[overlap >= 0].sum():
+                break
+            n_submit = LEAVES_FETCH_WORKERS - len(pending)
+    finally:
+        # Do not wait for fetches that can no longer change the result
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    order = np.argsort(overlap, kind="stable")[::-1]
     return curr_ids[order][0]
+
+
+def _overlap_counts(reference_sorted: np.ndarray, id_lists: list) -> np.ndarray:
+    "Number of ids in each list that are also in the sorted array `reference_sorted`"
+    counts = np.fromiter(
+        (len(x) for x in id_lists), dtype=np.int64, count=len(id_lists)
+    )
+    if len(reference_sorted) == 0 or counts.sum() == 0:
+        return np.zeros(len(id_lists), dtype=np.int64)
+    ids = np.concatenate(
+        [np.asarray(x, dtype=reference_sorted.dtype) for x in id_lists]
+    )
+    pos = np.minimum(np.searchsorted(reference_sorted, ids), len(reference_sorted) - 1)
+    found = reference_sorted[pos] == ids
+    list_of_id = np.repeat(np.arange(len(id_lists)), counts)
+    return np.bincount(list_of_id, weights=found, minlength=len(id_lists)).astype(
+        np.int64
+    )
@@ -1,5 +1,9 @@
+import hashlib
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from itertools import islice
 from typing import Literal, Optional
 
 import caveclient
@@ -7,12 +11,31 @@ import numpy as np
 import pandas as pd
 from meshparty import meshwork, skeleton
 from pcg_skel import chunk_tools
-from scipy import sparse
+from scipy import sparse, spatial
+
+from loguru import logger
+
+from .caching import LRUStore
+from .vertex_table import (
+    VertexTable,
+    VERTEX_POINT,
+    VERTEX_COLUMNS,
+    BRANCH_GROUP_COLUMN,
+    DISTANCE_COLUMN,
+    IS_AXON_COLUMN,
+    PARENT_COLUMN,
+    LVL2_ID_COLUMN,
+    END_POINT_COLUMN,
+    BRANCH_POINT_COLUMN,
+    ROOT_COLUMN,
+    NEW_POINT_COLUMN,
+    NEW_TIMESTAMP_COLUMN,
+    NUM_BRANCH_TO_ROOT_COLUMN,
+    PREORDER_COLUMN,
+    SUBTREE_END_COLUMN,
+    RADIUS_COLUMN,
+)
 
-from ..flask_app.config import logger
-
-VERTEX_POINT = "pt"
-VERTEX_COLUMNS = [f"{VERTEX_POINT}_{suf}" for suf in ["x", "y", "z"]]
 PATH_VERTEX_A_POINT = "pointA"
 PATH_VERTEX_B_POINT = "pointB"
 PATH_VERTEX_COLUMNS = [
@@ -20,113 +43,271 @@ PATH_VERTEX_COLUMNS = [
     for pre in [PATH_VERTEX_A_POINT, PATH_VERTEX_B_POINT]
     for suf in ["x", "y", "z"]
 ]
-BRANCH_GROUP_COLUMN = "branch_group"
-DISTANCE_COLUMN = "distance_to_root"
-IS_AXON_COLUMN = "is_axon"
-PARENT_COLUMN = "parent"
-LVL2_ID_COLUMN = "lvl2_id"
-END_POINT_COLUMN = "is_end"
-BRANCH_POINT_COLUMN = "is_branch"
-ROOT_COLUMN = "is_root"
-NEW_POINT_COLUMN = "is_new_point"
-NEW_TIMESTAMP_COLUMN = "not_in_previous_match"
-NUM_BRANCH_TO_ROOT_COLUMN = "num_bp_to_root"
+DOWNSTREAM_COLUMN = "is_downstream"
 
 RESTRICT_OPTIONS = ["upstream-of", "downstream-of"]
 
+LEAVES_FETCH_WORKERS = int(os.environ.get("TOURGUIDE_LEAVES_FETCH_WORKERS", 8))
+LEAVES_CACHE_BYTES = int(os.environ.get("TOURGUIDE_LEAVES_CACHE_MB", 256)) * 1024**2
 
-def process_meshwork_to_dataframe(
-    nrn: meshwork.Meshwork,
-) -> pd.DataFrame:
-    """Process a meshwork object into a rich vertex dataframe"""
-    verts = nrn.skeleton.vertices.astype(int)
-    is_axon = nrn.anno.is_axon.mesh_index.to_skel_mask
+# Level 2 ids of root ids, keyed by (datastack, root id). The leaves of a root id
+# never change, so entries are only removed to bound the size.
+_leaves_cache = LRUStore(
+    maxsize=LEAVES_CACHE_BYTES,
+    getsizeof=lambda x: x.nbytes,
+    name="lvl2_leaves",
+)
+
+HORIZON_QUANTUM_S = float(os.environ.get("TOURGUIDE_HORIZON_QUANTUM_S", 60))
+PREVIOUS_MATCH_CACHE_BYTES = (
+    int(os.environ.get("TOURGUIDE_PREVIOUS_MATCH_CACHE_MB", 128)) * 1024**2
+)
+
+# Level 2 ids of the best matching past root, keyed by (datastack, root id, quantized horizon)
+_previous_match_cache = LRUStore(
+    maxsize=PREVIOUS_MATCH_CACHE_BYTES,
+    getsizeof=lambda x: x.nbytes,
+    name="previous_match",
+)
 
-    l2df = nrn.anno.lvl2_ids.df
-    l2df["skind"] = nrn.skeleton.mesh_to_skel_map
+# Level 2 id closest to a restriction point, keyed by (datastack, root id, point)
+_restriction_cache = LRUStore(maxsize=4096, name="restriction_lvl2")
+
+# Version of the `process_meshwork_to_vertex_table` output. Bump it whenever columns are
+# added or computed differently, so tables cached on disk by older code are not used.
+VERTEX_TABLE_VERSION = 3
+
+# Restriction points inside the radius of their nearest skeleton vertex, and at most
+# this far from it, snap to it locally instead of looking up their level 2 id
+RESTRICTION_SNAP_DISTANCE_NM = float(
+    os.environ.get("TOURGUIDE_RESTRICTION_SNAP_NM", 500)
+)
+
+
+def process_meshwork_to_vertex_table(
+    nrn: meshwork.Meshwork,
+) -> VertexTable:
+    """Process a meshwork object into a rich vertex table"""
+    sk = nrn.skeleton
+    n_verts = len(sk.vertices)
+    verts = sk.vertices.astype(int)
+
+    # Group level 2 ids by skeleton vertex, keeping their mesh order within each vertex
+    skind = np.asarray(sk.mesh_to_skel_map)
+    l2_order = np.argsort(skind, kind="stable")
+    lvl2_ids = nrn.anno.lvl2_ids.df[LVL2_ID_COLUMN].values[l2_order]
+    lvl2_offsets = np.zeros(n_verts + 1, dtype=np.int64)
+    np.cumsum(np.bincount(skind, minlength=n_verts), out=lvl2_offsets[1:])
+
+    is_end = np.zeros(n_verts, dtype=bool)
+    is_end[sk.end_points] = True
+    is_branch = np.zeros(n_verts, dtype=bool)
+    is_branch[sk.branch_points] = True
+    is_root = np.zeros(n_verts, dtype=bool)
+    is_root[int(sk.root)] = True
+
+    parent = np.asarray(sk.parent_nodes(nrn.skeleton_indices))
+    preorder, subtree_end = euler_tour_index(parent, int(sk.root))
+    if sk.radius is None:
+        # Without radii, restriction points are never snapped to vertices
+        radius = np.zeros(n_verts)
+    else:
+        radius = np.asarray(sk.radius, dtype=float)
 
-    vert_df = pd.DataFrame(
+    vertex_table = VertexTable(
         {
             VERTEX_COLUMNS[0]: verts[:, 0],
             VERTEX_COLUMNS[1]: verts[:, 1],
             VERTEX_COLUMNS[2]: verts[:, 2],
-            IS_AXON_COLUMN: is_axon,
-            PARENT_COLUMN: nrn.skeleton.parent_nodes(nrn.skeleton_indices),
-            DISTANCE_COLUMN: nrn.skeleton.distance_to_root,
+            IS_AXON_COLUMN: np.asarray(nrn.anno.is_axon.mesh_index.to_skel_mask),
+            PARENT_COLUMN: parent,
+            DISTANCE_COLUMN: np.asarray(sk.distance_to_root),
             BRANCH_GROUP_COLUMN: branch_group_label(nrn),
             NUM_BRANCH_TO_ROOT_COLUMN: num_branch_points(nrn),
-            LVL2_ID_COLUMN: l2df.groupby("skind")[LVL2_ID_COLUMN].agg(list),
-        }
+            END_POINT_COLUMN: is_end,
+            BRANCH_POINT_COLUMN: is_branch,
+            ROOT_COLUMN: is_root,
+            PREORDER_COLUMN: preorder,
+            SUBTREE_END_COLUMN: subtree_end,
+            RADIUS_COLUMN: radius,
+        },
+        lvl2_ids=lvl2_ids,
+        lvl2_offsets=lvl2_offsets,
     )
-    vert_df[END_POINT_COLUMN] = False
-    vert_df.loc[nrn.skeleton.end_points, END_POINT_COLUMN] = True
+    logger.debug(f"Processed meshwork to vertex table with root at {int(sk.root)}")
+    return vertex_table
 
-    vert_df[BRANCH_POINT_COLUMN] = False
-    vert_df.loc[nrn.skeleton.branch_points, BRANCH_POINT_COLUMN] = True
 
-    vert_df[ROOT_COLUMN] = False
-    vert_df.loc[int(nrn.skeleton.root), ROOT_COLUMN] = True
-    logger.debug(
-        f"Processed meshwork to dataframe with root at {int(nrn.skeleton.root)}"
+def process_meshwork_to_dataframe(
+    nrn: meshwork.Meshwork,
+) -> pd.DataFrame:
+    """Process a meshwork object into a rich vertex dataframe"""
+    return process_meshwork_to_vertex_table(nrn).to_dataframe()
+
+
+def _child_graph(parent: np.ndarray) -> sparse.csr_matrix:
+    "Directed graph with an edge from each vertex to each of its children"
+    n = len(parent)
+    has_parent = np.flatnonzero(parent >= 0)
+    return sparse.csr_matrix(
+        (np.ones(len(has_parent), dtype=bool), (parent[has_parent], has_parent)),
+        shape=(n, n),
     )
-    return vert_df
+
+
+def _topological_order(parent: np.ndarray, root: int) -> np.ndarray:
+    "Vertex indices ordered so that every parent comes before its children"
+    return sparse.csgraph.breadth_first_order(
+        _child_graph(np.asarray(parent)), root, directed=True, return_predecessors=False
+    )
+
+
+def euler_tour_index(parent: np.ndarray, root: int) -> tuple:
+    """Preorder interval of every vertex's subtree.
+
+    Parameters
+    ----------
+    parent : np.ndarray
+        Parent index of each vertex, with -1 for the root.
+    root : int
+        Index of the root vertex.
+
+    Returns
+    -------
+    preorder : np.ndarray
+        Position of each vertex in a depth-first preorder traversal from the root.
+    subtree_end : np.ndarray
+        End of each vertex's subtree in preorder, so that `v` is downstream of `u`
+        (inclusive) exactly when `preorder[u] <= preorder[v] < subtree_end[u]`.
+    """
+    parent = np.asarray(parent)
+    order = sparse.csgraph.depth_first_order(
+        _child_graph(parent), root, directed=True, return_predecessors=False
+    )
+    preorder = np.empty(len(parent), dtype=np.int64)
+    preorder[order] = np.arange(len(order))
+
+    # Children come after parents in preorder, so a reverse pass accumulates subtree sizes.
+    size = [1] * len(parent)
+    parent_list = parent.tolist()
+    for v in order[:0:-1].tolist():
+        size[parent_list[v]] += size[v]
+    return preorder, preorder + np.array(size, dtype=np.int64)
+
+
+def downstream_mask(
+    vertex_table: VertexTable,
+    vertex_inds,
+    inclusive: bool = True,
+) -> np.ndarray:
+    """Boolean mask of vertices downstream of any of a collection of cut points
+
+    Parameters
+    ----------
+    vertex_table : VertexTable
+        Vertex table following format of `process_meshwork_to_vertex_table` output
+    vertex_inds : int or array-like
+        Row index or indices of the cut points.
+    inclusive : bool, optional
+        If True, the cut points themselves count as downstream. Default is True.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array with one value per vertex.
+    """
+    preorder = vertex_table[PREORDER_COLUMN]
+    vertex_inds = np.atleast_1d(np.asarray(vertex_inds, dtype=np.int64))
+
+    starts = preorder[vertex_inds]
+    if not inclusive:
+        starts = starts + 1
+    ends = vertex_table[SUBTREE_END_COLUMN][vertex_inds]
+
+    # Mark the union of the preorder intervals with a difference array.
+    coverage = np.zeros(int(vertex_table[SUBTREE_END_COLUMN].max()) + 1, dtype=np.int64)
+    np.add.at(coverage, starts, 1)
+    np.add.at(coverage, ends, -1)
+    in_interval = np.cumsum(coverage[:-1]) > 0
+    return in_interval[preorder]
+
+
+def upstream_mask(
+    vertex_table: VertexTable,
+    vertex_inds,
+    inclusive: bool = True,
+) -> np.ndarray:
+    "Boolean mask of vertices not downstream of any of the cut points, including the cut points if inclusive"
+    return ~downstream_mask(vertex_table, vertex_inds, inclusive=not inclusive)
 
 
 def num_branch_points(nrn):
-    n_bp = np.zeros(len(nrn.skeleton.vertices), dtype=int)
-    bp = nrn.skeleton.branch_points
-    for bp, ds_list in zip(bp, nrn.skeleton.downstream_nodes(bp)):
-        n_bp[ds_list] = n_bp[ds_list] + 1
-    return n_bp
+    "Number of branch points between each vertex and the root, inclusive"
+    sk = nrn.skeleton
+    parent = sk.parent_nodes(np.arange(len(sk.vertices)))
+    is_branch = np.zeros(len(sk.vertices), dtype=int)
+    is_branch[sk.branch_points] = 1
+
+    # Each vertex inherits the count of its parent, so a single pass in
+    # topological order replaces one downstream traversal per branch point.
+    n_bp = is_branch.tolist()
+    parent_list = parent.tolist()
+    for v in _topological_order(parent, int(sk.root)).tolist():
+        if parent_list[v] >= 0:
+            n_bp[v] += n_bp[parent_list[v]]
+    return np.array(n_bp, dtype=int)
 
 
 def branch_group_label(nrn, cp_max_thresh=200_000):
     "Label vertices by branch groups around long cover paths."
     sk = nrn.skeleton
     cps = sk.cover_paths
-    cp_lens = [sk.path_length(cp) for cp in cps]
+    # Cover paths run downstream to upstream along single parent links,
+    # so their length is the difference in distance to root of the ends.
+    cp_starts = np.array([cp[0] for cp in cps])
     cp_ends = np.array([cp[-1] for cp in cps])
+    cp_lens = sk.distance_to_root[cp_starts] - sk.distance_to_root[cp_ends]
 
-    # Internal use only
-    cp_df = pd.DataFrame({"cps": cps, "pathlen": cp_lens, "ends": cp_ends})
-    cp_df["root_parent"] = sk.parent_nodes(cp_df["ends"])
-
-    clip = cp_df["pathlen"] > cp_max_thresh
-    cp_df[clip].query("root_parent != -1")
-    clip_points = cp_df[clip].query("root_parent != -1")["ends"]
+    clip = np.logical_and(
+        cp_lens > cp_max_thresh,
+        sk.parent_nodes(cp_ends) != -1,
+    )
+    clip_points = cp_ends[clip]
     extra_clip_points = sk.child_nodes(sk.root)
     all_clip_pts = np.unique(np.concatenate([clip_points, extra_clip_points]))
 
-    _, lbls = sparse.csgraph.connected_components(sk.cut_graph(all_clip_pts))
-    min_dist_label = [np.min(sk.distance_to_root[lbls == l]) for l in np.unique(lbls)]
-    labels_ordered = np.unique(lbls)[np.argsort(min_dist_label)]
+    n_lbls, lbls = sparse.csgraph.connected_components(sk.cut_graph(all_clip_pts))
+    min_dist_label = np.full(n_lbls, np.inf)
+    np.minimum.at(min_dist_label, lbls, sk.distance_to_root)
+    labels_ordered = np.argsort(min_dist_label)
     new_lbls = np.argsort(labels_ordered)[lbls]
     return new_lbls
 
 
-def _skeleton_from_vertex_df(vert_df: pd.DataFrame) -> skeleton.Skeleton:
+def _skeleton_from_vertex_table(vertex_table: VertexTable) -> skeleton.Skeleton:
+    parent = vertex_table[PARENT_COLUMN]
+    has_parent = np.flatnonzero(parent != -1)
     return skeleton.Skeleton(
-        vertices=vert_df[VERTEX_COLUMNS].values,
-        edges=vert_df.query(f"{PARENT_COLUMN}!=-1")[PARENT_COLUMN].reset_index().values,
-        root=int(vert_df.query(ROOT_COLUMN).index[0]),
+        vertices=vertex_table[VERTEX_COLUMNS],
+        edges=np.column_stack([has_parent, parent[has_parent]]),
+        root=int(np.flatnonzero(vertex_table[ROOT_COLUMN])[0]),
     )
 
 
 def add_downstream_column(
-    vert_df: pd.DataFrame,
-    base_lvl2_id: int,
-    downstream_column: str = "is_downstream",
+    vertex_table: VertexTable,
+    base_lvl2_id,
+    downstream_column: str = DOWNSTREAM_COLUMN,
     inclusive: bool = True,
-    sk=None,
-) -> pd.DataFrame:
-    """Add a boolean column to a vertex dataframe indicating if a vertex is upstream of the base vertex
+) -> VertexTable:
+    """Add a boolean column to a vertex table indicating if a vertex is downstream of the base vertex
 
     Parameters
     ----------
-    vert_df : pd.DataFrame
-        Vertex dataframe following format of `process_meshwork_to_dataframe` output
-    base_lvl2_id : int
-        Single l2 id to use as a point to separate upstream/downstream vertices
+    vertex_table : VertexTable
+        Vertex table following format of `process_meshwork_to_vertex_table` output
+    base_lvl2_id : int or list
+        L2 id or ids to use as points to separate upstream/downstream vertices
     downstream_column : str, optional
         Name of new column indicating vertices downstream of the point specified, by default "is_downstream"
     inclusive: bool, optional
@@ -134,44 +315,55 @@ def add_downstream_column(
 
     Returns
     -------
-    pd.DataFrame
-        A dataframe with a boolean column indicating if vertices are downstream of the specified point
+    VertexTable
+        The vertex table with a boolean column indicating if vertices are downstream of the specified point
     """
-    try:
-        l2s_long = vert_df[LVL2_ID_COLUMN].explode()
-        first_skind = l2s_long[l2s_long == base_lvl2_id].index[0]
-    except:
-        raise ValueError(f"Could not find vertex with level 2 id {base_lvl2_id}")
+    base_skinds = vertex_table.vertex_of_lvl2(base_lvl2_id)
+    if np.any(base_skinds < 0):
+        missing = np.atleast_1d(base_lvl2_id)[base_skinds < 0]
+        raise ValueError(f"Could not find vertex with level 2 id {missing[0]}")
 
-    if sk is None:
-        sk = _skeleton_from_vertex_df(vert_df)
+    vertex_table[downstream_column] = downstream_mask(
+        vertex_table, base_skinds, inclusive=inclusive
+    )
+    return vertex_table
 
-    vert_df[downstream_column] = False
-    vert_df.loc[
-        sk.downstream_nodes(first_skind, inclusive=inclusive), downstream_column
-    ] = True
 
-    return vert_df
+def process_new_points(vertex_table: VertexTable, seen_lvl2_ids: list) -> VertexTable:
+    "Check if any l2 id associated with a skeleton vertex is new"
+    vertex_table[NEW_POINT_COLUMN] = ~vertex_table.lvl2_isin(seen_lvl2_ids)
+    return vertex_table
 
 
-def process_new_points(vertex_df: pd.DataFrame, seen_lvl2_ids: list) -> pd.DataFrame:
-    "Check if any l2 id associated with a skeleton vertex is new"
-    vertex_df[NEW_POINT_COLUMN] = True
-    l2seen = vertex_df[LVL2_ID_COLUMN].explode().isin(seen_lvl2_ids)
-    l2seen = l2seen[l2seen].index.unique()
-    vertex_df.loc[l2seen, NEW_POINT_COLUMN] = False
-    return vertex_df
+def get_lvl2_leaves(root_id: int, client: caveclient.CAVEclient) -> np.ndarray:
+    "Level 2 ids of a root id, cached across requests"
+    key = (getattr(client, "datastack_name", None), int(root_id))
+    leaves = _leaves_cache.get(key)
+    if leaves is None:
+        leaves = np.asarray(
+            client.chunkedgraph.get_leaves(root_id, stop_layer=2), dtype=np.int64
+        )
+        # Shared between requests, so it must not be modified
+        leaves.flags.writeable = False
+        _leaves_cache.put(key, leaves)
+    return leaves
 
 
 def get_highest_overlap_lvl2_ids(root_id, timestamp, client):
-    "Get level 2 ids for the past root with the highest overlap with the current root"
+    """Get level 2 ids for the past root with the highest overlap with the current root.
+
+    The newest past root usually wins on its own, so it is fetched first by itself.
+    If it does not, the rest are fetched concurrently, up to `LEAVES_FETCH_WORKERS`
+    at a time, but are scored in order so the search stops at the same root as a
+    sequential scan. Fetches still running at that point are not waited for.
+    """
     if isinstance(timestamp, float):
         timestamp = datetime.fromtimestamp(timestamp)
     id_dict = client.chunkedgraph.get_past_ids(
         root_ids=root_id,
         timestamp_past=timestamp,
     )
-    base_lvl2 = client.chunkedgraph.get_leaves(root_id, stop_layer=2)
+    base_lvl2 = get_lvl2_leaves(root_id, client)
 
     # As a heuristic, we start from the newest of the past roots because
     # it is likely to be a frequently edited object.
@@ -182,38 +374,195 @@ def get_highest_overlap_lvl2_ids(root_id, timestamp, client):
 
     relative_fracs = []
     past_lvl2 = {}
-    for rid in past_ids:
-        past_lvl2[rid] = client.chunkedgraph.get_leaves(rid, stop_layer=2)
-        rel_frac = len(np.intersect1d(base_lvl2, past_lvl2[rid])) / len(base_lvl2)
-        relative_fracs.append(rel_frac)
-        # If the highest value seen is greater than what is left, stop
-        if max(relative_fracs) > 1 - sum(relative_fracs):
-            break
+    to_fetch = iter(past_ids)
+    pending = deque()
+    executor = ThreadPoolExecutor(max_workers=LEAVES_FETCH_WORKERS)
+    try:
+        n_submit = 1
+        while True:
+            for next_rid in islice(to_fetch, n_submit):
+                pending.append(
+                    (next_rid, executor.submit(get_lvl2_leaves, next_rid, client))
+                )
+            if not pending:
+                break
+            rid, future = pending.popleft()
+            past_lvl2[rid] = future.result()
+            rel_frac = len(np.intersect1d(base_lvl2, past_lvl2[rid])) / len(base_lvl2)
+            relative_fracs.append(rel_frac)
+            # If the highest value seen is greater than what is left, stop
+            if max(relative_fracs) > 1 - sum(relative_fracs):
+                break
+            n_submit = LEAVES_FETCH_WORKERS - len(pending)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
 
     highest_past = past_ids[np.argmax(relative_fracs)]
     return past_lvl2[highest_past]
 
 
+def quantize_horizon(horizon_timestamp: float) -> float:
+    "Round a horizon timestamp down to a multiple of `HORIZON_QUANTUM_S` seconds"
+    if HORIZON_QUANTUM_S <= 0:
+        return float(horizon_timestamp)
+    return float(np.floor(horizon_timestamp / HORIZON_QUANTUM_S) * HORIZON_QUANTUM_S)
+
+
+def get_previous_match_lvl2_ids(
+    root_id: int,
+    horizon_timestamp: float,
+    client: caveclient.CAVEclient,
+) -> np.ndarray:
+    """Level 2 ids of the past root that best matches a root id at a horizon timestamp.
+
+    The horizon is quantized with `quantize_horizon` and the result is cached, so
+    filters that only differ in other options do not query the chunkedgraph again.
+    """
+    horizon_timestamp = quantize_horizon(horizon_timestamp)
+    key = (getattr(client, "datastack_name", None), int(root_id), horizon_timestamp)
+    lvl2_ids = _previous_match_cache.get(key)
+    if lvl2_ids is None:
+        lvl2_ids = np.array(
+            get_highest_overlap_lvl2_ids(root_id, horizon_timestamp, client),
+            dtype=np.int64,
+        )
+        lvl2_ids.flags.writeable = False
+        _previous_match_cache.put(key, lvl2_ids)
+    return lvl2_ids
+
+
+def _not_in_previous_match_mask(
+    root_id: int,
+    vertex_table: VertexTable,
+    client: caveclient.CAVEclient,
+    horizon_timestamp: float,
+) -> np.ndarray:
+    l2_previous_match = get_previous_match_lvl2_ids(root_id, horizon_timestamp, client)
+    # A vertex is newer if any of its level 2 ids did not exist in the previous match
+    return vertex_table.any_lvl2(~vertex_table.lvl2_mask(l2_previous_match))
+
+
 def add_timestamp_relative_vertex(
     root_id: int,
-    vertex_df: pd.DataFrame,
+    vertex_table: VertexTable,
     client: caveclient.CAVEclient,
     horizon_timestamp: int,
-) -> pd.DataFrame:
+) -> VertexTable:
     "Add a column indicating True if vertex was not part of the best matching id at a previous timestamp"
-    l2_previous_match = get_highest_overlap_lvl2_ids(root_id, horizon_timestamp, client)
-    not_in_previous = ~vertex_df[LVL2_ID_COLUMN].explode().isin(l2_previous_match)
+    vertex_table[NEW_TIMESTAMP_COLUMN] = _not_in_previous_match_mask(
+        root_id, vertex_table, client, horizon_timestamp
+    )
+    return vertex_table
 
-    # Treat everything as seen, then mark any that existed before as unseen
-    vertex_df[NEW_TIMESTAMP_COLUMN] = False
-    l2_newer_idx = not_in_previous[not_in_previous].index.unique()
-    vertex_df.loc[l2_newer_idx, NEW_TIMESTAMP_COLUMN] = True
-    return vertex_df
 
+def _restriction_lvl2_id(
+    root_id: int,
+    restriction_point: list,
+    client: caveclient.CAVEclient,
+) -> int:
+    "Level 2 id of a root id closest to a point, cached because root ids never change"
+    key = (
+        getattr(client, "datastack_name", None),
+        int(root_id),
+        tuple(int(x) for x in restriction_point),
+    )
+    return _restriction_cache.get_or_compute(
+        key,
+        lambda: chunk_tools.get_closest_lvl2_chunk(
+            point=restriction_point,
+            root_id=root_id,
+            client=client,
+            voxel_resolution=client.info.viewer_resolution(),
+            radius=300,
+        ),
+    )
 
-def filter_dataframe(
+
+def _vertex_kdtree(vertex_table: VertexTable) -> spatial.cKDTree:
+    "Spatial index of the vertex positions of a table, built once per table"
+    return vertex_table.memoize(
+        ("kdtree",), lambda: spatial.cKDTree(vertex_table[VERTEX_COLUMNS])
+    )
+
+
+def _restriction_vertex(
     root_id: int,
-    vertex_df: pd.DataFrame,
+    vertex_table: VertexTable,
+    restriction_point: list,
+    client: caveclient.CAVEclient,
+) -> int:
+    """Row of the vertex a restriction point belongs to.
+
+    The point is snapped to the nearest skeleton vertex if it lies inside that
+    vertex's radius and within `RESTRICTION_SNAP_DISTANCE_NM` of it. Skeleton vertices
+    can be microns apart, so a point farther out may be on a neighbouring branch, and
+    the closest level 2 id of the root id is looked up in the segmentation instead.
+    """
+    point_nm = np.asarray(restriction_point, dtype=float) * np.asarray(
+        client.info.viewer_resolution()
+    )
+    distance, row = _vertex_kdtree(vertex_table).query(point_nm)
+    if RADIUS_COLUMN in vertex_table:
+        snap_distance = min(
+            vertex_table[RADIUS_COLUMN][row], RESTRICTION_SNAP_DISTANCE_NM
+        )
+        if distance <= snap_distance:
+            return int(row)
+    logger.debug(
+        f"Restriction point is {distance:.0f} nm from the skeleton, looking up its level 2 id"
+    )
+    split_lvl2_id = _restriction_lvl2_id(root_id, restriction_point, client)
+    split_row = vertex_table.vertex_of_lvl2(split_lvl2_id)[0]
+    if split_row < 0:
+        raise ValueError(f"Could not find vertex with level 2 id {split_lvl2_id}")
+    return int(split_row)
+
+
+def _filter_key(
+    root_id: int,
+    vertex_df: VertexTable,
+    compartment_filter: Optional[str],
+    restriction_direction: Optional[str],
+    restriction_point: Optional[list],
+    only_new_lvl2: bool,
+    only_after_timestamp: bool,
+    horizon_timestamp: Optional[float],
+    max_branch_to_root: Optional[int],
+    max_distance_to_root: Optional[int],
+) -> tuple:
+    "Memo key for a set of filters, leaving out parameters that do not change the mask"
+    if compartment_filter not in ("axon", "dendrite"):
+        compartment_filter = None
+    if restriction_direction not in RESTRICT_OPTIONS or restriction_point is None:
+        restriction = None
+    else:
+        restriction = (restriction_direction, tuple(int(x) for x in restriction_point))
+    if only_new_lvl2:
+        # The new point column depends on the seen ids, so key on its contents
+        new_points = hashlib.blake2b(
+            np.packbits(vertex_df[NEW_POINT_COLUMN].astype(bool)).tobytes(),
+            digest_size=16,
+        ).hexdigest()
+    else:
+        new_points = None
+    if only_after_timestamp:
+        horizon = quantize_horizon(horizon_timestamp)
+    else:
+        horizon = None
+    return (
+        int(root_id),
+        compartment_filter,
+        restriction,
+        new_points,
+        horizon,
+        max_branch_to_root,
+        max_distance_to_root,
+    )
+
+
+def filter_mask(
+    root_id: int,
+    vertex_df: VertexTable,
     compartment_filter: Literal["axon", "dendrite", "all"] = None,
     restriction_direction: Optional[Literal["downstream-of", "upstream-of"]] = None,
     restriction_point: Optional[list] = None,
@@ -223,134 +572,315 @@ def filter_dataframe(
     max_branch_to_root: Optional[int] = None,
     max_distance_to_root: Optional[int] = None,
     client: Optional[caveclient.CAVEclient] = None,
-    return_filtered: bool = True,
-):
-    qry_str = []
+) -> np.ndarray:
+    """Boolean mask of the vertices that pass every filter.
+
+    The combined mask is memoized on the vertex table by the filter parameters, so the
+    point and path link callbacks share one computation, including the restriction
+    point and timestamp lookups. Each filter is also memoized as a separate sub-mask,
+    so changing one filter only recomputes that sub-mask.
+
+    Parameters
+    ----------
+    root_id : int
+        Root id of the neuron, used for remote lookups.
+    vertex_df : VertexTable
+        Vertex table following format of `process_meshwork_to_vertex_table` output
+    compartment_filter : "axon", "dendrite" or "all", optional
+        Keep only axon or dendrite vertices.
+    restriction_direction : "downstream-of" or "upstream-of", optional
+        Keep vertices on one side of `restriction_point`.
+    restriction_point : list, optional
+        Point in viewer resolution used to split the arbor.
+    only_new_lvl2 : bool, optional
+        Keep only vertices with level 2 ids not previously seen.
+    only_after_timestamp : bool, optional
+        Keep only vertices that were not part of the neuron at `horizon_timestamp`.
+    horizon_timestamp : int, optional
+        Timestamp for `only_after_timestamp`, rounded down to `HORIZON_QUANTUM_S` seconds.
+    max_branch_to_root : int, optional
+        Keep vertices with at most this many branch points to root, inclusive.
+    max_distance_to_root : int, optional
+        Keep vertices at most this far from root, in nm.
+    client : caveclient.CAVEclient, optional
+        Client for the restriction point and timestamp lookups.
+
+    Returns
+    -------
+    np.ndarray
+        Boolean array with one value per vertex.
+    """
+    key = _filter_key(
+        root_id,
+        vertex_df,
+        compartment_filter,
+        restriction_direction,
+        restriction_point,
+        only_new_lvl2,
+        only_after_timestamp,
+        horizon_timestamp,
+        max_branch_to_root,
+        max_distance_to_root,
+    )
+    return vertex_df.memoize(
+        ("filter_mask",) + key,
+        lambda: _compute_filter_mask(
+            root_id,
+            vertex_df,
+            compartment_filter=compartment_filter,
+            restriction_direction=restriction_direction,
+            restriction_point=restriction_point,
+            only_new_lvl2=only_new_lvl2,
+            only_after_timestamp=only_after_timestamp,
+            horizon_timestamp=horizon_timestamp,
+            max_branch_to_root=max_branch_to_root,
+            max_distance_to_root=max_distance_to_root,
+            client=client,
+        ),
+    )
+
+
+def _compute_filter_mask(
+    root_id: int,
+    vertex_df: VertexTable,
+    compartment_filter: Literal["axon", "dendrite", "all"] = None,
+    restriction_direction: Optional[Literal["downstream-of", "upstream-of"]] = None,
+    restriction_point: Optional[list] = None,
+    only_new_lvl2: bool = False,
+    only_after_timestamp: bool = False,
+    horizon_timestamp: Optional[int] = None,
+    max_branch_to_root: Optional[int] = None,
+    max_distance_to_root: Optional[int] = None,
+    client: Optional[caveclient.CAVEclient] = None,
+) -> np.ndarray:
+    vt = vertex_df
+    sub_masks = []
     if compartment_filter == "axon":
-        qry_str.append(f"{IS_AXON_COLUMN} == True")
+        sub_masks.append(
+            vt.memoize(("compartment", "axon"), lambda: vt[IS_AXON_COLUMN].astype(bool))
+        )
     elif compartment_filter == "dendrite":
-        qry_str.append(f"{IS_AXON_COLUMN} == False")
+        sub_masks.append(
+            vt.memoize(
+                ("compartment", "dendrite"), lambda: ~vt[IS_AXON_COLUMN].astype(bool)
+            )
+        )
 
     if max_branch_to_root is not None:
-        qry_str.append(f"{NUM_BRANCH_TO_ROOT_COLUMN} <= {max_branch_to_root}")
+        sub_masks.append(
+            vt.memoize(
+                ("max_branch_to_root", max_branch_to_root),
+                lambda: vt[NUM_BRANCH_TO_ROOT_COLUMN] <= max_branch_to_root,
+            )
+        )
 
     if max_distance_to_root is not None:
-        qry_str.append(f"{DISTANCE_COLUMN} <= {max_distance_to_root}")
+        sub_masks.append(
+            vt.memoize(
+                ("max_distance_to_root", max_distance_to_root),
+                lambda: vt[DISTANCE_COLUMN] <= max_distance_to_root,
+            )
+        )
 
     if restriction_direction in RESTRICT_OPTIONS and restriction_point is not None:
-        split_lvl2_id = chunk_tools.get_closest_lvl2_chunk(
-            point=restriction_point,
-            root_id=root_id,
-            client=client,
-            voxel_resolution=client.info.viewer_resolution(),
-            radius=300,
+        split_skind = np.array(
+            [_restriction_vertex(root_id, vt, restriction_point, client)]
         )
         if restriction_direction == "upstream-of":
-            qry_str.append(f"is_downstream == False")
-            vertex_df = add_downstream_column(
-                vertex_df,
-                split_lvl2_id,
-                inclusive=False,
-                downstream_column="is_downstream",
+            sub_masks.append(
+                vt.memoize(
+                    ("upstream-of", int(split_skind[0])),
+                    lambda: upstream_mask(vt, split_skind, inclusive=True),
+                )
             )
         elif restriction_direction == "downstream-of":
-            qry_str.append(f"is_downstream == True")
-            vertex_df = add_downstream_column(
-                vertex_df,
-                split_lvl2_id,
-                inclusive=True,
-                downstream_column="is_downstream",
+            sub_masks.append(
+                vt.memoize(
+                    ("downstream-of", int(split_skind[0])),
+                    lambda: downstream_mask(vt, split_skind, inclusive=True),
+                )
             )
 
     if only_new_lvl2:
-        qry_str.append("is_new_point == True")
+        # Depends on the seen ids, so it is read from the column rather than memoized
+        sub_masks.append(vt[NEW_POINT_COLUMN].astype(bool))
+
     if only_after_timestamp:
-        vertex_df = add_timestamp_relative_vertex(
-            root_id, vertex_df, client, horizon_timestamp
+        sub_masks.append(
+            vt.memoize(
+                ("after_timestamp", int(root_id), quantize_horizon(horizon_timestamp)),
+                lambda: _not_in_previous_match_mask(
+                    root_id, vt, client, horizon_timestamp
+                ),
+            )
         )
-        qry_str.append(f"{NEW_TIMESTAMP_COLUMN} == True")
-    if len(qry_str) == 0 or not return_filtered:
-        return vertex_df
-    else:
-        return vertex_df.query(" and ".join(qry_str))
+
+    mask = np.ones(len(vt), dtype=bool)
+    for sub_mask in sub_masks:
+        mask &= sub_mask
+    # Shared between callers through the memo, so it must not be modified
+    mask.flags.writeable = False
+    return mask
 
 
-def _make_skeleton_filter(
+def filter_dataframe(
     root_id: int,
-    sk: skeleton.Skeleton,
-    vertex_df: pd.DataFrame,
+    vertex_df: VertexTable,
     compartment_filter: Literal["axon", "dendrite", "all"] = None,
     restriction_direction: Optional[Literal["downstream-of", "upstream-of"]] = None,
     restriction_point: Optional[list] = None,
-    max_branch_to_root: Optional[int] = None,
-    max_distance_to_root: Optional[int] = None,
     only_new_lvl2: bool = False,
     only_after_timestamp: bool = False,
     horizon_timestamp: Optional[int] = None,
+    max_branch_to_root: Optional[int] = None,
+    max_distance_to_root: Optional[int] = None,
     client: Optional[caveclient.CAVEclient] = None,
-) -> tuple:
-    vertex_df = filter_dataframe(
-        root_id,
-        vertex_df,
+) -> VertexTable:
+    """Vertex table restricted to the vertices passing the filters of `filter_mask`.
+
+    Only the mask is memoized. The restricted table is a new copy of the passing rows,
+    or `vertex_df` itself if every vertex passes.
+    """
+    filters = dict(
         compartment_filter=compartment_filter,
         restriction_direction=restriction_direction,
         restriction_point=restriction_point,
-        max_branch_to_root=max_branch_to_root,
-        max_distance_to_root=max_distance_to_root,
         only_new_lvl2=only_new_lvl2,
         only_after_timestamp=only_after_timestamp,
         horizon_timestamp=horizon_timestamp,
-        client=client,
-        return_filtered=False,
+        max_branch_to_root=max_branch_to_root,
+        max_distance_to_root=max_distance_to_root,
     )
+    mask = filter_mask(root_id, vertex_df, client=client, **filters)
+    if mask.all():
+        return vertex_df
+    return vertex_df.take(mask)
 
-    mask = np.ones(len(sk.vertices), dtype=bool)
-    if compartment_filter == "axon":
-        mask &= vertex_df[IS_AXON_COLUMN].values
-    elif compartment_filter == "dendrite":
-        mask &= ~vertex_df[IS_AXON_COLUMN].values
-    if restriction_direction in RESTRICT_OPTIONS and restriction_point is not None:
-        if restriction_direction == "upstream-of":
-            mask &= ~vertex_df["is_downstream"].values
-        elif restriction_direction == "downstream-of":
-            mask &= vertex_df["is_downstream"].values
-    if only_new_lvl2:
-        mask &= vertex_df[NEW_POINT_COLUMN].values
-    if only_after_timestamp:
-        mask &= vertex_df[NEW_TIMESTAMP_COLUMN].values
-    if max_branch_to_root is not None:
-        mask &= vertex_df[NUM_BRANCH_TO_ROOT_COLUMN] <= max_branch_to_root + 1
-    if max_distance_to_root is not None:
-        mask &= vertex_df[DISTANCE_COLUMN] <= max_distance_to_root
-    return mask
 
+def _concatenate_paths(paths: list) -> tuple:
+    "Flat array of the vertices of a list of paths, and the offset of each path in it"
+    lengths = np.fromiter((len(p) for p in paths), dtype=np.int64, count=len(paths))
+    offsets = np.zeros(len(paths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    if len(paths) == 0:
+        return np.zeros(0, dtype=np.int64), offsets
+    return np.concatenate(paths).astype(np.int64), offsets
 
-def _interpolate_path(
-    path,
-    sk,
-    step_size,
-):
-    path = path[::-1]
-    if step_size is None:
-        return sk.vertices[path]
-    ds = sk.distance_to_root[path]
-    ds_interp = np.linspace(
-        ds[0],
-        ds[-1],
-        np.round((ds[-1] - ds[0]) / step_size).astype(int),
+
+def _reverse_paths(flat_paths: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    "Reverse the order of the vertices within each path of a flat path array"
+    lengths = np.diff(offsets)
+    path_id = np.repeat(np.arange(len(lengths)), lengths)
+    pos_in_path = np.arange(len(flat_paths)) - offsets[path_id]
+    return flat_paths[offsets[path_id + 1] - 1 - pos_in_path]
+
+
+def _interpolate_paths(
+    vertices: np.ndarray,
+    distances: np.ndarray,
+    offsets: np.ndarray,
+    step_size: float,
+) -> tuple:
+    """Resample concatenated paths at even steps of distance in one vectorized pass.
+
+    Parameters
+    ----------
+    vertices : np.ndarray
+        Nx3 array of the points of every path, concatenated.
+    distances : np.ndarray
+        Distance to root of each point, non-decreasing within each path.
+    offsets : np.ndarray
+        Start of each path in `vertices`, with the total length as the last entry.
+    step_size : float
+        Distance between resampled points, in the same units as `distances`.
+
+    Returns
+    -------
+    points : np.ndarray
+        Resampled points of every path, concatenated.
+    point_offsets : np.ndarray
+        Start of each path in `points`, with the total length as the last entry.
+    """
+    n_paths = len(offsets) - 1
+    starts = offsets[:-1]
+    ends = offsets[1:] - 1
+    path_of_vertex = np.repeat(np.arange(n_paths), np.diff(offsets))
+
+    d_start = distances[starts]
+    d_range = distances[ends] - d_start
+    n_interp = np.maximum(np.round(d_range / step_size).astype(np.int64), 0)
+    point_offsets = np.zeros(n_paths + 1, dtype=np.int64)
+    np.cumsum(n_interp, out=point_offsets[1:])
+
+    # Evenly spaced distances along each path, matching np.linspace per path
+    path_of_point = np.repeat(np.arange(n_paths), n_interp)
+    step_in_path = np.arange(point_offsets[-1]) - point_offsets[path_of_point]
+    n_steps = np.maximum(n_interp - 1, 1)[path_of_point]
+    d_local = d_range[path_of_point] * (step_in_path / n_steps)
+
+    # Shift each path into its own interval so one sorted search finds the
+    # segment containing every resampled point.
+    shift = 2.0 ** np.ceil(np.log2(d_range.max() + 1)) if n_paths > 0 else 1.0
+    key = distances - d_start[path_of_vertex] + shift * path_of_vertex
+    seg = np.searchsorted(key, d_local + shift * path_of_point, side="right") - 1
+    seg = np.clip(
+        seg, starts[path_of_point], np.maximum(ends - 1, starts)[path_of_point]
+    )
+    del key, path_of_vertex
+
+    d0 = distances[seg] - d_start[path_of_point]
+    dd = distances[seg + 1] - distances[seg]
+    t = np.divide(d_local - d0, dd, out=np.zeros_like(d_local), where=dd > 0)
+    t = np.clip(t, 0, 1)[:, np.newaxis]
+    points = vertices[seg].astype(float)
+    points += t * (vertices[seg + 1] - points)
+    return points, point_offsets
+
+
+def _cover_path_points(
+    sk: skeleton.Skeleton,
+    paths: list,
+    step_size: Optional[float] = None,
+    min_path_length: float = 0,
+) -> tuple:
+    "Concatenated points along every path longer than `min_path_length`, and the offset of each path"
+    flat_paths, offsets = _concatenate_paths(paths)
+    # Paths run from their tip to a parent vertex, so their length is the
+    # difference in distance to root of the two ends.
+    path_length = (
+        sk.distance_to_root[flat_paths[offsets[:-1]]]
+        - sk.distance_to_root[flat_paths[offsets[1:] - 1]]
     )
-    return np.vstack(
-        [
-            np.interp(ds_interp, ds, sk.vertices[path, 0]),
-            np.interp(ds_interp, ds, sk.vertices[path, 1]),
-            np.interp(ds_interp, ds, sk.vertices[path, 2]),
-        ],
-    ).T
+    keep = path_length > min_path_length
+    flat_paths, offsets = _concatenate_paths([p for p, k in zip(paths, keep) if k])
+
+    if step_size:
+        flat_paths = _reverse_paths(flat_paths, offsets)
+        return _interpolate_paths(
+            sk.vertices[flat_paths],
+            sk.distance_to_root[flat_paths],
+            offsets,
+            step_size,
+        )
+    return sk.vertices[flat_paths], offsets
+
+
+def _path_segments(points: np.ndarray, offsets: np.ndarray) -> np.ndarray:
+    "Nx6 array of the start and end points of every segment between consecutive points of a path"
+    is_segment_start = np.ones(len(points), dtype=bool)
+    lengths = np.diff(offsets)
+    is_segment_start[offsets[1:][lengths > 0] - 1] = False
+    segment_starts = np.flatnonzero(is_segment_start)
+
+    segments = np.empty((len(segment_starts), 6), dtype=float)
+    segments[:, :3] = points[segment_starts]
+    segments[:, 3:] = points[segment_starts + 1]
+    return segments
 
 
 def process_paths(
     root_id: int,
-    vertex_df: pd.DataFrame,
+    vertex_df: VertexTable,
     compartment_filter: Literal["axon", "dendrite", "all"] = None,
     restriction_direction: Optional[Literal["downstream-of", "upstream-of"]] = None,
     restriction_point: Optional[list] = None,
@@ -364,10 +894,9 @@ def process_paths(
     min_path_length: Optional[float] = None,
     return_l2_ids: bool = False,
 ):
-    sk = _skeleton_from_vertex_df(vertex_df)
-    mask = _make_skeleton_filter(
+    sk = _skeleton_from_vertex_table(vertex_df)
+    mask = filter_mask(
         root_id,
-        sk,
         vertex_df,
         compartment_filter=compartment_filter,
         restriction_direction=restriction_direction,
@@ -382,43 +911,20 @@ def process_paths(
 
     skm = sk.apply_mask(mask)
     paths = skm.cover_paths_with_parent()
-    path_length = np.array(skm.path_length(paths))
     if min_path_length is None:
         min_path_length = 0
 
-    if step_size:
-        step_size_nm = 1000 * step_size
-        interp_paths = np.vstack(
-            [
-                np.vstack(
-                    [
-                        _interpolate_path(path, skm, step_size_nm),
-                        np.array([np.nan, np.nan, np.nan]).reshape((1, 3)),
-                    ]
-                )
-                for path, pl in zip(paths, path_length)
-                if pl > min_path_length
-            ]
-        )
-    else:
-        interp_paths = np.vstack(
-            [
-                np.vstack(
-                    [
-                        skm.vertices[path],
-                        np.array([np.nan, np.nan, np.nan]).reshape((1, 3)),
-                    ]
-                )
-                for path, pl in zip(paths, path_length)
-                if pl > min_path_length
-            ]
-        )
-
+    points, offsets = _cover_path_points(
+        skm,
+        paths,
+        step_size=1000 * step_size if step_size else None,
+        min_path_length=min_path_length,
+    )
     path_df = pd.DataFrame(
-        np.concatenate([interp_paths[:-1], interp_paths[1:]], axis=1),
+        _path_segments(points, offsets),
         columns=PATH_VERTEX_COLUMNS,
-    ).dropna(axis=0)
+    )
     if return_l2_ids:
-        return path_df, vertex_df[mask][LVL2_ID_COLUMN].explode().values
+        return path_df, vertex_df.lvl2_for(mask)
     else:
         return path_df, None
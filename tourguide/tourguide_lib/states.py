@@ -3,10 +3,13 @@ from nglui.statebuilder import *
 import numpy as np
 import pandas as pd
 from caveclient.frameworkclient import CAVEclientFull as CAVEclient
+import hashlib
+import json
 import os
 
 from ..tourguide_app import utils
 from . import processing
+from .caching import LRUStore
 
 DEFAULT_SEGMENTATION_VIEW_KWS = {
     "selected_alpha": 0.15,
@@ -27,6 +30,12 @@ DEFAULT_NEUROGLANCER_URL = os.environ.get(
     "TOURGUIDE_NEUROGLANCER_URL", "https://spelunker.cave-explorer.org"
 )
 
+SHORT_LINK_CACHE_SIZE = int(os.environ.get("TOURGUIDE_SHORT_LINK_CACHE_SIZE", 1024))
+
+# Shortened links keyed by (server, target site, hash of the state JSON). Uploaded
+# states are immutable, so an identical state can reuse the same link.
+_short_link_cache = LRUStore(maxsize=SHORT_LINK_CACHE_SIZE, name="short_link")
+
 POINT_SORT_ORDER = [
     processing.IS_AXON_COLUMN,
     processing.BRANCH_GROUP_COLUMN,
@@ -53,6 +62,49 @@ def config_ngl(client: CAVEclient, target_url: Optional[str] = None) -> None:
         )
 
 
+def _state_hash(viewer_state: ViewerState) -> str:
+    """Hash of the viewer state JSON with annotation ids removed.
+
+    Annotation ids are random for each state, so they are left out to give identical
+    hashes for states built from the same data.
+    """
+    state = viewer_state.to_dict()
+    state["layers"] = [
+        (
+            {
+                **layer,
+                "annotations": [
+                    {k: v for k, v in anno.items() if k != "id"}
+                    for anno in layer["annotations"]
+                ],
+            }
+            if "annotations" in layer
+            else layer
+        )
+        for layer in state.get("layers", [])
+    ]
+    state_json = json.dumps(
+        state, sort_keys=True, separators=(",", ":"), cls=NumpyEncoder
+    )
+    return hashlib.sha256(state_json.encode()).hexdigest()
+
+
+def shorten_link(viewer_state: ViewerState, client: CAVEclient) -> str:
+    "Upload a viewer state to the link shortener, reusing the link of an identical state"
+    key = (client.server_address, client.datastack_name, _state_hash(viewer_state))
+    url = _short_link_cache.get(key)
+    if url is None:
+        url = viewer_state.to_link_shortener(
+            client=client, target_site=client.datastack_name
+        )
+        _short_link_cache.put(key, url)
+    return url
+
+
+def short_link_cache_info() -> dict:
+    return _short_link_cache.info()
+
+
 def base_layers(
     client: CAVEclient,
     use_skeleton_service: bool,
@@ -80,15 +132,25 @@ def base_layers(
     )
 
 
+def _point_dataframe(
+    vertex_df: processing.VertexTable,
+    point_column: str,
+) -> pd.DataFrame:
+    "Sorted dataframe of the vertices flagged by a boolean column"
+    return (
+        vertex_df.take(vertex_df[point_column])
+        .to_dataframe(include_lvl2=False)
+        .sort_values(by=POINT_SORT_ORDER)
+    )
+
+
 def _add_end_points(
     viewer_state: ViewerState,
-    vertex_df: pd.DataFrame,
+    vertex_df: processing.VertexTable,
     tags: list[str],
 ) -> ViewerState:
     return viewer_state.add_points(
-        data=vertex_df.query(processing.END_POINT_COLUMN).sort_values(
-            by=POINT_SORT_ORDER
-        ),
+        data=_point_dataframe(vertex_df, processing.END_POINT_COLUMN),
         name="end_points",
         point_column=processing.VERTEX_POINT,
         tags=tags,
@@ -100,13 +162,11 @@ def _add_end_points(
 
 def _add_branch_points(
     viewer_state: ViewerState,
-    vertex_df: pd.DataFrame,
+    vertex_df: processing.VertexTable,
     tags: list[str],
 ) -> ViewerState:
     viewer_state.add_points(
-        data=vertex_df.query(processing.BRANCH_POINT_COLUMN).sort_values(
-            by=POINT_SORT_ORDER
-        ),
+        data=_point_dataframe(vertex_df, processing.BRANCH_POINT_COLUMN),
         name="branch_points",
         point_column=processing.VERTEX_POINT,
         tags=tags,
@@ -117,57 +177,93 @@ def _add_branch_points(
     return viewer_state
 
 
-def end_point_link(
+def end_point_state(
     root_id: int,
-    vertex_df: pd.DataFrame,
+    vertex_df: processing.VertexTable,
     client: CAVEclient,
     use_skeleton_service: bool = True,
     tags: Optional[list] = None,
-) -> str:
-    config_ngl(client)
-
+) -> ViewerState:
     viewer_state = base_layers(
         client=client,
         use_skeleton_service=use_skeleton_service,
         root_ids=[root_id],
     )
-    return _add_end_points(
+    viewer_state = _add_end_points(
         viewer_state,
         vertex_df=vertex_df,
         tags=tags or [],
-    ).to_link_shortener(client=client, target_site=client.datastack_name)
+    )
+    return viewer_state
 
 
-def branch_point_link(
+def end_point_link(
     root_id: int,
-    vertex_df: pd.DataFrame,
-    client: str,
+    vertex_df: processing.VertexTable,
+    client: CAVEclient,
     use_skeleton_service: bool = True,
     tags: Optional[list] = None,
 ) -> str:
     config_ngl(client)
+    return shorten_link(
+        end_point_state(
+            root_id=root_id,
+            vertex_df=vertex_df,
+            client=client,
+            use_skeleton_service=use_skeleton_service,
+            tags=tags,
+        ),
+        client,
+    )
+
 
+def branch_point_state(
+    root_id: int,
+    vertex_df: processing.VertexTable,
+    client: str,
+    use_skeleton_service: bool = True,
+    tags: Optional[list] = None,
+) -> ViewerState:
     viewer_state = base_layers(
         client=client,
         use_skeleton_service=use_skeleton_service,
         root_ids=[root_id],
     )
-    return _add_branch_points(
+    viewer_state = _add_branch_points(
         viewer_state,
         vertex_df=vertex_df,
         tags=tags or [],
-    ).to_link_shortener(client=client, target_site=client.datastack_name)
+    )
+    return viewer_state
 
 
-def branch_end_point_link(
+def branch_point_link(
     root_id: int,
-    vertex_df: pd.DataFrame,
+    vertex_df: processing.VertexTable,
     client: str,
     use_skeleton_service: bool = True,
     tags: Optional[list] = None,
 ) -> str:
     config_ngl(client)
+    return shorten_link(
+        branch_point_state(
+            root_id=root_id,
+            vertex_df=vertex_df,
+            client=client,
+            use_skeleton_service=use_skeleton_service,
+            tags=tags,
+        ),
+        client,
+    )
 
+
+def branch_end_point_state(
+    root_id: int,
+    vertex_df: processing.VertexTable,
+    client: str,
+    use_skeleton_service: bool = True,
+    tags: Optional[list] = None,
+) -> ViewerState:
     viewer_state = base_layers(
         client=client,
         use_skeleton_service=use_skeleton_service,
@@ -178,14 +274,35 @@ def branch_end_point_link(
         vertex_df=vertex_df,
         tags=tags or [],
     )
-    return _add_branch_points(
+    viewer_state = _add_branch_points(
         viewer_state,
         vertex_df=vertex_df,
         tags=tags or [],
-    ).to_link_shortener(client=client, target_site=client.datastack_name)
+    )
+    return viewer_state
 
 
-def make_path_link(
+def branch_end_point_link(
+    root_id: int,
+    vertex_df: processing.VertexTable,
+    client: str,
+    use_skeleton_service: bool = True,
+    tags: Optional[list] = None,
+) -> str:
+    config_ngl(client)
+    return shorten_link(
+        branch_end_point_state(
+            root_id=root_id,
+            vertex_df=vertex_df,
+            client=client,
+            use_skeleton_service=use_skeleton_service,
+            tags=tags,
+        ),
+        client,
+    )
+
+
+def path_state(
     client: CAVEclient,
     root_id: int,
     path_df: Optional[pd.DataFrame] = None,
@@ -197,9 +314,7 @@ def make_path_link(
     add_restricted_segmentation_layer: bool = False,
     restricted_color: Optional[Union[tuple, str]] = None,
     tags: Optional[list[str]] = None,
-) -> str:
-    config_ngl(client)
-
+) -> ViewerState:
     if not add_restricted_segmentation_layer:
         root_ids = [root_id]
     else:
@@ -238,7 +353,36 @@ def make_path_link(
             alpha_3d=0.3,
             pick=False,
         )
-    return viewer_state.to_link_shortener(
-        client=client,
-        target_site=client.datastack_name,
+    return viewer_state
+
+
+def make_path_link(
+    client: CAVEclient,
+    root_id: int,
+    path_df: Optional[pd.DataFrame] = None,
+    use_skeleton_service: bool = True,
+    lvl2_ids: Optional[list] = None,
+    mesh_only: bool = False,
+    mesh_color: Optional[Union[tuple, str]] = None,
+    color: Optional[Union[str, tuple]] = None,
+    add_restricted_segmentation_layer: bool = False,
+    restricted_color: Optional[Union[tuple, str]] = None,
+    tags: Optional[list[str]] = None,
+) -> str:
+    config_ngl(client)
+    return shorten_link(
+        path_state(
+            client=client,
+            root_id=root_id,
+            path_df=path_df,
+            use_skeleton_service=use_skeleton_service,
+            lvl2_ids=lvl2_ids,
+            mesh_only=mesh_only,
+            mesh_color=mesh_color,
+            color=color,
+            add_restricted_segmentation_layer=add_restricted_segmentation_layer,
+            restricted_color=restricted_color,
+            tags=tags,
+        ),
+        client,
     )
@@ -0,0 +1,310 @@
+import io
+from typing import Callable, Hashable, Optional, Union
+
+import numpy as np
+import pandas as pd
+
+from .caching import LRUStore
+
+VERTEX_POINT = "pt"
+VERTEX_COLUMNS = [f"{VERTEX_POINT}_{suf}" for suf in ["x", "y", "z"]]
+BRANCH_GROUP_COLUMN = "branch_group"
+DISTANCE_COLUMN = "distance_to_root"
+IS_AXON_COLUMN = "is_axon"
+PARENT_COLUMN = "parent"
+LVL2_ID_COLUMN = "lvl2_id"
+END_POINT_COLUMN = "is_end"
+BRANCH_POINT_COLUMN = "is_branch"
+ROOT_COLUMN = "is_root"
+NEW_POINT_COLUMN = "is_new_point"
+NEW_TIMESTAMP_COLUMN = "not_in_previous_match"
+NUM_BRANCH_TO_ROOT_COLUMN = "num_bp_to_root"
+PREORDER_COLUMN = "preorder"
+SUBTREE_END_COLUMN = "subtree_end"
+RADIUS_COLUMN = "radius"
+
+VERTEX_INDEX_NAME = "skind"
+# Memoized values of a table may use up to this multiple of the memory of its arrays
+MEMO_BYTES_FRACTION = 1.0
+# Approximate memory of one node of a scipy cKDTree, beyond its data and index arrays
+KDTREE_NODE_BYTES = 112
+
+
+def _memo_nbytes(value) -> int:
+    "Approximate memory used by a memoized value"
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if hasattr(value, "data") and hasattr(value, "indices"):
+        # Spatial index, which holds a copy of the points and its own tree nodes
+        return value.data.nbytes + value.indices.nbytes + KDTREE_NODE_BYTES * value.size
+    return getattr(value, "nbytes", 0)
+
+
+class VertexTable:
+    """Columnar table of skeleton vertices backed by typed NumPy arrays.
+
+    Every column is a one-dimensional array with one entry per vertex. Level 2 ids
+    are stored as a single flat array in CSR layout, where the ids of vertex `i`
+    are `lvl2_ids[lvl2_offsets[i]:lvl2_offsets[i+1]]`.
+
+    Parameters
+    ----------
+    columns : dict
+        Mapping of column name to an array with one value per vertex.
+    lvl2_ids : np.ndarray
+        Flat array of level 2 ids, grouped by vertex.
+    lvl2_offsets : np.ndarray
+        Array of length `n_vertices + 1` with the start of each vertex's ids in `lvl2_ids`.
+    index : np.ndarray, optional
+        Skeleton index of each row. Defaults to `0..n_vertices-1` and is kept through `take`.
+    """
+
+    def __init__(
+        self,
+        columns: dict,
+        lvl2_ids: np.ndarray,
+        lvl2_offsets: np.ndarray,
+        index: Optional[np.ndarray] = None,
+    ):
+        self._columns = {k: np.asarray(v) for k, v in columns.items()}
+        self.lvl2_ids = np.asarray(lvl2_ids, dtype=np.int64)
+        self.lvl2_offsets = np.asarray(lvl2_offsets, dtype=np.int64)
+        n = len(self.lvl2_offsets) - 1
+        if index is None:
+            index = np.arange(n)
+        self.index = np.asarray(index, dtype=np.int64)
+        for k, v in self._columns.items():
+            if len(v) != n:
+                raise ValueError(f"Column {k} has {len(v)} rows, expected {n}")
+        # Lazily computed lookup arrays and memoized values, shared with shallow copies
+        self._derived = {}
+        self._memo = LRUStore(
+            maxsize=int(MEMO_BYTES_FRACTION * self.array_nbytes),
+            getsizeof=_memo_nbytes,
+        )
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __contains__(self, column: str) -> bool:
+        return column in self._columns
+
+    def __getitem__(self, column: Union[str, list]) -> np.ndarray:
+        if isinstance(column, list):
+            return np.column_stack([self._columns[c] for c in column])
+        return self._columns[column]
+
+    def __setitem__(self, column: str, values) -> None:
+        values = np.asarray(values)
+        if values.ndim == 0:
+            values = np.full(len(self), values)
+        if len(values) != len(self):
+            raise ValueError(
+                f"Column {column} has {len(values)} rows, expected {len(self)}"
+            )
+        self._columns[column] = values
+
+    def __repr__(self) -> str:
+        return f"VertexTable({len(self)} vertices, {len(self.lvl2_ids)} lvl2 ids, columns={self.columns})"
+
+    @property
+    def columns(self) -> list:
+        return list(self._columns.keys())
+
+    @property
+    def array_nbytes(self) -> int:
+        "Memory used by the columns and level 2 arrays"
+        return (
+            sum(v.nbytes for v in self._columns.values())
+            + self.lvl2_ids.nbytes
+            + self.lvl2_offsets.nbytes
+            + self.index.nbytes
+        )
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the arrays, their level 2 lookups and the memoized values.
+
+        Lookups and memoized values are built after a table is cached, so they are
+        counted at their full size up front: three int64 arrays per level 2 id for
+        the lookups, and the byte budget of the memo.
+        """
+        return self.array_nbytes + 3 * self.lvl2_ids.nbytes + self._memo.maxsize
+
+    def copy(self) -> "VertexTable":
+        """Shallow copy that shares column arrays.
+
+        Columns are replaced rather than modified in place, so adding or overwriting
+        a column on the copy leaves the original table untouched.
+        """
+        vertex_table = VertexTable(
+            dict(self._columns),
+            lvl2_ids=self.lvl2_ids,
+            lvl2_offsets=self.lvl2_offsets,
+            index=self.index,
+        )
+        vertex_table._derived = self._derived
+        vertex_table._memo = self._memo
+        return vertex_table
+
+    def memoize(self, key: Hashable, compute: Callable):
+        """Return `compute()`, cached with this table and its shallow copies under `key`.
+
+        Only use for values that depend on the shared arrays and the key, not on
+        columns that a copy may have replaced.
+        """
+        return self._memo.get_or_compute(key, compute)
+
+    @property
+    def lvl2_counts(self) -> np.ndarray:
+        "Number of level 2 ids for each vertex"
+        return np.diff(self.lvl2_offsets)
+
+    @property
+    def lvl2_vertex(self) -> np.ndarray:
+        "Row of the vertex that owns each entry in `lvl2_ids`"
+        if "lvl2_vertex" not in self._derived:
+            self._derived["lvl2_vertex"] = np.repeat(
+                np.arange(len(self)), self.lvl2_counts
+            )
+        return self._derived["lvl2_vertex"]
+
+    def _lvl2_sorted_index(self) -> tuple:
+        "Sorted level 2 ids and the position of each in `lvl2_ids`, built once per table"
+        if "lvl2_sort" not in self._derived:
+            order = np.argsort(self.lvl2_ids, kind="stable")
+            self._derived["lvl2_sort"] = (self.lvl2_ids[order], order)
+        return self._derived["lvl2_sort"]
+
+    def lvl2_positions(self, lvl2_ids) -> np.ndarray:
+        "Position of each level 2 id in `lvl2_ids`, or -1 if it does not belong to this table"
+        lvl2_ids = np.atleast_1d(np.asarray(lvl2_ids, dtype=np.int64))
+        sorted_ids, order = self._lvl2_sorted_index()
+        if len(sorted_ids) == 0:
+            return np.full(len(lvl2_ids), -1, dtype=np.int64)
+        pos = np.searchsorted(sorted_ids, lvl2_ids)
+        pos_clipped = np.minimum(pos, len(sorted_ids) - 1)
+        found = (pos < len(sorted_ids)) & (sorted_ids[pos_clipped] == lvl2_ids)
+        return np.where(found, order[pos_clipped], -1)
+
+    def vertex_of_lvl2(self, lvl2_ids) -> np.ndarray:
+        "Row of the vertex that owns each level 2 id, or -1 if it does not belong to this table"
+        pos = self.lvl2_positions(lvl2_ids)
+        rows = np.full(len(pos), -1, dtype=np.int64)
+        rows[pos >= 0] = self.lvl2_vertex[pos[pos >= 0]]
+        return rows
+
+    def lvl2_mask(self, lvl2_ids) -> np.ndarray:
+        "Boolean mask over `lvl2_ids` that is True for ids in the given collection"
+        pos = self.lvl2_positions(lvl2_ids)
+        mask = np.zeros(len(self.lvl2_ids), dtype=bool)
+        mask[pos[pos >= 0]] = True
+        return mask
+
+    def any_lvl2(self, lvl2_mask: np.ndarray) -> np.ndarray:
+        "Reduce a boolean mask over `lvl2_ids` to a per-vertex mask that is True if any entry is"
+        mask = np.zeros(len(self), dtype=bool)
+        mask[self.lvl2_vertex[np.asarray(lvl2_mask, dtype=bool)]] = True
+        return mask
+
+    def lvl2_isin(self, lvl2_ids) -> np.ndarray:
+        "Per-vertex mask that is True if any of the vertex's level 2 ids are in `lvl2_ids`"
+        rows = self.vertex_of_lvl2(lvl2_ids)
+        mask = np.zeros(len(self), dtype=bool)
+        mask[rows[rows >= 0]] = True
+        return mask
+
+    def lvl2_for(self, selection=None) -> np.ndarray:
+        "Flat array of the level 2 ids of the selected rows, as a boolean mask or row indices"
+        if selection is None:
+            return self.lvl2_ids
+        return self.take(selection).lvl2_ids
+
+    def _selection_rows(self, selection) -> np.ndarray:
+        selection = np.asarray(selection)
+        if selection.dtype == bool:
+            if len(selection) != len(self):
+                raise ValueError(
+                    f"Mask has {len(selection)} rows, expected {len(self)}"
+                )
+            return np.flatnonzero(selection)
+        return selection.astype(np.int64)
+
+    def take(self, selection) -> "VertexTable":
+        "New table with the rows given by a boolean mask or row indices"
+        rows = self._selection_rows(selection)
+        counts = self.lvl2_counts[rows]
+        new_offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(counts, out=new_offsets[1:])
+        # Position of each new entry in the old flat array: the start of its
+        # vertex's old segment plus its position within the segment.
+        shift = np.repeat(self.lvl2_offsets[:-1][rows] - new_offsets[:-1], counts)
+        lvl2_ids = self.lvl2_ids[np.arange(new_offsets[-1]) + shift]
+        return VertexTable(
+            {k: v[rows] for k, v in self._columns.items()},
+            lvl2_ids=lvl2_ids,
+            lvl2_offsets=new_offsets,
+            index=self.index[rows],
+        )
+
+    def to_dataframe(self, include_lvl2: bool = True) -> pd.DataFrame:
+        "Convert to a pandas dataframe indexed by skeleton index, with level 2 ids as lists"
+        df = pd.DataFrame(
+            self._columns,
+            index=pd.Index(self.index, name=VERTEX_INDEX_NAME),
+        )
+        if include_lvl2:
+            df[LVL2_ID_COLUMN] = [
+                x.tolist() for x in np.split(self.lvl2_ids, self.lvl2_offsets[1:-1])
+            ]
+        return df
+
+    def to_bytes(self, compress: bool = True) -> bytes:
+        """Serialize to npz bytes, with one array per column and level 2 ids as flat ids plus offsets.
+
+        Every array keeps its dtype, so `from_bytes` returns an identical table. The
+        app does not use this format: tables stay on the server, and the disk cache
+        stores separate `.npy` files so that entries can be memory-mapped.
+        """
+        buf = io.BytesIO()
+        save = np.savez_compressed if compress else np.savez
+        save(
+            buf,
+            columns=np.array(self.columns, dtype=str),
+            lvl2_ids=self.lvl2_ids,
+            lvl2_offsets=self.lvl2_offsets,
+            index=self.index,
+            **{f"col_{c}": v for c, v in self._columns.items()},
+        )
+        return buf.getvalue()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "VertexTable":
+        "Build a table from the output of `to_bytes`"
+        with np.load(io.BytesIO(data), allow_pickle=False) as f:
+            return cls(
+                {c: f[f"col_{c}"] for c in f["columns"].tolist()},
+                lvl2_ids=f["lvl2_ids"],
+                lvl2_offsets=f["lvl2_offsets"],
+                index=f["index"],
+            )
+
+    @classmethod
+    def from_dataframe(cls, df: pd.DataFrame) -> "VertexTable":
+        "Build a table from a dataframe whose level 2 id column holds lists"
+        lvl2_lists = df[LVL2_ID_COLUMN].values
+        counts = np.fromiter((len(x) for x in lvl2_lists), dtype=np.int64)
+        offsets = np.zeros(len(df) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        if offsets[-1] > 0:
+            lvl2_ids = np.concatenate(
+                [np.asarray(x, dtype=np.int64) for x in lvl2_lists]
+            )
+        else:
+            lvl2_ids = np.zeros(0, dtype=np.int64)
+        return cls(
+            {c: df[c].values for c in df.columns if c != LVL2_ID_COLUMN},
+            lvl2_ids=lvl2_ids,
+            lvl2_offsets=offsets,
+            index=df.index.values,
+        )